@@ -24,7 +24,9 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import hashlib, sys
+import errno, fcntl, hashlib, io, mmap, multiprocessing, os, shutil, sys, tempfile, threading
+import Queue, six
+from .filesystem import ProgressReporter, try_makedirs, walk
 
 if sys.version_info[0] < 3:
     def to_bytes(string):
@@ -56,3 +58,288 @@ def githash(data):
     s.update(to_bytes(u'blob {0}\0'.format(len(data))))
     s.update(to_bytes(data))
     return s.hexdigest()
+
+
+def githash_file(path, chunk_size=1024*1024, use_mmap=False):
+    u"""
+    Return the blob of a file without loading it in memory, the file is read by chunks or mapped with ``use_mmap``.
+
+    **Example usage**
+
+    >>> with io.open(u'/tmp/githash_file', u'wb') as f:
+    ...     a = f.write(b'give me some hash please')
+    >>> print(githash_file(u'/tmp/githash_file', chunk_size=5))
+    abdd1818289725c072eff0f5ce185457679650be
+    >>> print(githash_file(u'/tmp/githash_file', use_mmap=True))
+    abdd1818289725c072eff0f5ce185457679650be
+    >>> os.remove(u'/tmp/githash_file')
+    """
+    return hash_file(path, (u'githash', ), chunk_size=chunk_size, use_mmap=use_mmap)[u'githash']
+
+
+def hash_file(path, algorithms=(u'sha1', ), callback=None, ratio_delta=0.01, time_delta=1, chunk_size=1024*1024,
+              use_mmap=True, progress=None):
+    u"""
+    Return a dictionary with the hexadecimal digests of a file, computed with all ``algorithms`` in a single pass.
+
+    Any algorithm of :mod:`hashlib` is available, plus *githash* (see :func:`githash`). The file is mapped in memory
+    with ``use_mmap`` (or read by chunks into a pre-allocated buffer) and never loaded at once. Given ``callback``
+    would be called with *start_date*, *elapsed_time*, *eta_time*, *file_size*, *hashed_size* and *ratio*, like the
+    callback of :func:`pytoolbox.filesystem.recursive_copy`. The ``progress`` argument is used by :func:`hash_files`.
+
+    **Example usage**
+
+    >>> with io.open(u'/tmp/hash_file', u'wb') as f:
+    ...     a = f.write(b'give me some hash please' * 1000)
+    >>> digests = hash_file(u'/tmp/hash_file', (u'md5', u'sha1', u'sha256', u'githash'), chunk_size=1000)
+    >>> print(digests[u'md5'] == hashlib.md5(b'give me some hash please' * 1000).hexdigest())
+    True
+    >>> print(digests[u'githash'] == githash(b'give me some hash please' * 1000))
+    True
+    >>> ratios = []
+    >>> digests == hash_file(u'/tmp/hash_file', (u'md5', u'sha1', u'sha256', u'githash'), time_delta=0,
+    ...                      callback=lambda *args: ratios.append(args[5]), chunk_size=1000, use_mmap=False)
+    True
+    >>> print(len(ratios), ratios[-1])
+    24 1.0
+    >>> os.remove(u'/tmp/hash_file')
+    """
+    with io.open(path, u'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        hashers = {}
+        for algorithm in algorithms:
+            if algorithm == u'githash':
+                hashers[algorithm] = hashlib.sha1(to_bytes(u'blob {0}\0'.format(size)))
+            else:
+                hashers[algorithm] = hashlib.new(algorithm)
+        hashers = hashers.items()
+        progress = progress or ProgressReporter(callback, size, ratio_delta=ratio_delta, time_delta=time_delta)
+        if use_mmap and size > 0:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            chunk = view = None
+            try:
+                try:
+                    view = memoryview(mapping)  # Zero-copy slices (Python 3)
+                except TypeError:
+                    view = mapping
+                for offset in xrange(0, size, chunk_size):
+                    chunk = view[offset:offset + chunk_size]
+                    for algorithm, hasher in hashers:
+                        hasher.update(chunk)
+                    progress.add(len(chunk))
+            finally:
+                chunk = view = None  # Release the exported buffers before closing the mapping
+                mapping.close()
+        else:
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
+            while True:
+                length = f.readinto(buf)
+                if not length:
+                    break
+                for algorithm, hasher in hashers:
+                    hasher.update(view[:length])
+                progress.add(length)
+    return dict((algorithm, hasher.hexdigest()) for algorithm, hasher in hashers)
+
+
+def hash_files(paths, algorithms=(u'sha1', ), callback=None, ratio_delta=0.01, time_delta=1, workers=4,
+               chunk_size=1024*1024, use_mmap=True):
+    u"""
+    Return a dictionary with the path and digests of many files, hashed by a pool of ``workers`` threads (the
+    functions of :mod:`hashlib` release the GIL). See :func:`hash_file`, the progress is aggregated for all the files.
+
+    **Example usage**
+
+    >>> paths = [u'/tmp/hash_files_{0}'.format(i) for i in range(5)]
+    >>> for i, path in enumerate(paths):
+    ...     with io.open(path, u'wb') as f:
+    ...         a = f.write(b'x' * 1000 * i)
+    >>> sizes = []
+    >>> digests = hash_files(paths, (u'sha1', u'githash'), lambda *args: sizes.append(args[3:5]), time_delta=0)
+    >>> print(sizes[-1], digests[paths[0]][u'githash'])
+    (10000, 10000) e69de29bb2d1d6434b8b29ae775ad8c2e48c5391
+    >>> all(digests[path] == hash_file(path, (u'sha1', u'githash')) for path in paths)
+    True
+    >>> for path in paths:
+    ...     os.remove(path)
+    """
+    tasks, digests, errors = Queue.Queue(), {}, []
+    paths = list(paths)
+    for path in paths:
+        tasks.put(path)
+    progress = ProgressReporter(callback, sum(os.stat(p).st_size for p in paths), ratio_delta=ratio_delta,
+                                time_delta=time_delta)
+
+    def worker():
+        while not errors:
+            try:
+                path = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                digests[path] = hash_file(path, algorithms, chunk_size=chunk_size, use_mmap=use_mmap,
+                                          progress=progress)
+            except BaseException:
+                errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker) for i in xrange(min(workers, len(paths)) - 1)]
+    for thread in threads:
+        thread.start()
+    worker()  # The current thread is also a worker
+    for thread in threads:
+        thread.join()
+    if errors:
+        six.reraise(*errors[0])
+    return digests
+
+
+def githash_tree(path, processes=None, use_mmap=False):
+    u"""
+    Return a dictionary with the path and blob of every file of the directory tree ``path``.
+
+    The files are hashed in parallel by a pool of ``processes`` (default is the number of CPUs), set it to 1 to hash the
+    files in the current process.
+
+    **Example usage**
+
+    >>> for name, data in ((u'a', b''), (u'b/c', b'give me some hash please')):
+    ...     a = try_makedirs(os.path.dirname(os.path.join(u'/tmp/githash_tree', name)))
+    ...     with io.open(os.path.join(u'/tmp/githash_tree', name), u'wb') as f:
+    ...         a = f.write(data)
+    >>> hashes = githash_tree(u'/tmp/githash_tree', processes=2)
+    >>> for filename in sorted(hashes):
+    ...     print(filename, hashes[filename])
+    /tmp/githash_tree/a e69de29bb2d1d6434b8b29ae775ad8c2e48c5391
+    /tmp/githash_tree/b/c abdd1818289725c072eff0f5ce185457679650be
+    >>> hashes == githash_tree(u'/tmp/githash_tree', processes=1)
+    True
+    >>> shutil.rmtree(u'/tmp/githash_tree')
+    """
+    paths = [os.path.join(root, filename) for root, dirnames, files in walk(path) for filename, stat in files]
+    if processes == 1:
+        return dict((p, githash_file(p, use_mmap=use_mmap)) for p in paths)
+    pool = multiprocessing.Pool(processes)
+    try:
+        hashes = pool.map(_githash_file_mmap if use_mmap else githash_file, paths, chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(paths, hashes))
+
+
+def _githash_file_mmap(path):
+    return githash_file(path, use_mmap=True)
+
+
+FICLONE = 0x40049409  # ioctl to share the extents of a file with another (reflink), see ioctl_ficlone(2)
+
+
+class ContentStore(object):
+    u"""
+    A content-addressed store of files keyed by their blob (see :func:`githash_file`).
+
+    Identical files are stored only once, as ``root/<2 first characters of the blob>/<rest of the blob>``, and are
+    made read-only. Files are copied into the store, or hard-linked if ``link`` is set (the source file then shares
+    the inode of the blob and becomes read-only too). Files are never hard-linked out of the store, :meth:`get` makes
+    a copy (a reflink if supported by the file-system) so modifying it cannot corrupt the store.
+
+    **Example usage**
+
+    >>> with io.open(u'/tmp/content_asset', u'wb') as f:
+    ...     a = f.write(b'give me some hash please')
+    >>> store = ContentStore(u'/tmp/content_store')
+    >>> key = store.put(u'/tmp/content_asset')
+    >>> print(key, store.exists(key), store.put(u'/tmp/content_asset') == key)
+    abdd1818289725c072eff0f5ce185457679650be True True
+    >>> print(store.get(key))
+    /tmp/content_store/ab/dd1818289725c072eff0f5ce185457679650be
+    >>> os.stat(store.get(key)).st_mode & 0o777 == 0o444
+    True
+    >>> print(store.get(key, u'/tmp/content_copy'), githash_file(u'/tmp/content_copy') == key)
+    /tmp/content_copy True
+    >>> os.stat(u'/tmp/content_copy').st_ino == os.stat(store.get(key)).st_ino
+    False
+    >>> print(store.exists(u'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391'))
+    False
+    >>> store.get(u'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391')
+    Traceback (most recent call last):
+        ...
+    KeyError: u'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391'
+    >>> shutil.rmtree(u'/tmp/content_store')
+    >>> os.remove(u'/tmp/content_asset')
+    >>> os.remove(u'/tmp/content_copy')
+    """
+
+    def __init__(self, root, link=False):
+        self.root = root
+        self.link = link
+        try_makedirs(root)
+
+    def path(self, key):
+        u"""Return the path of the file with given blob ``key`` in the store."""
+        return os.path.join(self.root, key[:2], key[2:])
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key, destination=None):
+        u"""Return the path of the (read-only) file with given blob ``key``, or of its copy ``destination`` if set."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            raise KeyError(key)
+        if destination is None:
+            return path
+        self._copy(path, destination)
+        return destination
+
+    def put(self, path, key=None):
+        u"""Add a file to the store (if not already stored) and return its blob. The ``key`` is computed if not set."""
+        key = key or githash_file(path)
+        store_path = self.path(key)
+        if os.path.exists(store_path):
+            return key
+        try_makedirs(os.path.dirname(store_path))
+        try:
+            linked = self._link(path, store_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return key  # Another process stored the same content
+        if linked:
+            os.chmod(store_path, 0o444)
+        else:
+            # Copy to a temporary file then rename it to never expose an incomplete file
+            fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(store_path))
+            try:
+                os.close(fd)
+                self._copy(path, temporary_path)
+                os.chmod(temporary_path, 0o444)
+                os.rename(temporary_path, store_path)
+            except:
+                os.remove(temporary_path)
+                raise
+        return key
+
+    def _copy(self, source, destination):
+        u"""Copy the content of ``source`` to ``destination`` by using a reflink if supported, else a byte copy."""
+        try:
+            with open(source, u'rb') as src_file:
+                with open(destination, u'wb') as dst_file:
+                    fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                raise
+            shutil.copyfile(source, destination)
+
+    def _link(self, source, destination):
+        u"""Hard-link ``source`` to ``destination`` and return True, or False if disabled or not possible."""
+        if not self.link:
+            return False
+        try:
+            os.link(source, destination)
+            return True
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                return False
+            raise
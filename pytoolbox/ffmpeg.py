@@ -24,14 +24,18 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import os, re, select, shlex, time
+import errno, hashlib, io, json, multiprocessing, os, re, shlex, shutil, sys, tempfile, threading, time, uuid
+import Queue, six
 from subprocess import Popen, PIPE
-from xml.dom import minidom
 from .datetime import datetime_now, total_seconds
 from .encoding import to_bytes
-from .filesystem import get_size
-from .subprocess import make_async
+from .filesystem import get_size, try_makedirs
+from .subprocess import cmd, cmd_async, OutputCapture
 
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 
 AUDIO_TRACKS_REGEX = re.compile(
     ur'Stream #(?P<track>\d+.\d+)\s*\S+ Audio:\s+(?P<codec>[^,]+),\s+(?P<sample_rate>\d+) Hz,\s+'
@@ -41,19 +45,44 @@ VIDEO_TRACKS_REGEX = re.compile(
     ur'Stream #(?P<track>\d+.\d+)\s*\S+ Video:\s+(?P<codec>[^,]+),\s+(?P<colorimetry>[^,]+),\s+'
     ur'(?P<size>[^,]+),\s+(?P<bitrate>[^,]+/s),\s+(?P<framerate>\S+)\s+fps,')
 
-DURATION_REGEX = re.compile(r'PT(?P<hours>\d+)H(?P<minutes>\d+)M(?P<seconds>[^S]+)S')
+DURATION_REGEX = re.compile(
+    r'P(?:(?P<days>\d+)D)?T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>[\d.]+)S)?')
 
 # frame= 2071 fps=  0 q=-1.0 size=   34623kB time=00:01:25.89 bitrate=3302.3kbits/s
 ENCODING_REGEX = re.compile(
-    r'frame=\s*(?P<frame>\d+)\s+fps=\s*(?P<fps>\d+)\s+q=\s*(?P<q>\S+)\s+\S*size=\s*(?P<size>\S+)\s+'
+    r'frame=\s*(?P<frame>\d+)\s+fps=\s*(?P<fps>[\d.]+)\s+q=\s*(?P<q>\S+)\s+\S*size=\s*(?P<size>\S+)\s+'
     r'time=\s*(?P<time>\S+)\s+bitrate=\s*(?P<bitrate>\S+)')
 
+FFPROBE_COMMAND = u'ffprobe -v error -print_format json -show_format -show_streams "{0}"'
+
+KEYFRAMES_COMMAND = u'ffprobe -v error -select_streams v:0 -show_entries packet=pts_time,flags -of csv=p=0 "{0}"'
+
+PROGRESS_OPTIONS = u'-nostats -progress pipe:1'
+
 MPD_TEST = u"""<?xml version="1.0"?>
 <MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT0H6M7.83S">
   <useless text="testing encoding : ça va ou bien ?" />
 </MPD>
 """
 
+MPD_TIMELINE_TEST = u"""<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="dynamic" mediaPresentationDuration="PT1H2.5S">
+  <Period id="1" start="PT0S">
+    <AdaptationSet mimeType="video/mp4">
+      <Representation id="video" bandwidth="2500000">
+        <SegmentTemplate timescale="1000" media="video_$Time$.m4s">
+          <SegmentTimeline>
+            <S t="0" d="2000" r="1" />
+            <S d="1500" />
+          </SegmentTimeline>
+        </SegmentTemplate>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" />
+  </Period>
+</MPD>
+"""
+
 TEST_VECTOR = u"""
 ffmpeg version N-54336-g38f1d56 Copyright (c) 2000-2013 the FFmpeg developers
   built on Jul  1 2013 15:15:08 with gcc 4.7 (Ubuntu/Linaro 4.7.3-1ubuntu1)
@@ -85,13 +114,401 @@ Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'test.m4a':
 At least one output file must be specified
 """
 
-def get_media_duration(filename):
+def duration2str(seconds):
+    u"""
+    Return the duration formatted the way *ffmpeg* does.
+
+    **Example usage**
+
+    >>> print(duration2str(226.01))
+    00:03:46.01
+    >>> print(duration2str(u'6337.62'))
+    01:45:37.62
+    """
+    seconds = float(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return u'{0:02d}:{1:02d}:{2:05.2f}'.format(int(hours), int(minutes), seconds)
+
+
+def _bitrate(value):
+    return u'{0} kb/s'.format(int(value) // 1000) if value else None
+
+
+def _framerate(value):
+    try:
+        numerator, denominator = value.split(u'/')
+        return u'{0:g}'.format(round(int(numerator) / int(denominator), 2))
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_ffprobe(data):
+    u"""
+    Return the duration and the tracks of a media from the output of *ffprobe* (JSON).
+
+    The tracks are described the same way :func:`parse_ffmpeg` does by parsing the output of ``ffmpeg -i``.
+
+    **Example usage**
+
+    >>> from pprint import pprint
+    >>> infos = parse_ffprobe(u'''{
+    ...     "streams": [
+    ...         {"index": 0, "codec_type": "video", "codec_name": "h264", "profile": "High", "pix_fmt": "yuv420p",
+    ...          "width": 1280, "height": 720, "sample_aspect_ratio": "1:1", "display_aspect_ratio": "16:9",
+    ...          "bit_rate": "2504000", "avg_frame_rate": "30000/1001"},
+    ...         {"index": 1, "codec_type": "audio", "codec_name": "aac", "sample_rate": "44100", "channels": 2,
+    ...          "channel_layout": "stereo", "bits_per_sample": 16, "bit_rate": "155000"}
+    ...     ],
+    ...     "format": {"duration": "164.880000", "bit_rate": "2660000"}
+    ... }''')
+    >>> print(infos[u'duration'])
+    00:02:44.88
+    >>> pprint(infos[u'video'][u'0.0'])
+    {u'bitrate': u'2504 kb/s',
+     u'codec': u'h264 (High)',
+     u'colorimetry': u'yuv420p',
+     u'estimated_frames': 4941,
+     u'framerate': u'29.97',
+     u'size': u'1280x720 [PAR 1:1 DAR 16:9]'}
+    >>> pprint(infos[u'audio'][u'0.1'])
+    {u'bit_depth': u'16',
+     u'bitrate': u'155 kb/s',
+     u'channels': u'stereo',
+     u'codec': u'aac',
+     u'sample_rate': u'44100'}
+    """
+    data = json.loads(data)
+    try:
+        duration_secs = float(data[u'format'][u'duration'])
+        duration = duration2str(duration_secs)
+    except (KeyError, ValueError):
+        duration_secs, duration = 0, None
+    audio, video = {}, {}
+    for stream in data.get(u'streams', []):
+        track, codec_type = u'0.{0}'.format(stream.get(u'index')), stream.get(u'codec_type')
+        if codec_type == u'audio':
+            bit_depth = stream.get(u'bits_per_raw_sample') or stream.get(u'bits_per_sample')
+            audio[track] = {
+                u'codec': stream.get(u'codec_name'),
+                u'sample_rate': stream.get(u'sample_rate'),
+                u'channels': stream.get(u'channel_layout') or unicode(stream.get(u'channels')),
+                u'bit_depth': unicode(bit_depth) if bit_depth else None,
+                u'bitrate': _bitrate(stream.get(u'bit_rate'))
+            }
+        elif codec_type == u'video':
+            framerate = _framerate(stream.get(u'avg_frame_rate')) or _framerate(stream.get(u'r_frame_rate'))
+            codec, size = stream.get(u'codec_name'), u'{0}x{1}'.format(stream.get(u'width'), stream.get(u'height'))
+            if stream.get(u'profile'):
+                codec = u'{0} ({1})'.format(codec, stream[u'profile'])
+            if stream.get(u'sample_aspect_ratio') and stream.get(u'display_aspect_ratio'):
+                size = u'{0} [PAR {1} DAR {2}]'.format(size, stream[u'sample_aspect_ratio'],
+                                                        stream[u'display_aspect_ratio'])
+            video[track] = {
+                u'codec': codec,
+                u'colorimetry': stream.get(u'pix_fmt'),
+                u'size': size,
+                u'bitrate': _bitrate(stream.get(u'bit_rate')),
+                u'framerate': framerate,
+                u'estimated_frames': int(float(framerate) * duration_secs) if framerate else None
+            }
+    return {u'duration': duration, u'audio': audio, u'video': video}
+
+
+def parse_ffmpeg(output):
+    u"""
+    Return the duration and the tracks of a media from the output of ``ffmpeg -i`` (fallback if no *ffprobe*).
+
+    **Example usage**
+
+    >>> infos = parse_ffmpeg(u'''
+    ...   Duration: 00:02:44.88, start: 0.000000, bitrate: 2660 kb/s
+    ...     Stream #0:0(und): Video: h264 (High), yuv420p, 1280x720 [PAR 1:1 DAR 16:9], 2504 kb/s, 29.97 fps, 30 tbr
+    ...     Stream #0:1(und): Audio: aac, 44100 Hz, stereo, s16, 155 kb/s''')
+    >>> print(infos[u'duration'], sorted(infos[u'video']), sorted(infos[u'audio']))
+    00:02:44.88 [u'0.0'] [u'0.1']
+    >>> print(infos[u'video'][u'0.0'][u'codec'], infos[u'video'][u'0.0'][u'size'])
+    h264 (High) 1280x720 [PAR 1:1 DAR 16:9]
+    """
+    match = re.search(ur'Duration: (?P<duration>\S+),', output)
+    duration = match.group(u'duration') if match else None
+    # ffmpeg may return this so strange value, 00:00:00.04, let it being None
+    duration = duration if duration and duration != u'00:00:00.04' else None
+    duration_secs = total_seconds(duration) if duration else 0
+    audio, video = {}, {}
+    for match in AUDIO_TRACKS_REGEX.finditer(output):
+        group = match.groupdict()
+        track = group.pop(u'track').replace(u':', u'.')  # Stream #0:1 with recent versions of ffmpeg
+        audio[track] = group
+    for match in VIDEO_TRACKS_REGEX.finditer(output):
+        group = match.groupdict()
+        track = group.pop(u'track').replace(u':', u'.')
+        group[u'estimated_frames'] = int(float(group[u'framerate']) * duration_secs)
+        video[track] = group
+    return {u'duration': duration, u'audio': audio, u'video': video}
+
+
+class ProbeCache(object):
+    u"""
+    A persistent cache of the results of :func:`probe`, keyed by the (path, size, mtime) of the media.
+
+    The entries are stored as small JSON files in ``directory`` (sharded by the first two characters of the key) and
+    kept in memory once read. Any modification of a media (size or mtime) makes its entry stale. Set ``directory`` to
+    None to only keep the results in memory.
+
+    **Example usage**
+
+    >>> from nose.tools import assert_equal
+    >>> import shutil
+    >>> with io.open(u'/tmp/probe_cache.mp4', u'wb') as f:
+    ...     a = f.write(b'not a real media')
+    >>> cache = ProbeCache(u'/tmp/probe_cache')
+    >>> print(cache.get(u'/tmp/probe_cache.mp4'))
+    None
+    >>> cache.set(u'/tmp/probe_cache.mp4', {u'duration': u'00:00:10.00', u'audio': {}, u'video': {}})
+    >>> assert_equal(ProbeCache(u'/tmp/probe_cache').get(u'/tmp/probe_cache.mp4')[u'duration'], u'00:00:10.00')
+
+    The entry is stale once the media is modified:
+
+    >>> with io.open(u'/tmp/probe_cache.mp4', u'ab') as f:
+    ...     a = f.write(b'!')
+    >>> print(cache.get(u'/tmp/probe_cache.mp4'))
+    None
+    >>> os.remove(u'/tmp/probe_cache.mp4')
+    >>> shutil.rmtree(u'/tmp/probe_cache')
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(filename, stat=None):
+        stat = stat or os.stat(filename)
+        return [os.path.abspath(filename), stat.st_size, stat.st_mtime]
+
+    def path(self, signature):
+        path = signature[0]
+        key = hashlib.sha1(path.encode(u'utf-8') if isinstance(path, unicode) else path).hexdigest()
+        return os.path.join(self.directory, key[:2], u'{0}.json'.format(key[2:]))
+
+    def get(self, filename, stat=None, default=None):
+        u"""Return the cached result of probing ``filename`` or ``default`` if missing or stale."""
+        signature = self.signature(filename, stat)
+        with self._lock:
+            entry = self.entries.get(signature[0])
+        if entry is None and self.directory:
+            try:
+                with io.open(self.path(signature), u'r', encoding=u'utf-8') as f:
+                    entry = json.loads(f.read())
+            except (IOError, ValueError):  # Missing or corrupted entry
+                return default
+            with self._lock:
+                self.entries[signature[0]] = entry
+        if entry is None or entry[u'signature'] != signature:
+            return default
+        return entry[u'result']
+
+    def set(self, filename, result, stat=None):
+        u"""Cache the result of probing ``filename``, ``stat`` should be retrieved before the probe."""
+        from .serialization import WriteTransaction
+        signature = self.signature(filename, stat)
+        entry = {u'signature': signature, u'result': result}
+        with self._lock:
+            self.entries[signature[0]] = entry
+        if self.directory:
+            path = self.path(signature)
+            try_makedirs(os.path.dirname(path))
+            # Atomic rename but no fsync, a cache entry lost by a crash is only probed again
+            with WriteTransaction(fsync=False) as transaction:
+                transaction.write(path, data=json.dumps(entry))
+
+
+def probe(filename, cache=None):
+    u"""
+    Return the duration and the tracks of a media (see :func:`get_media_tracks`) or None if it cannot be analysed.
+
+    The media is analysed by a single run of *ffprobe* (or ``ffmpeg -i`` if *ffprobe* is not available). The result is
+    retrieved from the ``cache`` (a :class:`ProbeCache`) if the media was already analysed and is unchanged.
+
+    **Example usage**
+
+    >>> print(probe(u'/tmp/this_media_does_not_exist.mp4'))
+    None
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.ENOTDIR):
+            return None
+        raise
+    missing = object()
+    if cache is not None:
+        result = cache.get(filename, stat, default=missing)
+        if result is not missing:
+            return result
+    try:
+        process = Popen(shlex.split(to_bytes(FFPROBE_COMMAND.format(filename))), stdout=PIPE, stderr=PIPE,
+                        close_fds=True)
+        stdout, stderr = process.communicate()
+        result = parse_ffprobe(stdout.decode(u'utf-8')) if process.returncode == 0 else None
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        process = Popen(shlex.split(to_bytes(u'ffmpeg -i "{0}"'.format(filename))), stderr=PIPE, close_fds=True)
+        result = parse_ffmpeg(process.communicate()[1].decode(u'utf-8', u'replace'))
+    if result is not None and not result[u'duration']:
+        result = None
+    if cache is not None:
+        cache.set(filename, result, stat)
+    return result
+
+
+def probe_many(filenames, concurrency=multiprocessing.cpu_count(), cache=None):
+    u"""
+    Probe the medias with up to ``concurrency`` running processes and yields a tuple (filename, result, error) for each
+    media as soon as it is analysed. The error is the exception raised by :func:`probe` (the result is then None). The
+    result of a missing media is None, like for a media that cannot be analysed.
+
+    The results are retrieved from and saved to the ``cache`` (a :class:`ProbeCache`), only the new or modified medias
+    are analysed. Queued medias are not probed if the generator is closed before the end.
+
+    **Example usage**
+
+    >>> with io.open(u'/tmp/probe_many.mp4', u'wb') as f:
+    ...     a = f.write(b'not a real media')
+    >>> cache = ProbeCache()
+    >>> cache.set(u'/tmp/probe_many.mp4', {u'duration': u'00:00:10.00', u'audio': {}, u'video': {}})
+    >>> for filename, result, error in sorted(probe_many([u'/tmp/probe_many.mp4', u'/tmp/missing.mp4'], cache=cache)):
+    ...     print(filename, result and result[u'duration'], error.__class__.__name__)
+    /tmp/missing.mp4 None NoneType
+    /tmp/probe_many.mp4 00:00:10.00 NoneType
+    >>> os.remove(u'/tmp/probe_many.mp4')
+    """
+    pending, done = Queue.Queue(), Queue.Queue()
+    for filename in filenames:
+        pending.put(filename)
+    count, stop = pending.qsize(), threading.Event()
+
+    def worker():
+        while not stop.is_set():
+            try:
+                filename = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                done.put((filename, probe(filename, cache), None))
+            except Exception as e:
+                done.put((filename, None, e))
+
+    threads = [threading.Thread(target=worker) for i in xrange(min(concurrency, count))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for i in xrange(count):
+            yield done.get()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def get_mpd_duration(filename):
+    u"""
+    Return the duration of a MPEG-DASH MPD (the value of *mediaPresentationDuration*) as a string or None.
+
+    The MPD is streamed and the parsing stops at the root element, the size of the MPD does not matter.
+
+    **Example usage**
+
+    >>> with io.open(u'/tmp/test.mpd', u'w', encoding=u'utf-8') as f:
+    ...     a = f.write(MPD_TIMELINE_TEST)
+    >>> print(get_mpd_duration(u'/tmp/test.mpd'))
+    01:00:02.50
+    >>> os.remove(u'/tmp/test.mpd')
+    """
+    with open(filename, u'rb') as f:
+        for event, element in ElementTree.iterparse(f, events=(b'start', )):
+            if element.tag.rpartition(u'}')[2] == u'MPD':
+                match = DURATION_REGEX.match(element.get(u'mediaPresentationDuration', u''))
+                if match is not None:
+                    days, hours, minutes, seconds = (match.group(g) for g in (u'days', u'hours', u'minutes',
+                                                                              u'seconds'))
+                    return duration2str(
+                        int(days or 0) * 86400 + int(hours or 0) * 3600 + int(minutes or 0) * 60 +
+                        float(seconds or 0))
+            return None  # Only the root element matters
+    return None
+
+
+def iter_mpd(filename, tags=(u'Period', u'AdaptationSet', u'Representation', u'SegmentTemplate', u'S')):
+    u"""
+    Yield a tuple (depth, tag, attributes) for each element of a MPEG-DASH MPD listed in ``tags``, in document order.
+
+    The MPD is streamed and the parsed elements are freed, a large (live) MPD is read with a constant memory footprint.
+    Stop the iteration as soon as you got what you want (e.g. the first Period).
+
+    **Example usage**
+
+    >>> with io.open(u'/tmp/test.mpd', u'w', encoding=u'utf-8') as f:
+    ...     a = f.write(MPD_TIMELINE_TEST)
+    >>> for depth, tag, attributes in iter_mpd(u'/tmp/test.mpd', tags=(u'Period', u'AdaptationSet', u'S')):
+    ...     print(depth, tag, sorted(attributes.items()))
+    1 Period [(u'id', u'1'), (u'start', u'PT0S')]
+    2 AdaptationSet [(u'mimeType', u'video/mp4')]
+    6 S [(u'd', u'2000'), (u'r', u'1'), (u't', u'0')]
+    6 S [(u'd', u'1500')]
+    2 AdaptationSet [(u'mimeType', u'audio/mp4')]
+
+    Expand the segment timeline into (time, duration) tuples:
+
+    >>> print(list(iter_segment_timeline(iter_mpd(u'/tmp/test.mpd'))))
+    [(0, 2000), (2000, 2000), (4000, 1500)]
+    >>> os.remove(u'/tmp/test.mpd')
+    """
+    with open(filename, u'rb') as f:
+        parents = []
+        for event, element in ElementTree.iterparse(f, events=(b'start', b'end')):
+            if event == u'start':
+                tag = element.tag.rpartition(u'}')[2]
+                if tag in tags:
+                    yield len(parents), tag, dict((unicode(k), unicode(v)) for k, v in element.attrib.items())
+                parents.append(element)
+            else:
+                parents.pop()
+                element.clear()
+                if parents:
+                    parents[-1].remove(element)  # The parent keeps no reference to its parsed children
+
+
+def iter_segment_timeline(elements):
+    u"""
+    Yield a tuple (time, duration) for each segment of the timelines of the elements yielded by :func:`iter_mpd`.
+
+    The time restarts at the value of the ``t`` attribute of an *S* element (if any) and the segment is repeated ``r``
+    more times. A negative ``r`` (repeat until the next *S* or the end of the period) is not supported.
+    """
+    time = 0
+    for depth, tag, attributes in elements:
+        if tag == u'SegmentTemplate':
+            time = 0
+        elif tag == u'S':
+            time = int(attributes.get(u't', time))
+            duration = int(attributes[u'd'])
+            for i in xrange(max(0, int(attributes.get(u'r', 0))) + 1):
+                yield time, duration
+                time += duration
+
+
+def get_media_duration(filename, cache=None):
     u"""
     Returns the duration of a media as a string.
 
     If input ``filename`` is a MPEG-DASH MPD, then duration will be parser from value of key
-    *mediaPresentationDuration*. For any other type of file, this is a *ffmpeg* subprocess
-    that detect duration of the media.
+    *mediaPresentationDuration* (see :func:`get_mpd_duration`). For any other type of file, this is a *ffmpeg*
+    subprocess that detect duration of the media, see :func:`probe`.
 
     **Example usage**
 
@@ -111,29 +528,17 @@ def get_media_duration(filename):
     01:45:23.62
     """
     if os.path.splitext(filename)[1] == u'.mpd':
-        mpd = minidom.parse(filename)
-        if mpd.firstChild.nodeName == u'MPD':
-            match = DURATION_REGEX.search(mpd.firstChild.getAttribute(u'mediaPresentationDuration'))
-            if match is not None:
-                return u'{0:02d}:{1:02d}:{2:05.2f}'.format(
-                    int(match.group(u'hours')), int(match.group(u'minutes')),
-                    float(match.group(u'seconds')))
-    else:
-        cmd = u'ffmpeg -i "{0}"'.format(filename)
-        pipe = Popen(shlex.split(to_bytes(cmd)), stderr=PIPE, close_fds=True)
-        match = re.search(ur'Duration: (?P<duration>\S+),', unicode(pipe.stderr.read()))
-        if not match:
-            return None
-        duration = match.group(u'duration')
-        # ffmpeg may return this so strange value, 00:00:00.04, let it being None
-        return duration if duration and duration != u'00:00:00.04' else None
-    return None
+        return get_mpd_duration(filename)
+    infos = probe(filename, cache)
+    return infos[u'duration'] if infos else None
 
 
-def get_media_tracks(filename):
+def get_media_tracks(filename, cache=None):
     u"""
+    Return the duration and the tracks of a media, see :func:`probe`.
 
-    .. warning:: FIXME Add unit-test to update REGEX by mocking ffmpeg with TEST_VECTOR and checking the output !
+    The tracks are described the same way by :func:`parse_ffprobe` and by :func:`parse_ffmpeg` (if *ffprobe* is not
+    available).
 
     **Example usage**
 
@@ -157,105 +562,589 @@ def get_media_tracks(filename):
         }
 
     """
-    duration = get_media_duration(filename)
-    if not duration:
+    return probe(filename, cache)
+
+
+def parse_stats(line):
+    u"""
+    Return the statistics of an encoding from a line of progress of *ffmpeg* or None if the line is something else.
+
+    **Example usage**
+
+    >>> from pprint import pprint
+    >>> pprint(parse_stats(u'frame= 2071 fps= 29 q=-1.0 size=   34623kB time=00:01:25.89 bitrate=3302.3kbits/s'))
+    {u'bitrate': u'3302.3kbits/s',
+     u'fps': u'29',
+     u'frame': u'2071',
+     u'q': u'-1.0',
+     u'size': 35453952,
+     u'time': u'00:01:25.89'}
+    >>> print(parse_stats(u'frame=    0 fps=0.0 q=0.0 size=       0kB time=-00:00:00.02 bitrate=N/A')[u'time'])
+    None
+    >>> print(parse_stats(u'Press [q] to stop, [?] for help'))
+    None
+    """
+    match = ENCODING_REGEX.search(line)
+    if not match:
         return None
-    duration_secs = total_seconds(duration)
-    cmd = u'ffmpeg -i "{0}"'.format(filename)
-    pipe = Popen(shlex.split(cmd), stderr=PIPE, close_fds=True)
-    output = pipe.stderr.read()
-    audio, video = {}, {}
-    for match in AUDIO_TRACKS_REGEX.finditer(output):
-        group = match.groupdict()
-        track = group.pop(u'track')
-        audio[track] = group
-    for match in VIDEO_TRACKS_REGEX.finditer(output):
-        group = match.groupdict()
-        track = group.pop(u'track')
-        group[u'estimated_frames'] = int(float(group[u'framerate']) * duration_secs)
-        video[track] = group
-    return {u'duration': duration, u'audio': audio, u'video': video}
+    stats = match.groupdict()
+    if _seconds(stats[u'time']) is None:
+        stats[u'time'] = None
+    size = stats[u'size']
+    try:
+        stats[u'size'] = int(size[:-2]) * 1024 if size.endswith(u'kB') else int(size)
+    except ValueError:
+        stats[u'size'] = None
+    return stats
 
 
-def encode(in_filename, out_filename, encoder_string, ratio_delta=0.01, time_delta=1, max_time_delta=5,
-           sanity_min_ratio=0.95, sanity_max_ratio=1.05):
+def parse_progress(block):
+    u"""
+    Return the statistics of an encoding from a block of key=value pairs of ``ffmpeg -progress``.
 
-    def get_ratio(in_duration, out_duration):
-        try:
-            ratio = total_seconds(out_duration) / total_seconds(in_duration)
-            return 0.0 if ratio < 0.0 else 1.0 if ratio > 1.0 else ratio
-        except ZeroDivisionError:
-            return 1.0
+    **Example usage**
 
-   # Get input media duration and size to be able to estimate ETA
-    in_duration, in_size = get_media_duration(in_filename), get_size(in_filename)
+    >>> from pprint import pprint
+    >>> pprint(parse_progress({u'frame': u'2071', u'fps': u'29.50', u'stream_0_0_q': u'28.0', u'total_size': u'3600',
+    ...                        u'out_time_us': u'85890000', u'out_time_ms': u'85890000',
+    ...                        u'out_time': u'00:01:25.890000', u'bitrate': u'3302.3kbits/s',
+    ...                        u'progress': u'continue'}))
+    {u'bitrate': u'3302.3kbits/s',
+     u'fps': u'29.50',
+     u'frame': u'2071',
+     u'q': u'28.0',
+     u'size': 3600,
+     u'time': u'00:01:25.89'}
 
-    # Initialize metrics
-    output = u''
-    stats = {}
-    start_date, start_time = datetime_now(), time.time()
-    prev_ratio = prev_time = ratio = 0
+    The time is None if not yet known (e.g. before the first frame):
 
-    # Create FFmpeg subprocess
-    cmd = u'ffmpeg -y -i "{0}" {1} "{2}"'.format(in_filename, encoder_string, out_filename)
-    ffmpeg = Popen(shlex.split(cmd), stderr=PIPE, close_fds=True)
-    make_async(ffmpeg.stderr)
-
-    while True:
-        # Wait for data to become available
-        select.select([ffmpeg.stderr], [], [])
-        chunk = ffmpeg.stderr.read()
-        output += chunk
-        elapsed_time = time.time() - start_time
-        match = ENCODING_REGEX.match(chunk)
-        if match:
-            stats = match.groupdict()
-            out_duration = stats[u'time']
-            ratio = get_ratio(in_duration, out_duration)
-            delta_time = elapsed_time - prev_time
-            if (ratio - prev_ratio > ratio_delta and delta_time > time_delta) or delta_time > max_time_delta:
-                prev_ratio, prev_time = ratio, elapsed_time
-                eta_time = int(elapsed_time * (1.0 - ratio) / ratio) if ratio > 0 else 0
-                yield {
-                    u'status': u'PROGRESS',
-                    u'output': output,
-                    u'returncode': None,
-                    u'start_date': start_date,
-                    u'elapsed_time': elapsed_time,
-                    u'eta_time': eta_time,
-                    u'in_size': in_size,
-                    u'in_duration': in_duration,
-                    u'out_size': get_size(out_filename),
-                    u'out_duration': out_duration,
-                    u'percent': int(100 * ratio),
-                    u'frame': stats.get(u'frame'),
-                    u'fps': stats.get(u'fps'),
-                    u'bitrate': stats.get(u'bitrate'),
-                    u'quality': stats.get(u'q'),
-                    u'sanity': None
-                }
-        returncode = ffmpeg.poll()
-        if returncode is not None:
+    >>> print(parse_progress({u'out_time_us': u'N/A', u'out_time_ms': u'N/A', u'out_time': u'N/A'})[u'time'])
+    None
+    >>> print(parse_progress({u'out_time_ms': u'-23220', u'out_time': u'-00:00:00.023220'})[u'time'])
+    None
+    """
+    try:
+        size = int(block.get(u'total_size'))
+    except (TypeError, ValueError):
+        size = None  # N/A
+    q = next((value for key, value in sorted(block.items()) if key.endswith(u'_q')), None)
+    # Despite its name, out_time_ms is in microseconds too (out_time_us was added later to fix the naming)
+    seconds = _seconds(block.get(u'out_time_us'), 1e-6)
+    if seconds is None:
+        seconds = _seconds(block.get(u'out_time_ms'), 1e-6)
+    if seconds is None:
+        seconds = _seconds(block.get(u'out_time'))
+    return {
+        u'frame': block.get(u'frame'), u'fps': block.get(u'fps'), u'q': q, u'size': size,
+        u'time': None if seconds is None else duration2str(seconds), u'bitrate': block.get(u'bitrate')
+    }
+
+
+def _seconds(value, factor=None):
+    u"""Return a time of *ffmpeg* (scaled by ``factor`` if set) in seconds or None if not available or negative."""
+    if value is None:
+        return None
+    try:
+        seconds = int(value) * factor if factor else total_seconds(value)
+    except ValueError:
+        return None  # N/A
+    return None if seconds < 0 or value.lstrip().startswith(u'-') else seconds
+
+
+def get_keyframes(filename):
+    u"""Return the timestamps (in seconds) of the key-frames of the first video track of a media."""
+    process = Popen(shlex.split(to_bytes(KEYFRAMES_COMMAND.format(filename))), stdout=PIPE, stderr=PIPE,
+                    close_fds=True)
+    keyframes = []
+    for line in process.communicate()[0].decode(u'utf-8').splitlines():
+        pts_time, _, flags = line.partition(u',')
+        if flags.startswith(u'K'):
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                pass  # N/A
+    return sorted(keyframes)
+
+
+def split_segments(keyframes, duration, count, segment_duration=None):
+    u"""
+    Return a list of segments (start, duration) that split a media of ``duration`` seconds at its ``keyframes``.
+
+    The segments last ``segment_duration`` seconds (or ``duration`` / ``count``) at least, the last one until the end
+    (its duration is None).
+
+    **Example usage**
+
+    >>> split_segments([0, 2, 4, 6, 8], 10, 2)
+    [(0.0, 6.0), (6.0, None)]
+    >>> split_segments([0, 2, 4, 6, 8], 10, 3)
+    [(0.0, 4.0), (4.0, 4.0), (8.0, None)]
+    >>> split_segments([0, 2, 4, 6, 8], 10, 2, segment_duration=20)
+    [(0.0, None)]
+    """
+    segment_duration = segment_duration or duration / count
+    starts, target = [0.0], segment_duration
+    for keyframe in keyframes:
+        if keyframe >= duration:
             break
+        if keyframe >= target:
+            starts.append(float(keyframe))
+            while target <= keyframe:
+                target += segment_duration
+    return [(start, end - start) for start, end in zip(starts, starts[1:])] + [(starts[-1], None)]
+
+
+def _get_ratio(in_duration, out_duration):
+    if in_duration is None:
+        return 0.0  # Unknown duration (e.g. the input cannot be analysed)
+    try:
+        ratio = total_seconds(out_duration) / total_seconds(in_duration)
+        return 0.0 if ratio < 0.0 else 1.0 if ratio > 1.0 else ratio
+    except ZeroDivisionError:
+        return 1.0
+
+
+def _iter_stats(ffmpeg, output, progress, timeout):
+    u"""Yield the statistics of an encoding by reading the framed output of an *ffmpeg* :class:`AsyncProcess`."""
+    block = {}
+    for name, line in ffmpeg.lines(timeout=timeout):
+        if name == u'stderr':
+            output.write(line)
+            if progress:
+                continue
+            stats = parse_stats(line.decode(u'utf-8', u'replace'))
+            if not stats:
+                continue
+        elif not progress:
+            continue
+        else:
+            key, _, value = line.decode(u'utf-8', u'replace').strip().partition(u'=')
+            block[key] = value
+            if key != u'progress':
+                continue  # The block of key=value pairs is not yet complete
+            stats, block = parse_progress(block), {}
+        if stats[u'time'] is None:
+            continue  # No time yet (N/A or negative), the progress cannot be computed
+        yield stats
 
-    # Output media file sanity check
-    out_duration = get_media_duration(out_filename)
-    ratio = get_ratio(in_duration, out_duration) if out_duration else 0.0
-    yield {
-        u'status': u'ERROR' if returncode else u'SUCCESS',
+
+def _status(status, output, returncode, start_date, elapsed_time, eta_time, in_size, in_duration, out_size,
+            out_duration, percent, stats, sanity):
+    return {
+        u'status': status,
         u'output': output,
         u'returncode': returncode,
         u'start_date': start_date,
         u'elapsed_time': elapsed_time,
-        u'eta_time': 0,
+        u'eta_time': eta_time,
         u'in_size': in_size,
         u'in_duration': in_duration,
-        u'out_size': get_size(out_filename),
+        u'out_size': out_size,
         u'out_duration': out_duration,
-        u'percent': int(100 * ratio) if returncode else 100,  # Assume that a successful encoding = 100%
+        u'percent': percent,
         u'frame': stats.get(u'frame'),
         u'fps': stats.get(u'fps'),
         u'bitrate': stats.get(u'bitrate'),
         u'quality': stats.get(u'q'),
-        u'sanity': sanity_min_ratio <= ratio <= sanity_max_ratio
+        u'sanity': sanity
     }
+
+
+def _final_status(out_filename, output, returncode, start_date, start_time, in_size, in_duration, stats,
+                  sanity_min_ratio, sanity_max_ratio, cache):
+    u"""Return the final status of an encoding after a sanity check of the output media."""
+    exists = os.path.exists(out_filename)
+    out_duration = get_media_duration(out_filename, cache) if exists else None
+    ratio = _get_ratio(in_duration, out_duration) if out_duration else 0.0
+    return _status(
+        u'ERROR' if returncode else u'SUCCESS', output, returncode, start_date, time.time() - start_time, 0, in_size,
+        in_duration, get_size(out_filename) if exists else 0, out_duration,
+        int(100 * ratio) if returncode else 100,  # Assume that a successful encoding = 100%
+        stats, sanity_min_ratio <= ratio <= sanity_max_ratio)
+
+
+def encode(in_filename, out_filename, encoder_string, ratio_delta=0.01, time_delta=1, max_time_delta=5,
+           sanity_min_ratio=0.95, sanity_max_ratio=1.05, capture=OutputCapture, cache=None, timeout=None,
+           progress=True, workers=1, segment_duration=None):
+    u"""
+    Encode a media with *ffmpeg* and yield the status of the encoding (progress, ETA, ...) up to the final one.
+
+    The output of *ffmpeg* is read without busy-looping and framed line by line (split on ``\\r`` and ``\\n``) so that
+    every line of progress is parsed. Set ``progress`` to False if *ffmpeg* does not support ``-progress`` (the lines of
+    statistics written to stderr are parsed instead).
+
+    * Set ``timeout`` to kill *ffmpeg* if it outputs nothing during ``timeout`` seconds (the status is then ERROR).
+    * Close the generator to cancel the encoding (*ffmpeg* is killed).
+    * Set ``workers`` > 1 to split the media at its key-frames, encode the segments (lasting ``segment_duration`` or
+      the duration of the media / ``workers``) in parallel and concatenate them, see :func:`encode_segments`.
+    """
+    if workers > 1:
+        for status in encode_segments(in_filename, out_filename, encoder_string, ratio_delta, time_delta,
+                                      max_time_delta, sanity_min_ratio, sanity_max_ratio, capture, cache, timeout,
+                                      progress, workers, segment_duration):
+            yield status
+        return
+
+   # Get input media duration and size to be able to estimate ETA
+    in_duration, in_size = get_media_duration(in_filename, cache), get_size(in_filename)
+
+    # Initialize metrics
+    output = capture(u'stderr')  # Bounded memory footprint, see subprocess.OutputCapture
+    stats = {}
+    start_date, start_time = datetime_now(), time.time()
+    prev_ratio = prev_time = ratio = 0
+
+    # Create FFmpeg subprocess
+    options = PROGRESS_OPTIONS if progress else u''
+    cmd = u'ffmpeg -y {0} -i "{1}" {2} "{3}"'.format(options, in_filename, encoder_string, out_filename)
+    ffmpeg = cmd_async(cmd, fail=False, separators=(b'\n', b'\r'))
+
+    try:
+        for stats in _iter_stats(ffmpeg, output, progress, timeout):
+            elapsed_time = time.time() - start_time
+            out_duration = stats[u'time']
+            ratio = _get_ratio(in_duration, out_duration)
+            delta_time = elapsed_time - prev_time
+            if (ratio - prev_ratio > ratio_delta and delta_time > time_delta) or delta_time > max_time_delta:
+                prev_ratio, prev_time = ratio, elapsed_time
+                eta_time = int(elapsed_time * (1.0 - ratio) / ratio) if ratio > 0 else 0
+                yield _status(u'PROGRESS', _join(outputs), None, start_date, elapsed_time, eta_time, in_size,
+                              in_duration, stats[u'size'], out_duration, int(100 * ratio), stats, None)
+    finally:
+        if not ffmpeg.finished:
+            ffmpeg.cancel()  # Generator closed by the caller
+        output.close()
+
+    yield _final_status(out_filename, output.value, ffmpeg.returncode, start_date, start_time, in_size, in_duration,
+                        stats, sanity_min_ratio, sanity_max_ratio, cache)
+
+
+def encode_segments(in_filename, out_filename, encoder_string, ratio_delta=0.01, time_delta=1, max_time_delta=5,
+                    sanity_min_ratio=0.95, sanity_max_ratio=1.05, capture=OutputCapture, cache=None, timeout=None,
+                    progress=True, workers=multiprocessing.cpu_count(), segment_duration=None):
+    u"""
+    Encode a media with up to ``workers`` *ffmpeg* processes and yield the status of the encoding, see :func:`encode`.
+
+    The media is split at its key-frames (see :func:`split_segments`), the segments are encoded in parallel into a
+    temporary directory next to ``out_filename`` and then concatenated (without re-encoding) with the concat demuxer.
+
+    The status reports the aggregated progress: the percent and the ETA are computed from the encoded duration of all
+    the segments, the frames, the fps and the size are the sum of the ones of the segments. The output is the one of
+    the segments (in order) followed by the one of the concatenation if it failed. An exception raised while encoding
+    a segment cancels the other segments and is raised again.
+
+    .. note::
+
+        The audio is encoded per segment. Some audio codecs may introduce tiny gaps at the boundaries of the segments.
+    """
+    in_duration, in_size = get_media_duration(in_filename, cache), get_size(in_filename)
+    duration_secs = total_seconds(in_duration) if in_duration else 0
+    segments = split_segments(get_keyframes(in_filename), duration_secs, workers, segment_duration)
+    directory = tempfile.mkdtemp(prefix=u'segments-', dir=os.path.dirname(os.path.abspath(out_filename)))
+    extension = os.path.splitext(out_filename)[1]
+    filenames = [os.path.join(directory, u'{0:05d}{1}'.format(i, extension)) for i in xrange(len(segments))]
+
+    start_date, start_time = datetime_now(), time.time()
+    prev_ratio = prev_time = 0
+    positions, statistics, outputs = [0.0] * len(segments), [{} for segment in segments], [None] * len(segments)
+    pending, events, lock, running, stop = Queue.Queue(), Queue.Queue(), threading.Lock(), {}, threading.Event()
+    for index, segment in enumerate(segments):
+        pending.put((index, segment))
+
+    def worker():
+        while not stop.is_set():
+            try:
+                index, (start, length) = pending.get_nowait()
+            except Queue.Empty:
+                return
+            output = capture(u'stderr')
+            command = u'ffmpeg -y {0} -ss {1} -i "{2}" {3} {4} "{5}"'.format(
+                PROGRESS_OPTIONS if progress else u'', start, in_filename,
+                u'' if length is None else u'-t {0}'.format(length), encoder_string, filenames[index])
+            ffmpeg = cmd_async(command, fail=False, separators=(b'\n', b'\r'))
+            with lock:
+                running[index] = ffmpeg
+            if stop.is_set():
+                ffmpeg.cancel()
+            returncode, error = None, None
+            try:
+                for stats in _iter_stats(ffmpeg, output, progress, timeout):
+                    events.put((index, stats, output, None, None))
+                returncode = ffmpeg.returncode
+            except BaseException:
+                error = sys.exc_info()
+                ffmpeg.cancel()
+            finally:
+                output.close()
+                with lock:
+                    del running[index]
+                # A segment that raised (or with an unknown return code) is a failed segment
+                events.put((index, None, output, 1 if returncode is None else returncode, error))
+
+    def shutdown():
+        stop.set()
+        with lock:
+            for ffmpeg in running.values():
+                ffmpeg.cancel()
+        for thread in threads:
+            thread.join()
+
+    threads = [threading.Thread(target=worker) for i in xrange(min(workers, len(segments)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        remaining, returncode = len(segments), 0
+        while remaining:
+            index, stats, output, returncode, error = events.get()
+            outputs[index] = output
+            if error is not None:
+                shutdown()
+                six.reraise(*error)
+            if stats is None:
+                remaining -= 1
+                if returncode:
+                    break  # A segment failed, the encoding failed
+                start, length = segments[index]
+                positions[index] = (length if length is not None else duration_secs - start)
+                continue
+            statistics[index] = stats
+            positions[index] = total_seconds(stats[u'time'])
+            elapsed_time = time.time() - start_time
+            ratio = _get_ratio(in_duration, sum(positions))  # 0 until the end if the duration is unknown
+            delta_time = elapsed_time - prev_time
+            if (ratio - prev_ratio > ratio_delta and delta_time > time_delta) or delta_time > max_time_delta:
+                prev_ratio, prev_time = ratio, elapsed_time
+                eta_time = int(elapsed_time * (1.0 - ratio) / ratio) if ratio > 0 else 0
+                yield _status(u'PROGRESS', _join(outputs), None, start_date, elapsed_time, eta_time, in_size,
+                              in_duration, sum(s.get(u'size') or 0 for s in statistics),
+                              duration2str(sum(positions)), int(100 * ratio), _aggregate(statistics), None)
+        shutdown()  # Cancel the running segments if one failed
+
+        if not returncode:
+            # Concatenate the segments without re-encoding
+            list_filename = os.path.join(directory, u'segments.txt')
+            with io.open(list_filename, u'w', encoding=u'utf-8') as f:
+                for filename in filenames:
+                    f.write(u"file '{0}'\n".format(filename.replace(u"'", u"'\\''")))
+            result = cmd(u'ffmpeg -y -f concat -safe 0 -i "{0}" -c copy "{1}"'.format(list_filename, out_filename),
+                         fail=False)
+            returncode = result[u'returncode']
+            if returncode:
+                output = capture(u'stderr')
+                output.write(result[u'stderr'])
+                output.close()
+                outputs.append(output)
+        yield _final_status(out_filename, _join(outputs), returncode, start_date, start_time, in_size, in_duration,
+                            _aggregate(statistics), sanity_min_ratio, sanity_max_ratio, cache)
+    finally:
+        shutdown()  # Generator closed by the caller
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _join(outputs):
+    u"""Return the values of the output captures (the ones of the segments not started yet are None) joined."""
+    return b''.join(output.value for output in outputs if output is not None)
+
+
+def _aggregate(statistics):
+    u"""
+    Return the statistics of the segments encoded in parallel summed up.
+
+    **Example usage**
+
+    >>> from pprint import pprint
+    >>> pprint(_aggregate([{u'frame': u'10', u'fps': u'25.5', u'q': u'28.0', u'size': 100, u'bitrate': u'1kbits/s'},
+    ...                    {u'frame': u'20', u'fps': u'24', u'q': u'29.0', u'size': 200}, {}]))
+    {u'bitrate': None, u'fps': u'49.5', u'frame': u'30', u'q': None, u'size': 300}
+    """
+    def total(key, convert):
+        try:
+            return sum(convert(s[key]) for s in statistics if s.get(key) is not None)
+        except ValueError:
+            return None  # N/A
+    frame, fps = total(u'frame', int), total(u'fps', float)
+    return {
+        u'frame': None if frame is None else unicode(frame), u'fps': None if fps is None else u'{0:g}'.format(fps),
+        u'q': None, u'size': total(u'size', int), u'bitrate': None
+    }
+
+# Encoding jobs scheduler ----------------------------------------------------------------------------------------------
+
+class EncodeJob(object):
+    u"""An encoding job of a :class:`EncodeScheduler`, the status and the statistic are updated while encoding."""
+
+    ALL_STATUS = PENDING, PROGRESS, SUCCESS, FAILURE, REVOKED = \
+        u'PENDING', u'PROGRESS', u'SUCCESS', u'FAILURE', u'REVOKED'
+
+    FINAL_STATUS = (SUCCESS, FAILURE, REVOKED)
+
+    def __init__(self, in_filename, out_filename, encoder_string, priority=0, cost=1, workers=1, _id=None,
+                 status=PENDING, statistic=None, sequence=0):
+        self.in_filename = in_filename
+        self.out_filename = out_filename
+        self.encoder_string = encoder_string
+        self.priority = priority
+        self.cost = cost
+        self.workers = workers
+        self._id = _id or uuid.uuid4().hex
+        self.status = status
+        self.statistic = statistic or {}
+        self.sequence = sequence
+        self.cancelled = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state[u'cancelled']
+        state[u'statistic'] = dict((k, v) for k, v in self.statistic.items() if k != u'output')
+        return state
+
+
+class EncodeScheduler(object):
+    u"""
+    A local queue of encoding jobs (see :func:`encode`) that runs as many encodings at once as the machine can handle.
+
+    A job is admitted if the total cost of the running jobs (plus its own) do not exceed ``cores`` and if the load
+    average of the machine do not exceed ``max_load`` (the cores by default). The load generated by the running jobs
+    is subtracted from the load average because it is lagging. The cost of a job is declared when submitted, else
+    retrieved from ``costs`` (a dictionary encoder string -> cost), else the number of ``workers`` of the job. A job is
+    always admitted if nothing is running.
+
+    The pending jobs are admitted by priority (highest first), then in order of submission. The queue is saved to
+    ``filename`` (see :func:`pytoolbox.serialization.to_file` with ``safe`` set) at every change of status and loaded
+    back when the scheduler is created. Any job interrupted by a crash is pending again.
+
+    The ``callback`` is called with the job as argument at every status reported by :func:`encode`.
+
+    **Example usage**
+
+    >>> scheduler = EncodeScheduler(u'/tmp/scheduler.json', cores=4, max_load=1000, costs={u'-c:v libx264': 3})
+    >>> low = scheduler.submit(u'/tmp/missing_1.mp4', u'/tmp/out_1.mp4', u'-c:v libx264')
+    >>> high = scheduler.submit(u'/tmp/missing_2.mp4', u'/tmp/out_2.mp4', u'-c copy', priority=10)
+    >>> print([job.cost for job in scheduler.jobs], scheduler.next_job() is high)
+    [3, 1] True
+    >>> print(scheduler.admissible(low, running_cost=1, load=1.0), scheduler.admissible(low, running_cost=2, load=2.0))
+    True False
+
+    The queue is persistent:
+
+    >>> scheduler = EncodeScheduler(u'/tmp/scheduler.json')
+    >>> print([job.status for job in scheduler.jobs], scheduler.next_job()._id == high._id)
+    [u'PENDING', u'PENDING'] True
+
+    Run the jobs (the medias are missing):
+
+    >>> scheduler.run()
+    >>> print([job.status for job in scheduler.jobs])
+    [u'FAILURE', u'FAILURE']
+    >>> os.remove(u'/tmp/scheduler.json')
+    """
+
+    def __init__(self, filename=None, cores=multiprocessing.cpu_count(), max_load=None, costs=None, callback=None,
+                 interval=1, **kwargs):
+        self.filename = filename
+        self.cores = cores
+        self.max_load = max_load or cores
+        self.costs = costs or {}
+        self.callback = callback
+        self.interval = interval
+        self.kwargs = kwargs  # Extra arguments of encode
+        self.jobs, self.running = [], {}
+        self._condition = threading.Condition()
+        if filename and os.path.exists(filename):
+            with io.open(filename, u'r', encoding=u'utf-8') as f:
+                for state in json.loads(f.read())[u'jobs']:
+                    job = EncodeJob(**state)
+                    if job.status not in EncodeJob.FINAL_STATUS:
+                        job.status = EncodeJob.PENDING  # Interrupted by a crash
+                    self.jobs.append(job)
+
+    def submit(self, in_filename, out_filename, encoder_string, priority=0, cost=None, workers=1):
+        u"""Append a job to the queue and return it."""
+        cost = cost or self.costs.get(encoder_string) or workers
+        with self._condition:
+            sequence = max([job.sequence for job in self.jobs] or [0]) + 1
+            job = EncodeJob(in_filename, out_filename, encoder_string, priority, cost, workers, sequence=sequence)
+            self.jobs.append(job)
+            self.save()
+            self._condition.notify_all()
+        return job
+
+    def cancel(self, _id):
+        u"""Cancel a job, the encoding is killed (at its next status) if running."""
+        with self._condition:
+            for job in self.jobs:
+                if job._id == _id and job.status not in EncodeJob.FINAL_STATUS:
+                    job.cancelled = True
+                    if job._id not in self.running:
+                        job.status = EncodeJob.REVOKED
+                        self.save()
+                    self._condition.notify_all()
+
+    def save(self):
+        u"""Save the queue to the file (if any)."""
+        if self.filename:
+            from .serialization import to_file
+            state = {u'jobs': [job.__getstate__() for job in self.jobs]}
+            to_file(self.filename, data=json.dumps(state), safe=True)
+
+    def next_job(self):
+        u"""Return the pending job with the highest priority or None."""
+        pending = [job for job in self.jobs if job.status == EncodeJob.PENDING]
+        return min(pending, key=lambda job: (-job.priority, job.sequence)) if pending else None
+
+    def admissible(self, job, running_cost=None, load=None):
+        u"""Return True if the ``job`` can be started now."""
+        if running_cost is None:
+            running_cost = sum(j.cost for j in self.running.values())
+        if not running_cost:
+            return True
+        load = os.getloadavg()[0] if load is None else load
+        external_load = max(0.0, load - running_cost)
+        return running_cost + job.cost <= self.cores and external_load + running_cost + job.cost <= self.max_load
+
+    def run(self, forever=False):
+        u"""Run the jobs until the queue is empty (or forever, waiting for new jobs to be submitted)."""
+        with self._condition:
+            while True:
+                job = self.next_job()
+                while job is not None and self.admissible(job):
+                    self._start(job)
+                    job = self.next_job()
+                if not forever and job is None and not self.running:
+                    break
+                self._condition.wait(self.interval)
+
+    def _start(self, job):
+        job.status = EncodeJob.PROGRESS
+        thread = threading.Thread(target=self._encode, args=(job, ))
+        thread.daemon = True
+        self.running[job._id] = job
+        self.save()
+        thread.start()
+
+    def _encode(self, job):
+        try:
+            statuses = encode(job.in_filename, job.out_filename, job.encoder_string, workers=job.workers,
+                              **self.kwargs)
+            try:
+                for statistic in statuses:
+                    job.statistic = statistic
+                    if job.cancelled:
+                        break
+                    if hasattr(self.callback, u'__call__'):
+                        self.callback(job)
+            finally:
+                statuses.close()  # Kill ffmpeg if cancelled
+            status = EncodeJob.REVOKED if job.cancelled else \
+                EncodeJob.SUCCESS if job.statistic.get(u'status') == u'SUCCESS' else EncodeJob.FAILURE
+        except Exception as e:
+            job.statistic = {u'error': unicode(e)}
+            status = EncodeJob.FAILURE
+        with self._condition:
+            job.status = status
+            del self.running[job._id]
+            self.save()
+            self._condition.notify_all()
+        if hasattr(self.callback, u'__call__'):
+            self.callback(job)
@@ -24,10 +24,29 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import errno, grp, pwd, os, shutil, time
+import errno, grp, hashlib, io, json, pickle, pwd, os, shutil, six, sys, threading, time
+import Queue
 from codecs import open
 from .datetime import datetime_now
-from .encoding import string_types
+from .encoding import string_types, to_bytes
+
+# Directory entries with cached stat (Python 3.5+ or the scandir backport), the walk falls back to listdir + stat
+scandir = getattr(os, u'scandir', None)
+if scandir is None:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# Zero-copy system calls (Python 3.8+ and 3.3+), the copy falls back to a read/write loop if unavailable or unsupported
+copy_file_range = getattr(os, u'copy_file_range', None)
+sendfile = getattr(os, u'sendfile', None)
+ZERO_COPY_FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
 
 
 def first_that_exist(*paths):
@@ -54,88 +73,613 @@ def from_template(template, destination, values):
             destination_file.write(template_file.read().format(**values))
 
 
-def get_size(path):
+def get_size(path, workers=1):
     u"""
     Returns the size of a file or directory.
 
     If given ``path`` is a directory (or symlink to a directory), then returned value is computed by summing the size of
-    all files, and that recursively.
+    all files, and that recursively. The tree is scanned by :func:`walk` with given ``workers``.
+
+    **Example usage**
+
+    >>> for i in range(3):
+    ...     a = try_makedirs(u'/tmp/get_size/{0}/{0}'.format(i))
+    ...     with io.open(u'/tmp/get_size/{0}/{0}/file'.format(i), u'wb') as f:
+    ...         a = f.write(b'x' * 1000 * i)
+    >>> print(get_size(u'/tmp/get_size'), get_size(u'/tmp/get_size', workers=4), get_size(u'/tmp/get_size/2/2/file'))
+    3000 3000 2000
+    >>> shutil.rmtree(u'/tmp/get_size')
     """
     if os.path.isfile(path):
         return os.stat(path).st_size
-    size = 0
-    for root, dirnames, filenames in os.walk(path):
-        for filename in filenames:
-            size += os.stat(os.path.join(root, filename)).st_size
-    return size
+    return sum(stat.st_size for root, dirnames, files in walk(path, workers) for filename, stat in files)
+
+
+class ProgressReporter(object):
+    u"""
+    Aggregate (atomically) the amount of bytes processed by any number of threads and call ``callback`` with
+    *start_date*, *elapsed_time*, *eta_time*, *total_size*, *size* and *ratio* only if delta time or delta ratio is
+    sufficient. The callback is never called concurrently nor with a size lower than the previous call, and is called
+    outside of the lock aggregating the sizes: A slow callback does not block the other threads adding bytes.
+
+    **Example usage**
+
+    >>> calls = []
+    >>> progress = ProgressReporter(lambda *args: calls.append(args[3:]), 1000, ratio_delta=0.1, time_delta=0)
+    >>> for i in range(10):
+    ...     progress.add(100)
+    >>> print(progress.size, [size for total_size, size, ratio in calls])
+    1000 [200, 400, 600, 800, 1000]
+    """
+
+    def __init__(self, callback, total_size=0, ratio_delta=0.01, time_delta=1):
+        self.callback = callback
+        self.total_size = total_size
+        self.ratio_delta = ratio_delta
+        self.time_delta = time_delta
+        self.start_date, self.start_time = datetime_now(), time.time()
+        self.size = self.prev_ratio = self.prev_time = 0
+        self._lock, self._callback_lock, self._callback_size = threading.Lock(), threading.Lock(), -1
+
+    @property
+    def elapsed_time(self):
+        return time.time() - self.start_time
+
+    def add(self, length):
+        with self._lock:
+            self.size += length
+            try:
+                ratio = float(self.size) / self.total_size
+                ratio = 0.0 if ratio < 0.0 else 1.0 if ratio > 1.0 else ratio
+            except ZeroDivisionError:
+                ratio = 1.0
+            elapsed_time = self.elapsed_time
+            # Update status of job only if delta time or delta ratio is sufficient
+            if not (ratio - self.prev_ratio > self.ratio_delta and elapsed_time - self.prev_time > self.time_delta):
+                return
+            self.prev_ratio, self.prev_time = ratio, elapsed_time
+            eta_time = int(elapsed_time * (1.0 - ratio) / ratio) if ratio > 0 else 0
+            size = self.size
+        if self.callback:
+            with self._callback_lock:
+                if size > self._callback_size:  # Another thread may have reported a more recent status meanwhile
+                    self._callback_size = size
+                    self.callback(self.start_date, elapsed_time, eta_time, self.total_size, size, ratio)
+
+
+class SizeIndex(object):
+    u"""
+    An incremental index of the size of directories.
+
+    The listing and the total size of the files of every directory are cached and keyed by the (inode, mtime) of the
+    directory. A query only re-scans the directories that changed (entries created, removed or renamed), the others cost
+    a single ``os.stat``. The index can be saved to a file and loaded back with ``write`` and ``read``.
+
+    .. warning::
+
+        Modifying a file in-place does not update the mtime of its directory. Call :meth:`invalidate` with the path of
+        the file or :meth:`watch` the tree (requires :mod:`pyinotify`) to keep the index live. The cached totals of the
+        watched trees are then returned without any system call.
+
+    **Example usage**
+
+    >>> for i in range(3):
+    ...     a = try_makedirs(u'/tmp/size_index/{0}'.format(i))
+    ...     with io.open(u'/tmp/size_index/{0}/file'.format(i), u'wb') as f:
+    ...         a = f.write(b'x' * 100)
+    >>> index = SizeIndex()
+    >>> print(index.get_size(u'/tmp/size_index'), index.scans)
+    300 4
+
+    Only the changed directory is scanned again:
+
+    >>> with io.open(u'/tmp/size_index/1/other', u'wb') as f:
+    ...     a = f.write(b'x' * 50)
+    >>> print(index.get_size(u'/tmp/size_index'), index.scans)
+    350 5
+    >>> print(index.get_size(u'/tmp/size_index/2'), index.scans)
+    100 5
+
+    A file modified in-place must be invalidated:
+
+    >>> with io.open(u'/tmp/size_index/1/other', u'ab') as f:
+    ...     a = f.write(b'x' * 50)
+    >>> print(index.get_size(u'/tmp/size_index'))
+    350
+    >>> index.invalidate(u'/tmp/size_index/1/other')
+    >>> print(index.get_size(u'/tmp/size_index'), index.scans)
+    400 6
+
+    The index is persistent:
+
+    >>> index.write(u'/tmp/size_index.pkl')
+    >>> index = SizeIndex.read(u'/tmp/size_index.pkl')
+    >>> print(index.get_size(u'/tmp/size_index'), index.scans)
+    400 0
+    >>> shutil.rmtree(u'/tmp/size_index')
+    >>> os.remove(u'/tmp/size_index.pkl')
+    """
+
+    def __init__(self):
+        self.directories, self.totals, self.scans = {}, {}, 0
+        self._lock = threading.RLock()
+        self._notifier = None
+
+    def __getstate__(self):
+        return {u'directories': self.directories}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.directories = state[u'directories']
+
+    @classmethod
+    def read(cls, filename):
+        u"""Return an index loaded from a file."""
+        with io.open(filename, u'rb') as f:
+            return pickle.load(f)
+
+    def write(self, filename):
+        u"""Save the index to a file (safely, the file is replaced once written)."""
+        from .serialization import to_file
+        with self._lock:
+            to_file(filename, pickle_data=self, binary=True, safe=True)
+
+    def get_size(self, path):
+        u"""Returns the size of a file or directory, see :func:`get_size`."""
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            return os.stat(path).st_size
+        with self._lock:
+            return self._size(path)
+
+    def invalidate(self, path):
+        u"""Forget the cached size of the directory ``path`` (or of the directory containing the file ``path``)."""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self.directories:
+                path = os.path.dirname(path)
+            self.directories.pop(path, None)
+            while True:  # The totals of the parent directories are obsolete
+                self.totals.pop(path, None)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+    def watch(self, path):
+        u"""Keep the index live by watching the tree ``path`` with inotify."""
+        if pyinotify is None:
+            raise NotImplementedError(to_bytes(u'Module pyinotify is required to watch a directory tree.'))
+        index = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                index.invalidate(event.path)
+
+        with self._lock:
+            if self._notifier is None:
+                self._manager = pyinotify.WatchManager()
+                self._notifier = pyinotify.ThreadedNotifier(self._manager, Handler())
+                self._notifier.daemon = True
+                self._notifier.start()
+            mask = (pyinotify.IN_MODIFY | pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM |
+                    pyinotify.IN_MOVED_TO)
+            self._manager.add_watch(os.path.abspath(path), mask, rec=True, auto_add=True)
+
+    def unwatch(self):
+        u"""Stop watching the trees, the index will use the (inode, mtime) of the directories."""
+        with self._lock:
+            if self._notifier is not None:
+                self._notifier.stop()
+                self._notifier = self._manager = None
+            self.totals.clear()
+
+    def _size(self, path):
+        if self._notifier is not None and path in self.totals:
+            return self.totals[path]
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._forget(path)
+            return 0
+        key, entry = (stat.st_ino, stat.st_mtime), self.directories.get(path)
+        if entry is None or entry[0] != key:
+            dirnames, files, recurse = _scan(path)
+            self.scans += 1
+            if entry:
+                for dirname in set(entry[2]) - set(recurse):
+                    self._forget(os.path.join(path, dirname))
+            entry = self.directories[path] = (key, sum(s.st_size for n, s in files), tuple(recurse))
+        total = entry[1] + sum(self._size(os.path.join(path, d)) for d in entry[2])
+        if self._notifier is not None:
+            self.totals[path] = total
+        return total
+
+    def _forget(self, path):
+        u"""Remove a directory and its sub-directories from the index."""
+        prefix = path.rstrip(os.sep) + os.sep
+        for cache in (self.directories, self.totals):
+            for key in [k for k in cache if k == path or k.startswith(prefix)]:
+                del cache[key]
+
+
+def walk(path, workers=1):
+    u"""
+    Walk a directory tree in one pass and yield a tuple (root, dirnames, files) for every directory of the tree, with
+    files being a list of (filename, stat) of the files in that directory.
+
+    This is like ``os.walk`` (top-down, symlinks to directories listed but not followed, unreadable directories
+    skipped), but the stat results comes from the cached ``DirEntry.stat()`` of ``scandir``. Set ``workers`` to scan
+    the sub-directories in parallel, the directories are then yielded in any order (but parents before children).
+
+    **Example usage**
+
+    >>> for directory in (u'/tmp/walk/a/b', u'/tmp/walk/c'):
+    ...     a = try_makedirs(directory)
+    ...     with io.open(os.path.join(directory, u'file'), u'wb') as f:
+    ...         a = f.write(b'1234')
+    >>> for root, dirnames, files in sorted(walk(u'/tmp/walk')):
+    ...     print(root, sorted(dirnames), [(filename, int(stat.st_size)) for filename, stat in files])
+    /tmp/walk [u'a', u'c'] []
+    /tmp/walk/a [u'b'] []
+    /tmp/walk/a/b [] [(u'file', 4)]
+    /tmp/walk/c [] [(u'file', 4)]
+    >>> print(sorted(root for root, dirnames, files in walk(u'/tmp/walk', workers=4)))
+    [u'/tmp/walk', u'/tmp/walk/a', u'/tmp/walk/a/b', u'/tmp/walk/c']
+    >>> shutil.rmtree(u'/tmp/walk')
+    """
+    if workers <= 1:
+        pending = [path]
+        while pending:
+            root = pending.pop()
+            dirnames, files, recurse = _scan(root)
+            yield root, dirnames, files
+            pending.extend(os.path.join(root, d) for d in reversed(recurse))
+        return
+
+    tasks, results = Queue.Queue(), Queue.Queue()
+
+    def worker():
+        while True:
+            root = tasks.get()
+            if root is None:
+                return
+            try:
+                results.put((root, ) + _scan(root))
+            except Exception as e:
+                results.put(e)
+
+    threads = [threading.Thread(target=worker) for i in xrange(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        tasks.put(path)
+        pending = 1
+        while pending:
+            result = results.get()
+            pending -= 1
+            if isinstance(result, Exception):
+                raise result
+            root, dirnames, files, recurse = result
+            for dirname in recurse:
+                tasks.put(os.path.join(root, dirname))
+                pending += 1
+            yield root, dirnames, files
+    finally:
+        try:
+            while True:
+                tasks.get_nowait()  # Cancel the pending scans
+        except Queue.Empty:
+            pass
+        for thread in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def _scan(root):
+    u"""Return a tuple (dirnames, files, dirnames to recurse into) for the directory ``root``, see :func:`walk`."""
+    dirnames, files, recurse = [], [], []
+    try:
+        entries = list(scandir(root)) if scandir else os.listdir(root)
+    except OSError:
+        return dirnames, files, recurse  # Like os.walk, skip the directories that cannot be listed
+    for entry in entries:
+        if scandir:
+            name, is_dir = entry.name, entry.is_dir()
+            is_link = is_dir and entry.is_symlink()
+        else:
+            name = entry
+            entry = os.path.join(root, name)
+            is_dir = os.path.isdir(entry)
+            is_link = is_dir and os.path.islink(entry)
+        if is_dir:
+            dirnames.append(name)
+            if not is_link:
+                recurse.append(name)
+        else:
+            files.append((name, entry.stat() if scandir else os.stat(entry)))
+    return dirnames, files, recurse
+
+
+def copy_range(src_path, dst_path, offset, count, on_copied=None, block_size=1024*1024):
+    u"""
+    Copy ``count`` bytes from ``offset`` of a source file to the same offset of an existing destination file.
+
+    The copy happens in-kernel with ``os.copy_file_range`` or ``os.sendfile`` if available and fall back to a read/write
+    loop with a pre-allocated buffer. Given ``on_copied`` would be called with the length of every copied block.
+    Files are always closed, even in case of error. Returns the amount of copied bytes.
+
+    **Example usage**
+
+    >>> with io.open(u'/tmp/copy_range.src', u'wb') as f:
+    ...     a = f.write(b'0123456789')
+    >>> with io.open(u'/tmp/copy_range.dst', u'wb') as f:
+    ...     a = f.write(b'..........')
+    >>> print(copy_range(u'/tmp/copy_range.src', u'/tmp/copy_range.dst', 2, 5, block_size=2))
+    5
+    >>> print(io.open(u'/tmp/copy_range.dst', u'rb').read().decode(u'utf-8'))
+    ..23456...
+    >>> os.remove(u'/tmp/copy_range.src')
+    >>> os.remove(u'/tmp/copy_range.dst')
+    """
+    copied = 0
+    with io.open(src_path, u'rb', buffering=0) as src_file, io.open(dst_path, u'r+b', buffering=0) as dst_file:
+        src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+        methods = [m for m in (u'copy_file_range', u'sendfile') if globals()[m]] + [u'readinto']
+        for method in methods:
+            try:
+                if method == u'sendfile':
+                    dst_file.seek(offset + copied)  # Sendfile writes at the current position of the destination
+                elif method == u'readinto':
+                    src_file.seek(offset + copied)
+                    dst_file.seek(offset + copied)
+                    buf = bytearray(block_size)
+                    view = memoryview(buf)
+                while copied < count:
+                    length, position = min(block_size, count - copied), offset + copied
+                    if method == u'copy_file_range':
+                        length = copy_file_range(src_fd, dst_fd, length, position, position)
+                    elif method == u'sendfile':
+                        length = sendfile(dst_fd, src_fd, position, length)
+                    else:
+                        length = src_file.readinto(view[:length])
+                        dst_file.write(view[:length])
+                    if not length:
+                        raise IOError(u'Source file {0} is smaller than expected'.format(src_path))
+                    copied += length
+                    if on_copied:
+                        on_copied(length)
+                return copied
+            except OSError as e:
+                if e.errno not in ZERO_COPY_FALLBACK_ERRORS or method == u'readinto':
+                    raise
+    return copied
+
+
+def hash_range(path, offset=0, count=None, algorithm=u'sha1', block_size=1024*1024):
+    u"""
+    Returns the hexadecimal digest of ``count`` bytes (or until the end) from ``offset`` of a file.
 
+    **Example usage**
 
-def recursive_copy(source_path, destination_path, callback, ratio_delta=0.01, time_delta=1):
+    >>> with io.open(u'/tmp/hash_range', u'wb') as f:
+    ...     a = f.write(b'0123456789')
+    >>> print(hash_range(u'/tmp/hash_range', 2, 5, u'md5') == hashlib.md5(b'23456').hexdigest())
+    True
+    >>> print(hash_range(u'/tmp/hash_range', block_size=3) == hashlib.sha1(b'0123456789').hexdigest())
+    True
+    >>> os.remove(u'/tmp/hash_range')
+    """
+    hasher = hashlib.new(algorithm)
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with io.open(path, u'rb', buffering=0) as f:
+        f.seek(offset)
+        while count is None or count > 0:
+            length = f.readinto(view[:block_size if count is None else min(block_size, count)])
+            if not length:
+                break
+            hasher.update(view[:length])
+            if count is not None:
+                count -= length
+    return hasher.hexdigest()
+
+
+def recursive_copy(source_path, destination_path, callback, ratio_delta=0.01, time_delta=1, workers=4,
+                   block_size=1024*1024, range_size=64*1024*1024, resume=False, manifest_path=None,
+                   algorithm=u'sha1'):
     u"""
     Copy the content of a source directory to a destination directory.
     This method is based on a block-copy algorithm making progress update possible.
 
+    The files are split into ranges of ``range_size`` bytes that are copied in parallel by a pool of ``workers``
+    threads, see :func:`copy_range`. The tree is walked only once (see :func:`walk`) to compute the source size and
+    create the destination directories and files.
+
     Given ``callback`` would be called with *start_date*, *elapsed_time*, *eta_time*, *src_size*, *dst_size* and
-    *ratio*.
+    *ratio*. The callback may be called by any worker thread but never concurrently.
 
     This method will return a dictionary containing *start_date*, *elapsed_time* and *src_size*.
     At the end of the copy, if the size of the destination directory is not equal to the source then a ``IOError`` is
     raised. The destination directory is removed in case of error.
+
+    Set ``resume`` to True to make the copy resumable: Every range is verified by comparing the ``algorithm`` digests of
+    the source and the destination, made durable (fdatasync) and then appended to a manifest (JSON lines, default is
+    *destination*.manifest). The manifest is fsync-ed every second and when the copy stops, a range missing from the
+    manifest after a crash is only copied again.
+    In case of error the destination and the manifest are kept, and the next call will skip the ranges listed in the
+    manifest (if the source file has not changed and the destination range still matches the digest). The manifest is
+    removed at the end of a successful copy and the returned dictionary also contains *resumed_size*.
+
+    **Example usage**
+
+    >>> import filecmp
+    >>> for i, size in enumerate((0, 1000, 5000, 12345)):
+    ...     a = try_makedirs(u'/tmp/copy_source/{0}'.format(i))
+    ...     with io.open(u'/tmp/copy_source/{0}/file'.format(i), u'wb') as f:
+    ...         a = f.write(os.urandom(size))
+    >>> ratios = []
+    >>> result = recursive_copy(u'/tmp/copy_source', u'/tmp/copy_destination', lambda *args: ratios.append(args[5]),
+    ...                         time_delta=0, block_size=512, range_size=2048)
+    >>> print(result[u'src_size'], len(ratios) > 0, ratios == sorted(ratios))
+    18345 True True
+    >>> print(filecmp.dircmp(u'/tmp/copy_source', u'/tmp/copy_destination').subdirs[u'3'].diff_files)
+    []
+    >>> all(filecmp.cmp(u'/tmp/copy_source/{0}/file'.format(i), u'/tmp/copy_destination/{0}/file'.format(i),
+    ...                 shallow=False) for i in range(4))
+    True
+    >>> shutil.rmtree(u'/tmp/copy_destination')
+
+    An interrupted copy is resumed where it stopped:
+
+    >>> from nose.tools import assert_raises
+    >>> def interrupt(start_date, elapsed_time, eta_time, src_size, dst_size, ratio):
+    ...     if ratio > 0.5:
+    ...         raise KeyboardInterrupt()
+    >>> assert_raises(KeyboardInterrupt, recursive_copy, u'/tmp/copy_source', u'/tmp/copy_destination', interrupt,
+    ...               time_delta=0, workers=1, block_size=512, range_size=2048, resume=True)
+    >>> os.path.exists(u'/tmp/copy_destination.manifest')
+    True
+    >>> result = recursive_copy(u'/tmp/copy_source', u'/tmp/copy_destination', lambda *args: None, time_delta=0,
+    ...                         block_size=512, range_size=2048, resume=True)
+    >>> print(result[u'src_size'], 0 < result[u'resumed_size'] < 18345)
+    18345 True
+    >>> all(filecmp.cmp(u'/tmp/copy_source/{0}/file'.format(i), u'/tmp/copy_destination/{0}/file'.format(i),
+    ...                 shallow=False) for i in range(4))
+    True
+    >>> os.path.exists(u'/tmp/copy_destination.manifest')
+    False
+
+    The ranges listed in the manifest are copied again if the destination does not match anymore:
+
+    >>> assert_raises(KeyboardInterrupt, recursive_copy, u'/tmp/copy_source', u'/tmp/copy_destination', interrupt,
+    ...               time_delta=0, workers=1, block_size=512, range_size=2048, resume=True)
+    >>> shutil.rmtree(u'/tmp/copy_destination')
+    >>> result = recursive_copy(u'/tmp/copy_source', u'/tmp/copy_destination', lambda *args: None, time_delta=0,
+    ...                         block_size=512, range_size=2048, resume=True)
+    >>> print(result[u'src_size'], result[u'resumed_size'])
+    18345 0
+    >>> all(filecmp.cmp(u'/tmp/copy_source/{0}/file'.format(i), u'/tmp/copy_destination/{0}/file'.format(i),
+    ...                 shallow=False) for i in range(4))
+    True
+    >>> shutil.rmtree(u'/tmp/copy_source')
+    >>> shutil.rmtree(u'/tmp/copy_destination')
     """
+    manifest_path = manifest_path or u'{0}.manifest'.format(destination_path.rstrip(os.sep))
+    manifest = None
     try:
-        start_date, start_time = datetime_now(), time.time()
-        src_size, dst_size = get_size(source_path), 0
+        progress = ProgressReporter(callback, ratio_delta=ratio_delta, time_delta=time_delta)
+        src_size, resumed_size, tasks, verified, dst_paths = 0, [0], Queue.Queue(), {}, []
 
-        # Recursive copy of a directory of files
-        for src_root, dirnames, filenames in os.walk(source_path):
-            for filename in filenames:
-                dst_root = src_root.replace(source_path, destination_path)
+        # Load the ranges already copied and verified
+        if resume and os.path.exists(manifest_path):
+            with io.open(manifest_path, u'r', encoding=u'utf-8') as f:
+                for line in f:
+                    try:
+                        block = json.loads(line)
+                    except ValueError:
+                        continue  # The last line may be truncated
+                    verified[(block[u'path'], block[u'size'], block[u'mtime'], block[u'offset'], block[u'count'],
+                              block[u'algorithm'])] = block[u'digest']
+
+        # Walk the source directory once to create the destination tree and split the files into ranges to copy
+        for src_root, dirnames, files in walk(source_path, workers):
+            dst_root = os.path.normpath(os.path.join(destination_path, os.path.relpath(src_root, source_path)))
+            try_makedirs(dst_root)
+            for filename, stat in files:
                 src_path = os.path.join(src_root, filename)
                 dst_path = os.path.join(dst_root, filename)
-
-                # Initialize block-based copy
-                try_makedirs(os.path.dirname(dst_path))
-                block_size = 1024 * 1024
-                src_file = open(src_path, u'rb')
-                dst_file = open(dst_path, u'wb')
-
-                # Block-based copy loop
-                block_pos = prev_ratio = prev_time = 0
-                while True:
-                    block = src_file.read(block_size)
-                    try:
-                        ratio = float(dst_size) / src_size
-                        ratio = 0.0 if ratio < 0.0 else 1.0 if ratio > 1.0 else ratio
-                    except ZeroDivisionError:
-                        ratio = 1.0
-                    elapsed_time = time.time() - start_time
-                    # Update status of job only if delta time or delta ratio is sufficient
-                    if ratio - prev_ratio > ratio_delta and elapsed_time - prev_time > time_delta:
-                        prev_ratio = ratio
-                        prev_time = elapsed_time
-                        eta_time = int(elapsed_time * (1.0 - ratio) / ratio) if ratio > 0 else 0
-                        callback(start_date, elapsed_time, eta_time, src_size, dst_size, ratio)
-                    block_length = len(block)
-                    block_pos += block_length
-                    dst_size += block_length
-                    if not block:
-                        break  # End of input reached
-                    dst_file.write(block)
-                # FIXME maybe a finally block for that
-                src_file.close()
-                dst_file.close()
+                size = stat.st_size
+                with io.open(dst_path, u'ab' if resume else u'wb') as dst_file:
+                    dst_file.truncate(size)  # Resume mode keeps the content already copied
+                src_size += size
+                dst_paths.append(dst_path)
+                relative_path = os.path.relpath(src_path, source_path)
+                for offset in xrange(0, size, range_size):
+                    block = (relative_path, size, stat.st_mtime, offset, min(range_size, size - offset), algorithm)
+                    tasks.put((src_path, dst_path, block))
+        if resume:
+            manifest = io.open(manifest_path, u'a', encoding=u'utf-8')
+            manifest_synced = [time.time()]
+
+        # Progress is aggregated (atomically) across the workers
+        lock, on_copied, progress.total_size = threading.Lock(), progress.add, src_size
+        errors = []
+
+        def worker():
+            while not errors:
+                try:
+                    task = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    copy_block(*task)
+                except BaseException:
+                    errors.append(sys.exc_info())
+
+        def copy_block(src_path, dst_path, block):
+            offset, count = block[3], block[4]
+            # The destination may have been modified (or removed and re-created empty) since the range was verified
+            if block in verified and hash_range(dst_path, offset, count, algorithm, block_size) == verified[block]:
+                with lock:
+                    resumed_size[0] += count
+                on_copied(count)
+                return
+            copy_range(src_path, dst_path, offset, count, on_copied=on_copied, block_size=block_size)
+            if resume:
+                digest = hash_range(src_path, offset, count, algorithm, block_size)
+                if hash_range(dst_path, offset, count, algorithm, block_size) != digest:
+                    raise IOError(u'Destination {0} does not match source at offset {1}'.format(dst_path, offset))
+                # The range must be on disk before being listed in the manifest
+                fd = os.open(dst_path, os.O_RDONLY)
+                try:
+                    getattr(os, u'fdatasync', os.fsync)(fd)
+                finally:
+                    os.close(fd)
+                line = json.dumps(dict(zip((u'path', u'size', u'mtime', u'offset', u'count', u'algorithm'), block),
+                                       digest=digest))
+                with lock:
+                    manifest.write(line + u'\n')
+                    manifest.flush()
+                    if time.time() - manifest_synced[0] >= 1:
+                        os.fsync(manifest.fileno())
+                        manifest_synced[0] = time.time()
+
+        threads = [threading.Thread(target=worker) for i in xrange(min(workers, tasks.qsize()) - 1)]
+        for thread in threads:
+            thread.start()
+        worker()  # The current thread is also a worker
+        for thread in threads:
+            thread.join()
+        if errors:
+            six.reraise(*errors[0])
 
         # Output directory sanity check
-        dst_size = get_size(destination_path)
+        dst_size = sum(os.path.getsize(p) for p in dst_paths)
         if dst_size != src_size:
             raise IOError(
                 u'Destination size does not match source ({0} vs {1})'.format(src_size, dst_size))
 
-        elapsed_time = time.time() - start_time
-        return {u'start_date': start_date, u'elapsed_time': elapsed_time, u'src_size': src_size}
+        if manifest:
+            manifest.close()
+            os.remove(manifest_path)
+
+        result = {u'start_date': progress.start_date, u'elapsed_time': progress.elapsed_time, u'src_size': src_size}
+        if resume:
+            result[u'resumed_size'] = resumed_size[0]
+        return result
     except:
-        # Cleanup - remove output directory
-        shutil.rmtree(destination_path, ignore_errors=True)
+        if manifest:
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            manifest.close()
+        # Cleanup - remove output directory (unless the copy can be resumed)
+        if not resume:
+            shutil.rmtree(destination_path, ignore_errors=True)
         raise
 
 
@@ -252,14 +796,20 @@ def try_symlink(source, link_name):
         raise  # Re-raise exception if a different error occurred
 
 
-def chown(path, user, group, recursive=False):
-    u"""Change owner/group of a path, can be recursive. User and group can be a name or an id."""
+def chown(path, user, group, recursive=False, workers=1):
+    u"""
+    Change owner/group of a path, can be recursive. User and group can be a name or an id.
+
+    The recursive mode scans the tree with :func:`walk` (given ``workers``) and skips the files already owned by
+    ``user`` and ``group``.
+    """
     uid = pwd.getpwnam(user).pw_uid if isinstance(user, string_types) else user
     gid = grp.getgrnam(group).gr_gid if isinstance(group, string_types) else group
     if recursive:
-        for root, dirnames, filenames in os.walk(path):
+        for root, dirnames, files in walk(path, workers):
             os.chown(root, uid, gid)
-            for filename in filenames:
-                os.chown(os.path.join(root, filename), uid, gid)
+            for filename, stat in files:
+                if stat.st_uid != uid or stat.st_gid != gid:
+                    os.chown(os.path.join(root, filename), uid, gid)
     else:
         os.chown(path, uid, gid)
@@ -24,13 +24,31 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import sys
+import errno, os, socket, struct, sys
 
 if sys.version_info[0] > 2:
     from ipaddress import ip_address
 else:
     from ipaddr import IPAddress as ip_address
 
+# <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Constants >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
+
+# Not (always) exported by the socket module, values are those of Linux
+SO_TIMESTAMPNS = getattr(socket, u'SO_TIMESTAMPNS', 35)
+SO_RXQ_OVFL = getattr(socket, u'SO_RXQ_OVFL', 40)
+IP_ADD_SOURCE_MEMBERSHIP = getattr(socket, u'IP_ADD_SOURCE_MEMBERSHIP', 39)
+
+TIMESPEC_STRUCT = struct.Struct(b'@ll')
+DROPS_STRUCT = struct.Struct(b'@I')
+
+# Socket.recvmsg() (thus ancillary data) is only available with Python 3.3+
+HAS_RECVMSG = hasattr(socket.socket, u'recvmsg')
+if HAS_RECVMSG:
+    ANCILLARY_SIZE = socket.CMSG_SPACE(TIMESPEC_STRUCT.size) + socket.CMSG_SPACE(DROPS_STRUCT.size)
+
+PROC_NET_UDP = u'/proc/net/udp'
+PROC_NET_UDP6 = u'/proc/net/udp6'
+
 
 def IPSocket(string):
     u"""
@@ -59,3 +77,127 @@ def IPSocket(string):
     except Exception:
         raise ValueError(u'{0} is not a valid IP socket.'.format(string))
     return {u'ip': ip, u'port': port}
+
+
+def tune_socket(sock, rcvbuf=None, sndbuf=None, timestamps=False, overflow=False):
+    u"""
+    Tune the kernel side of a socket and return a dictionary with the effective settings.
+
+    Buffer sizes are requested with SO_RCVBUF/SO_SNDBUF, the kernel may round them (Linux doubles the value and caps it
+    to net.core.rmem_max/wmem_max). The receive timestamps (SO_TIMESTAMPNS) and the drop counter (SO_RXQ_OVFL) are
+    delivered as ancillary data, see :func:`receive_datagram`. An option not supported by the platform is reported as
+    False instead of raising.
+
+    **Example usage**
+
+    >>> sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> settings = tune_socket(sock, rcvbuf=65536, sndbuf=65536, timestamps=True, overflow=True)
+    >>> settings[u'rcvbuf'] >= 65536 and settings[u'sndbuf'] >= 65536
+    True
+    >>> sorted(settings.keys())
+    [u'overflow', u'rcvbuf', u'sndbuf', u'timestamps']
+    >>> sock.close()
+    """
+    for name, option, value in ((u'rcvbuf', socket.SO_RCVBUF, rcvbuf), (u'sndbuf', socket.SO_SNDBUF, sndbuf)):
+        if value:
+            sock.setsockopt(socket.SOL_SOCKET, option, value)
+    settings = {
+        u'rcvbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+        u'sndbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+        u'timestamps': False,
+        u'overflow': False
+    }
+    for name, option, value in ((u'timestamps', SO_TIMESTAMPNS, timestamps), (u'overflow', SO_RXQ_OVFL, overflow)):
+        if value:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, 1)
+                settings[name] = True
+            except socket.error as e:
+                if e.errno not in (errno.ENOPROTOOPT, errno.EINVAL):
+                    raise
+    return settings
+
+
+def join_multicast_group(sock, group, source=None, interface=u'0.0.0.0'):
+    u"""
+    Add the socket to the multicast ``group`` on given ``interface`` (default is any).
+
+    If ``source`` is set then the membership is source-specific (IP_ADD_SOURCE_MEMBERSHIP) and the kernel will filter
+    out datagrams sent to the group by any other host.
+    """
+    group, interface = socket.inet_aton(group), socket.inet_aton(interface)
+    if source:
+        # struct ip_mreq_source { imr_multiaddr, imr_interface, imr_sourceaddr }
+        mreq = struct.pack(b'4s4s4s', group, interface, socket.inet_aton(source))
+        sock.setsockopt(socket.IPPROTO_IP, IP_ADD_SOURCE_MEMBERSHIP, mreq)
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, struct.pack(b'4s4s', group, interface))
+
+
+def receive_datagram(sock, size):
+    u"""
+    Receive a datagram and return a tuple (datagram, address, kernel timestamp, kernel drops).
+
+    The timestamp (in seconds) and the drops (cumulative count of datagrams the kernel dropped because the receive
+    buffer was full) are read from the ancillary data. They are None if unavailable (options not set with
+    :func:`tune_socket`, no ``recvmsg`` with Python 2) and the caller should fall back to :func:`udp_drops`. Linux only
+    attaches the drops counter once it is non-zero.
+
+    **Example usage**
+
+    >>> sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> sock.bind((u'127.0.0.1', 0))
+    >>> settings = tune_socket(sock, timestamps=True, overflow=True)
+    >>> sock.sendto(b'hello', sock.getsockname())
+    5
+    >>> datagram, address, timestamp, drops = receive_datagram(sock, 1500)
+    >>> datagram == b'hello' and address == sock.getsockname()
+    True
+    >>> timestamp is None or timestamp > 0, drops in (None, 0)
+    (True, True)
+    >>> sock.close()
+    """
+    if not HAS_RECVMSG:
+        datagram, address = sock.recvfrom(size)
+        return datagram, address, None, None
+    datagram, ancdata, flags, address = sock.recvmsg(size, ANCILLARY_SIZE)
+    timestamp = drops = None
+    for level, kind, data in ancdata:
+        if level != socket.SOL_SOCKET:
+            continue
+        if kind == SO_TIMESTAMPNS and len(data) >= TIMESPEC_STRUCT.size:
+            seconds, nanoseconds = TIMESPEC_STRUCT.unpack_from(data)
+            timestamp = seconds + nanoseconds / 1e9
+        elif kind == SO_RXQ_OVFL and len(data) >= DROPS_STRUCT.size:
+            drops = DROPS_STRUCT.unpack_from(data)[0]
+    return datagram, address, timestamp, drops
+
+
+def udp_drops(sock, path=None):
+    u"""
+    Return the count of datagrams dropped by the kernel for a UDP socket by reading ``/proc/net/udp`` (or
+    ``/proc/net/udp6`` for an IPv6 socket) or ``path`` if set.
+
+    This works without any socket option or ancillary data (e.g. with Python 2 or twisted) but requires a Linux kernel.
+    Return None if the socket is not listed (or the file is not available).
+
+    **Example usage**
+
+    >>> sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> sock.bind((u'127.0.0.1', 0))
+    >>> udp_drops(sock) in (None, 0)
+    True
+    >>> sock.close()
+    """
+    path = path or (PROC_NET_UDP6 if sock.family == socket.AF_INET6 else PROC_NET_UDP)
+    inode = unicode(os.fstat(sock.fileno()).st_ino)
+    try:
+        with open(path) as f:
+            next(f)  # Skip header
+            for line in f:
+                fields = line.split()
+                if len(fields) > 12 and fields[9] == inode:
+                    return int(fields[12])
+    except (IOError, OSError):
+        pass
+    return None
@@ -68,12 +68,16 @@ class RtpPacket(object):
         |                        header extension                       |
         |                             ....                              |
         +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+
+    The elements of one-byte (profile 0xBEDE) and two-byte (profile 0x100X) header extensions are decoded on demand
+    (see :rfc:`5285` and ``extension_elements``).
     """
 
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Constants >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
     ER_VERSION = u'RTP Header : Version must be set to 2'
     ER_PADDING_LENGTH = u'RTP Header : Bad padding length'
+    ER_CSRC_COUNT = u'RTP Header : Bad contributing sources count'
     ER_EXTENSION_LENGTH = u'RTP Header : Bad extension length'
     ER_PAYLOAD = u'RTP packet must have a payload'
 
@@ -90,6 +94,17 @@ class RtpPacket(object):
     MP2T_CLK = 90000  # MPEG2 TS clock rate [Hz]
     S_MASK = 0x0000ffff
     TS_MASK = 0xffffffff
+    ONE_BYTE_PROFILE = 0xbede
+    TWO_BYTE_PROFILE = 0x1000
+    TWO_BYTE_MASK = 0xfff0
+    ONE_BYTE_ID_SHIFT = 4
+    ONE_BYTE_L_MASK = 0x0f
+    ONE_BYTE_STOP_ID = 15
+
+    HEADER_STRUCT = struct.Struct(b'!BBHII')
+    EXTENSION_STRUCT = struct.Struct(b'!HH')
+    TWO_BYTE_STRUCT = struct.Struct(b'!BB')
+    CSRC_STRUCTS = [struct.Struct(b'!' + b'I' * cc) for cc in xrange(CC_MASK + 1)]
 
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Properties >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
@@ -148,7 +163,54 @@ class RtpPacket(object):
         >>> print(rtp.header_size)
         12
         """
-        return RtpPacket.HEADER_LENGTH + 4*len(self.csrc)
+        return (RtpPacket.HEADER_LENGTH + 4*len(self.csrc) +
+                (4 + 4*self.extension_words if self.extension else 0))
+
+    @property
+    def extension_words(self):
+        u"""Returns the length of the header extension (excluding its own header) in 32-bit words."""
+        return (len(self.extension_data) + 3) // 4
+
+    @property
+    def extension_elements(self):
+        u"""
+        Returns a dictionary with the elements of the header extension (identifier -> data) if the extension is a
+        :rfc:`5285` one-byte or two-byte header extension, None if there is no such extension.
+
+        The elements are decoded when this property is accessed for the first time (then cached).
+
+        **Example usage**
+
+        One-byte header extension with 2 elements (id=1 with 1 byte, id=2 with 3 bytes) and some padding:
+
+        >>> bytes = bytearray.fromhex(u'9021a401 cafea421 b0605ebb bede0002 10ab2233 44550000 1234')
+        >>> rtp = RtpPacket(bytes, len(bytes))
+        >>> assert(rtp.valid and rtp.extension and rtp.extension_profile == RtpPacket.ONE_BYTE_PROFILE)
+        >>> elements = rtp.extension_elements
+        >>> print(sorted(elements.keys()))
+        [1, 2]
+        >>> print(u''.join(u'%02x' % b for b in elements[1]), u''.join(u'%02x' % b for b in elements[2]))
+        ab 334455
+        >>> print(u''.join(u'%02x' % b for b in rtp.payload))
+        1234
+
+        Two-byte header extension with an element (id=7 with 2 bytes) and an empty one (id=9):
+
+        >>> bytes = bytearray.fromhex(u'9021a401 cafea421 b0605ebb 10000002 0702abcd 09000000 1234')
+        >>> rtp = RtpPacket(bytes, len(bytes))
+        >>> elements = rtp.extension_elements
+        >>> print(sorted(elements.keys()), u''.join(u'%02x' % b for b in elements[7]), len(elements[9]))
+        [7, 9] abcd 0
+
+        Any other profile is not decoded:
+
+        >>> bytes = bytearray.fromhex(u'9021a401 cafea421 b0605ebb 12340001 00000000 1234')
+        >>> print(RtpPacket(bytes, len(bytes)).extension_elements)
+        None
+        """
+        if self._extension_elements is None and self.extension:
+            self._extension_elements = RtpPacket.decode_extension(self.extension_profile, self.extension_data)
+        return self._extension_elements
 
     @property
     def payload_size(self):
@@ -220,9 +282,15 @@ class RtpPacket(object):
         >>> header += rtp.payload
         >>> rtp2 = RtpPacket(header, len(header))
         >>> assert(rtp == rtp2)
+
+        The contributing sources and the header extension are also serialized:
+
+        >>> bytes = bytearray.fromhex(u'9121a401 cafea421 b0605ebb 11111111 bede0001 10ab0000 1234')
+        >>> rtp = RtpPacket(bytes, len(bytes))
+        >>> assert(rtp.header_bytes + rtp.payload == bytes)
         """
         cc = len(self.csrc)
-        bytes = bytearray(RtpPacket.HEADER_LENGTH + 4*cc)
+        bytes = bytearray(self.header_size)
         bytes[0] = (((self.version << RtpPacket.V_SHIFT) & RtpPacket.V_MASK) +
                     (RtpPacket.P_MASK if self.padding else 0) +
                     (RtpPacket.X_MASK if self.extension else 0) +
@@ -232,10 +300,11 @@ class RtpPacket(object):
         struct.pack_into(b'!H', bytes, 2, self.sequence)
         struct.pack_into(b'!I', bytes, 4, self.timestamp)
         struct.pack_into(b'!I', bytes, 8, self.ssrc)
-        i = 12
-        for contributor in self.csrc:
-            struct.pack_into(b'!I', bytes, i, contributor)
-            i += 4
+        RtpPacket.CSRC_STRUCTS[cc].pack_into(bytes, RtpPacket.HEADER_LENGTH, *self.csrc)
+        if self.extension:
+            offset = RtpPacket.HEADER_LENGTH + 4*cc
+            RtpPacket.EXTENSION_STRUCT.pack_into(bytes, offset, self.extension_profile, self.extension_words)
+            bytes[offset+4:offset+4+len(self.extension_data)] = self.extension_data
         return bytes
 
     @property
@@ -293,7 +362,7 @@ class RtpPacket(object):
         Testing header fields value (with padding, extension and ccrc):
 
         >>> bytes = bytes.fromhex(u'b5a1a401 cafea421 b0605ebb 11111111 22222222 33333333 '
-        ...                       u'44444444 55555555 00000004 87654321 12340002')
+        ...                       u'44444444 55555555 00000001 87654321 12340002')
         >>> rtp = RtpPacket(bytes, len(bytes))
         >>> assert(rtp.valid)
         >>> assert(rtp.version == 2 and rtp.padding and rtp.extension and rtp.marker)
@@ -302,6 +371,15 @@ class RtpPacket(object):
         >>> assert(rtp.csrc[0] == 286331153 and rtp.csrc[1] == 572662306 and rtp.csrc[2] == 858993459)
         >>> assert(rtp.csrc[3] == 1145324612 and rtp.csrc[4] == 1431655765 and len(rtp.payload) == 2)
         >>> assert(rtp.payload[0] == 0x12 and rtp.payload[1] == 0x34)
+        >>> assert(rtp.extension_profile == 0 and rtp.extension_data == bytearray.fromhex(u'87654321'))
+
+        Testing header with a truncated list of contributing sources or header extension:
+
+        >>> from nose.tools import assert_equal
+        >>> bytes = bytearray.fromhex(u'82a1a401 cafea421 b0605ebb 11111111')
+        >>> assert_equal(RtpPacket(bytes, len(bytes)).errors, [RtpPacket.ER_CSRC_COUNT, RtpPacket.ER_PAYLOAD])
+        >>> bytes = bytearray.fromhex(u'90a1a401 cafea421 b0605ebb 00000002 87654321')
+        >>> assert_equal(RtpPacket(bytes, len(bytes)).errors, [RtpPacket.ER_EXTENSION_LENGTH, RtpPacket.ER_PAYLOAD])
         """
         # Fields default values
         self.version = 0
@@ -313,43 +391,49 @@ class RtpPacket(object):
         self.timestamp = 0
         self.ssrc = 0
         self.csrc = []
+        self.extension_profile = None
+        self.extension_data = bytearray()
         self.payload = []
         self._errors = None
+        self._extension_elements = None
 
         offset = RtpPacket.HEADER_LENGTH
         if length < offset:
             return
-        self.version = (bytes[0] & RtpPacket.V_MASK) >> 6
+        first, second, sequence, timestamp, ssrc = RtpPacket.HEADER_STRUCT.unpack_from(bytes)
+        self.version = (first & RtpPacket.V_MASK) >> RtpPacket.V_SHIFT
         if self.version != 2:
             return
-        self.padding = (bytes[0] & RtpPacket.P_MASK) == RtpPacket.P_MASK
+        self.padding = (first & RtpPacket.P_MASK) == RtpPacket.P_MASK
         if self.padding:  # Remove padding if present
-            padding_length = bytes[-1]
+            padding_length = bytes[length-1]
             if padding_length == 0 or length < (offset + padding_length):
                 self._errors = RtpPacket.ER_PADDING_LENGTH
                 return
             length -= padding_length
-        self.extension = (bytes[0] & RtpPacket.X_MASK) == RtpPacket.X_MASK
-        cc = bytes[0] & RtpPacket.CC_MASK
-        self.csrc = []  # cc > 0 ? new long[cc] : null
-        self.marker = (bytes[1] & RtpPacket.M_MASK) == RtpPacket.M_MASK
-        self.payload_type = bytes[1] & RtpPacket.PT_MASK
-        self.sequence = bytes[2]*256 + bytes[3]
-        self.timestamp = ((bytes[4]*256 + bytes[5])*256 + bytes[6])*256 + bytes[7]
-        self.ssrc = ((bytes[8]*256 + bytes[9])*256 + bytes[10])*256 + bytes[11]
-
-        for i in xrange(cc):
-            self.csrc.append(
-                ((bytes[offset]*256 + bytes[offset+1])*256 + bytes[offset+2])*256 + bytes[offset+3])
-            offset += 4
-            # FIXME In session.c of VLC they store per-source statistics in a rtp_source_t struct
-
-        if self.extension:  # Extension header (ignored for now)
-            extensionLength = bytes[offset+2]*256 + bytes[offset+3]
-            offset += 4 + extensionLength
+        self.extension = (first & RtpPacket.X_MASK) == RtpPacket.X_MASK
+        cc = first & RtpPacket.CC_MASK
+        self.marker = (second & RtpPacket.M_MASK) == RtpPacket.M_MASK
+        self.payload_type = second & RtpPacket.PT_MASK
+        self.sequence, self.timestamp, self.ssrc = sequence, timestamp, ssrc
+
+        if length < offset + 4*cc:
+            self._errors = RtpPacket.ER_CSRC_COUNT
+            return
+        self.csrc = list(RtpPacket.CSRC_STRUCTS[cc].unpack_from(bytes, offset))
+        offset += 4*cc
+        # FIXME In session.c of VLC they store per-source statistics in a rtp_source_t struct
+
+        if self.extension:  # Extension header (elements are decoded on demand)
+            if length < offset + 4:
+                self._errors = RtpPacket.ER_EXTENSION_LENGTH
+                return
+            self.extension_profile, words = RtpPacket.EXTENSION_STRUCT.unpack_from(bytes, offset)
+            offset += 4 + 4*words
             if length < offset:
                 self._errors = RtpPacket.ER_EXTENSION_LENGTH
                 return
+            self.extension_data = bytes[offset-4*words:offset]
 
         # And finally ... The payload !
         self.payload = bytes[offset:length]
@@ -398,9 +482,61 @@ class RtpPacket(object):
         rtp.timestamp = timestamp & RtpPacket.TS_MASK
         rtp.ssrc = 0
         rtp.csrc = []
+        rtp.extension_profile = None
+        rtp.extension_data = bytearray()
         rtp.payload = payload
         return rtp
 
+    @staticmethod
+    def decode_extension(profile, data):
+        u"""
+        Returns a dictionary with the elements (identifier -> data) of a :rfc:`5285` header extension or None if
+        ``profile`` is neither a one-byte nor a two-byte header extension. Decoding stops at the first truncated
+        element.
+
+        :param profile: Value of the field *defined by profile* of the header extension
+        :type profile: int
+        :param data: Content of the header extension (excluding its own header)
+        :type data: bytearray
+
+        **Example usage**
+
+        >>> elements = RtpPacket.decode_extension(RtpPacket.ONE_BYTE_PROFILE, bytearray.fromhex(u'00 10 ab f0 20 cd'))
+        >>> print(list(elements.keys()), u''.join(u'%02x' % b for b in elements[1]))
+        [1] ab
+        >>> print(RtpPacket.decode_extension(RtpPacket.TWO_BYTE_PROFILE, bytearray.fromhex(u'05 04 ab cd')))
+        {}
+        """
+        elements, i, length = {}, 0, len(data)
+        if profile == RtpPacket.ONE_BYTE_PROFILE:
+            while i < length:
+                byte = data[i]
+                if byte == 0:  # Padding
+                    i += 1
+                    continue
+                identifier = byte >> RtpPacket.ONE_BYTE_ID_SHIFT
+                if identifier == RtpPacket.ONE_BYTE_STOP_ID:
+                    break
+                start, i = i + 1, i + 2 + (byte & RtpPacket.ONE_BYTE_L_MASK)
+                if i > length:
+                    break
+                elements[identifier] = data[start:i]
+        elif profile & RtpPacket.TWO_BYTE_MASK == RtpPacket.TWO_BYTE_PROFILE:
+            while i < length:
+                if data[i] == 0:  # Padding
+                    i += 1
+                    continue
+                if i + 2 > length:
+                    break
+                identifier, size = RtpPacket.TWO_BYTE_STRUCT.unpack_from(data, i)
+                start, i = i + 2, i + 2 + size
+                if i > length:
+                    break
+                elements[identifier] = data[start:i]
+        else:
+            return None
+        return elements
+
     def __eq__(self, other):
         u"""
         Equality test.
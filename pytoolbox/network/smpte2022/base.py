@@ -24,11 +24,91 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import struct
-from fastxor import fast_xor_inplace
+import binascii, struct, sys, timeit
 from ...encoding import to_bytes
 from ..rtp import RtpPacket
 
+try:
+    from fastxor import fast_xor_inplace
+except ImportError:
+    fast_xor_inplace = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# XOR backends ---------------------------------------------------------------------------------------------------------
+
+def numpy_xor_inplace(a, b):
+    u"""XOR ``b`` into ``a`` (both of the same length) with :mod:`numpy`, ``a`` must be a :class:`bytearray`."""
+    if a:
+        a_array = numpy.frombuffer(a, dtype=numpy.uint8)
+        numpy.bitwise_xor(a_array, numpy.frombuffer(b, dtype=numpy.uint8), out=a_array)
+
+
+if sys.version_info[0] > 2:
+    def int_xor_inplace(a, b):
+        u"""XOR ``b`` into ``a`` (both of the same length) by converting them to (wide) integers."""
+        if a:
+            a[:] = (int.from_bytes(a, u'big') ^ int.from_bytes(b, u'big')).to_bytes(len(a), u'big')
+else:
+    def int_xor_inplace(a, b):
+        u"""XOR ``b`` into ``a`` (both of the same length) by converting them to (wide) integers."""
+        if a:
+            value = int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16)
+            a[:] = binascii.unhexlify(b'%0*x' % (2 * len(a), value))
+
+XOR_BACKENDS = {u'fastxor': fast_xor_inplace, u'numpy': numpy_xor_inplace if numpy else None,
+                u'int': int_xor_inplace}
+
+
+def benchmark_xor_backends(size=1316, number=100):
+    u"""
+    Returns a dictionary with the time (in seconds) spent by every available XOR backend to XOR ``number`` times two
+    payloads of ``size`` bytes (by default the payload of a RTP packet with 7 MPEG2-TS packets).
+
+    **Example usage**
+
+    >>> timings = benchmark_xor_backends(number=10)
+    >>> assert(u'int' in timings and min(timings.values()) > 0)
+
+    All the available backends are computing the same result:
+
+    >>> results = set()
+    >>> for name in timings:
+    ...     a = bytearray.fromhex(u'00 0f f0 ff 12')
+    ...     XOR_BACKENDS[name](a, bytearray.fromhex(u'ff ff 00 0f 12'))
+    ...     results.add(u''.join(u'%02x' % x for x in a))
+    >>> print(u', '.join(results))
+    fff0f0f000
+    """
+    a = (bytearray(range(256)) * (size // 256 + 1))[:size]
+    b = a[::-1]
+    timings = {}
+    for name, function in XOR_BACKENDS.items():
+        if function is not None:
+            timings[name] = timeit.Timer(lambda: function(a, b)).timeit(number=number)
+    return timings
+
+
+def select_xor_backend(size=1316, number=100):
+    u"""
+    Returns the name and the function of the fastest available XOR backend, detected by a micro-benchmark.
+
+    **Example usage**
+
+    >>> name, function = select_xor_backend(number=10)
+    >>> assert(XOR_BACKENDS[name] == function)
+    """
+    timings = benchmark_xor_backends(size=size, number=number)
+    name = min(timings, key=timings.get)
+    return name, XOR_BACKENDS[name]
+
+XOR_BACKEND, xor_inplace = select_xor_backend()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
 class FecPacket(object):
     u"""
     This represent a real-time transport protocol (RTP) packet.
@@ -143,6 +223,7 @@ class FecPacket(object):
     ER_SEQUENCE = u"One of the packets doesn't verify : sequence = snbase + i * offset, 0<i<na"
     ER_INDEX = u'Unable to get missing media packet index'
     ER_J = u'Unable to find a suitable j e N that satisfy : media_sequence = snbase + j * offset'
+    ER_NOT_MISSING = u'Media packet {0} is not registered as missing'
 
     HEADER_LENGTH = 16
     E_MASK = 0x80
@@ -163,6 +244,9 @@ class FecPacket(object):
     ALGORITHM_RANGE = xrange(len(ALGORITHM_NAMES))
     XOR, Hamming, ReedSolomon = ALGORITHM_RANGE
 
+    # FEC matrix geometry tables, _geometries[(offset, na)] = (deltas, indexes)
+    _geometries = {}
+
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Properties >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
     @property
@@ -239,6 +323,50 @@ class FecPacket(object):
         """
         return self.offset if self.direction == FecPacket.COL else self.na
 
+    @property
+    def protected(self):
+        u"""
+        Returns the sequence numbers of the media packets protected by this packet.
+
+        **Example usage**
+
+        >>> packets = [RtpPacket.create(65534, 100, RtpPacket.MP2T_PT, bytearray(123)),
+        ...            RtpPacket.create(    1, 200, RtpPacket.MP2T_PT, bytearray(1234))]
+        >>> fec = FecPacket.compute(10, FecPacket.XOR, FecPacket.COL, 3, 2, packets)
+        >>> print(fec.protected)
+        [65534, 1]
+        """
+        snbase = self.snbase
+        return [(snbase + delta) & RtpPacket.S_MASK for delta in FecPacket.geometry(self.offset, self.na)[0]]
+
+    @property
+    def missing(self):
+        u"""Returns the sequence numbers of the protected media packets registered as missing."""
+        mask, snbase, offset, missing = self.missing_mask, self.snbase, self.offset, []
+        j = 0
+        while mask:
+            if mask & 1:
+                missing.append((snbase + j * offset) & RtpPacket.S_MASK)
+            mask >>= 1
+            j += 1
+        return missing
+
+    @property
+    def missing_count(self):
+        u"""Returns the amount of protected media packets registered as missing."""
+        return bin(self.missing_mask).count(u'1')
+
+    @property
+    def single_missing(self):
+        u"""
+        Returns the sequence number of the missing media packet if exactly one media packet is registered as missing,
+        None otherwise.
+        """
+        mask = self.missing_mask
+        if mask and not mask & (mask - 1):
+            return (self.snbase + (mask.bit_length() - 1) * self.offset) & RtpPacket.S_MASK
+        return None
+
     @property
     def header_size(self):
         u"""
@@ -349,7 +477,7 @@ class FecPacket(object):
         self.mask = 0
         self.extended = True
         self.n = False
-        self.missing = []
+        self.missing_mask = 0  # Bit j is set if media packet snbase + j * offset is missing
         if bytes:
             packet = RtpPacket(bytes, length)
             self.sequence = packet.sequence
@@ -505,14 +633,12 @@ class FecPacket(object):
         fec.snbase = packets[0].sequence
         # Detect maximum length of packets payload and check packets validity
         size = 0
-        i = 0
-        for packet in packets:
+        for packet, delta in zip(packets, FecPacket.geometry(fec.offset, fec.na)[0]):
             if not packet.validMP2T:
                 raise ValueError(to_bytes(FecPacket.ER_VALID_MP2T))
-            if packet.sequence != (fec.snbase + i*fec.offset) % RtpPacket.S_MASK:
+            if packet.sequence != (fec.snbase + delta) & RtpPacket.S_MASK:
                 raise ValueError(to_bytes(FecPacket.ER_SEQUENCE))
             size = max(size, packet.payload_size)
-            i += 1
         # Create payload recovery field according to size/length
         fec.payload_recovery = bytearray(size)
         # Compute FEC packet's fields based on input packets
@@ -525,10 +651,7 @@ class FecPacket(object):
             payload = packet.payload
             if len(packet.payload) < size:
                 payload = payload + bytearray(size - len(packet.payload))
-            fast_xor_inplace(fec.payload_recovery, payload)
-            # NUMPY fec.payload_recovery = bytearray(numpy.bitwise_xor(fec.payload_recovery, payload))
-            # XOR LOOP for i in xrange(min(size, len(packet.payload))):
-            # XOR LOOP     fec.payload_recovery[i] ^= packet.payload[i]
+            xor_inplace(fec.payload_recovery, payload)
         return fec
 
     def set_missing(self, media_sequence):
@@ -539,8 +662,8 @@ class FecPacket(object):
 
         >>> packets = [RtpPacket.create(65530, 65530, RtpPacket.MP2T_PT, bytearray(u'gaga', u'utf-8')),
         ...            RtpPacket.create(65533, 65533, RtpPacket.MP2T_PT, bytearray(u'salut', u'utf-8')),
-        ...            RtpPacket.create(    1,     1, RtpPacket.MP2T_PT, bytearray(u'12345', u'utf-8')),
-        ...            RtpPacket.create(    4,     4, RtpPacket.MP2T_PT, bytearray(u'robot', u'utf-8'))]
+        ...            RtpPacket.create(    0,     1, RtpPacket.MP2T_PT, bytearray(u'12345', u'utf-8')),
+        ...            RtpPacket.create(    3,     4, RtpPacket.MP2T_PT, bytearray(u'robot', u'utf-8'))]
         >>> fec = FecPacket.compute(4, FecPacket.XOR, FecPacket.COL, 3, 4, packets)
         >>> print(fec)
         errors                = []
@@ -570,73 +693,101 @@ class FecPacket(object):
 
         Testing set / get of a unique missing value:
 
-        >>> print(fec.set_missing(1))
+        >>> print(fec.set_missing(0))
         2
-        >>> print(fec.missing[0])
-        1
-        >>> print(len(fec.missing))
+        >>> print(fec.missing[0], fec.single_missing)
+        0 0
+        >>> print(fec.missing_count)
         1
 
         Testing simple recovery of a unique value:
 
-        >>> print(fec.set_recovered(1))
+        >>> print(fec.set_recovered(0))
         2
-        >>> print(len(fec.missing))
-        0
+        >>> print(fec.missing_count, fec.single_missing)
+        0 None
 
         Testing set / get of multiple missing values (including re-setting of a value):
 
-        >>> print(fec.set_missing(4))
+        >>> print(fec.set_missing(3))
         3
-        >>> print(fec.set_missing(4))
+        >>> print(fec.set_missing(3))
         3
-        >>> print(len(fec.missing))
-        1
+        >>> print(fec.missing_count, fec.single_missing)
+        1 3
         >>> print(fec.set_missing(fec.snbase + fec.offset))
         1
         >>> print(fec.set_missing(fec.snbase))
         0
-        >>> print(len(fec.missing))
-        3
+        >>> print(fec.missing_count, fec.single_missing)
+        3 None
         >>> print(fec.missing)
-        [4, 65533, 65530]
+        [65530, 65533, 3]
 
         Testing re-recovery of a value:
 
-        >>> fec.set_recovered(4); fec.set_recovered(4)
+        >>> fec.set_recovered(3); fec.set_recovered(3)
         Traceback (most recent call last):
             ...
-        ValueError: list.remove(x): x not in list
+        ValueError: Media packet 3 is not registered as missing
         >>> print(fec.missing)
-        [65533, 65530]
+        [65530, 65533]
         """
         j = self.computeJ(media_sequence)
         if j is None:
             raise ValueError(FecPacket.ER_J)
-        if not media_sequence in self.missing:
-            self.missing.append(media_sequence)
+        self.missing_mask |= 1 << j
         return j
 
     def set_recovered(self, media_sequence):
         u"""
-        TODO
+        Unregister a protected media packet registered as missing.
         """
         j = self.computeJ(media_sequence)
         if j is None:
             raise ValueError(FecPacket.ER_J)
-        self.missing.remove(media_sequence)
+        if not self.missing_mask & (1 << j):
+            raise ValueError(to_bytes(FecPacket.ER_NOT_MISSING.format(media_sequence)))
+        self.missing_mask &= ~(1 << j)
         return j
 
     def computeJ(self, media_sequence):
         u"""
-        TODO
+        Returns the index j of a protected media packet (media_sequence = snbase + j * offset) or None if the media
+        packet is not protected by this packet.
+
+        **Example usage**
+
+        >>> packets = [RtpPacket.create(65535, 100, RtpPacket.MP2T_PT, bytearray(10)),
+        ...            RtpPacket.create(    4, 200, RtpPacket.MP2T_PT, bytearray(10))]
+        >>> fec = FecPacket.compute(12, FecPacket.XOR, FecPacket.COL, 5, 2, packets)
+        >>> print(fec.computeJ(65535), fec.computeJ(4), fec.computeJ(9), fec.computeJ(65534))
+        0 1 None None
+        """
+        return FecPacket.geometry(self.offset, self.na)[1].get((media_sequence - self.snbase) & RtpPacket.S_MASK)
+
+    @staticmethod
+    def geometry(offset, na):
+        u"""
+        Returns the (cached) geometry tables of a FEC packet protecting ``na`` media packets spaced by ``offset``.
+
+        * ``deltas[j]`` is the delta between the sequence number of the j-th protected media packet and *snbase*.
+        * ``indexes[delta]`` is the reverse mapping (j) of ``deltas``.
+
+        **Example usage**
+
+        >>> deltas, indexes = FecPacket.geometry(4, 5)
+        >>> print(deltas, indexes[12])
+        (0, 4, 8, 12, 16) 3
+        >>> assert(FecPacket.geometry(4, 5)[0] is deltas)
         """
-        delta = media_sequence - self.snbase
-        if delta < 0:
-            delta = RtpPacket.S_MASK + delta
-        if delta % self.offset != 0:
-            return None
-        return int(delta / self.offset)
+        key = (offset, na)
+        try:
+            return FecPacket._geometries[key]
+        except KeyError:
+            deltas = tuple(j * offset for j in xrange(na))
+            geometry = FecPacket._geometries[key] = (deltas, dict((delta, j) for j, delta in enumerate(deltas)))
+            return geometry
 
     def __eq__(self, other):
         u"""
@@ -25,8 +25,9 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import logging, socket, struct, time
+import logging, socket, time
 from ....encoding import to_bytes
+from ...ip import join_multicast_group, receive_datagram, tune_socket, udp_drops
 from ...rtp import RtpPacket
 from ..generator import FecGenerator
 
@@ -46,8 +47,8 @@ class SocketFecGenerator(object):
     >>> media = IPSocket(SocketFecGenerator.DEFAULT_MEDIA)
     >>> col = IPSocket(SocketFecGenerator.DEFAULT_COL)
     >>> row = IPSocket(SocketFecGenerator.DEFAULT_ROW)
-    >>> generator = SocketFecGenerator(media, col, row, 5, 6)
-    >>> print(generator._generator)
+    >>> generator = SocketFecGenerator(media, col, row, 5, 6, rcvbuf=4*1024*1024)
+    >>> print(generator)
     Matrix size L x D            = 5 x 6
     Total invalid media packets  = 0
     Total media packets received = 0
@@ -55,6 +56,8 @@ class SocketFecGenerator(object):
     Row    sequence number       = 1
     Media  sequence number       = None
     Medias buffer (seq. numbers) = []
+    Kernel dropped packets       = 0
+    Inter-arrival jitter (ms)    = 0.000
     """
 
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Properties >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
@@ -65,7 +68,8 @@ class SocketFecGenerator(object):
 
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Constructor >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
-    def __init__(self, media_socket, col_socket, row_socket, L, D):
+    def __init__(self, media_socket, col_socket, row_socket, L, D, rcvbuf=None, sndbuf=None, timestamps=True,
+                 source=None):
         u"""
         Construct a SocketFecGenerator.
 
@@ -79,15 +83,31 @@ class SocketFecGenerator(object):
         :type L: int
         :param D: Vertical size of the FEC matrix (rows)
         :type D: int
+        :param rcvbuf: Size of the kernel receive buffer of the media socket (in bytes, None to keep default)
+        :type rcvbuf: int
+        :param sndbuf: Size of the kernel send buffer of the FEC socket (in bytes, None to keep default)
+        :type sndbuf: int
+        :param timestamps: Use the kernel receive timestamps (SO_TIMESTAMPNS) to compute the jitter
+        :type timestamps: bool
+        :param source: IP address of the media source, to join the group as a source-specific multicast member
+        :type source: str
         """
         self.media_socket = media_socket
         self.col_socket = col_socket
         self.row_socket = row_socket
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.timestamps = timestamps
+        self.source = source
+        self.kernel_drops = 0
+        self.jitter = 0.0
         self._generator = FecGenerator(L, D)
         self._generator.on_new_col = self.on_new_col
         self._generator.on_new_row = self.on_new_row
         self._generator.on_reset = self.on_reset
         self._running = False
+        self._output = None
+        self._previous = None
 
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Properties >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
@@ -96,6 +116,15 @@ class SocketFecGenerator(object):
         u"""Return True if FEC generator is running."""
         return self._running
 
+    @property
+    def output(self):
+        u"""Return the socket used to send FEC packets (created and tuned at first call)."""
+        if self._output is None:
+            self._output = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            self._output.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+            tune_socket(self._output, sndbuf=self.sndbuf)
+        return self._output
+
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Functions >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
     def run(self, timeout, stop_time=None):
@@ -118,6 +147,7 @@ class SocketFecGenerator(object):
         """
         if self._running:
             raise NotImplementedError(to_bytes(u'SMPTE 2022-1 FEC Generator already running'))
+        sock = None
         try:
             self._running = True
             log.info(u'SMPTE 2022-1 FEC Generator by David Fischer')
@@ -127,27 +157,41 @@ class SocketFecGenerator(object):
             start_time = time.time()
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+            settings = tune_socket(sock, rcvbuf=self.rcvbuf, timestamps=self.timestamps, overflow=True)
+            log.info(u'Media socket settings {0}'.format(settings))
             sock.bind((self.media_socket[u'ip'], self.media_socket[u'port']))
             # Tell the operating system to add the socket to the multicast group on all interfaces
-            group = socket.inet_aton(self.media_socket[u'ip'])
-            mreq = struct.pack(b'4sL', group, socket.INADDR_ANY)
-            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            join_multicast_group(sock, self.media_socket[u'ip'], source=self.source)
             sock.settimeout(timeout)  # Time-out must be enabled to react to stop requests
             while self._running:      # Receive loop
                 try:
-                    datagram, address = sock.recvfrom(1024)
+                    datagram, address, arrival_time, drops = receive_datagram(sock, 1500)
                     media = RtpPacket(bytearray(datagram), len(datagram))
                     log.debug(u'Incoming media packet seq={0} ts={1} psize={2} ssrc={3} address={4}'.format(
                               media.sequence, media.timestamp, media.payload_size, media.ssrc, address))
+                    if drops is not None:
+                        self.kernel_drops = drops
+                    self.update_jitter(media, arrival_time or time.time())
                     self._generator.put_media(media)
                 except socket.timeout:
                     pass  # Handle time-out by doing nothing more than re-looping
                 delta_time = time.time() - start_time
                 if stop_time and delta_time > stop_time:
                     break
+            self.kernel_drops = max(self.kernel_drops, udp_drops(sock) or 0)
             log.info(u'Stopped listening {0} after {1} seconds'.format(self.media_socket, delta_time))
+            log.info(u'Statistics\n{0}'.format(self))
         finally:
             self.stop()
+            if sock is not None:
+                sock.close()
+            self.close_output()
+
+    def close_output(self):
+        u"""Close the socket used to send FEC packets (it is created again if needed)."""
+        if self._output is not None:
+            self._output.close()
+            self._output = None
 
     def stop(self):
         u"""
@@ -159,6 +203,37 @@ class SocketFecGenerator(object):
         log.info(u'\nGenerator stopped\n')
         self._running = False
 
+    def update_jitter(self, media, arrival_time):
+        u"""
+        Update the inter-arrival jitter estimate with an incoming media packet, as specified by RFC 3550 (6.4.1).
+
+        :param media: Incoming media packet
+        :type media: RtpPacket
+        :param arrival_time: Arrival time of the packet (in seconds, kernel timestamp if available)
+        :type arrival_time: float
+
+        **Example usage**
+
+        >>> from ...ip import IPSocket
+        >>> generator = SocketFecGenerator(IPSocket(SocketFecGenerator.DEFAULT_MEDIA), None, None, 5, 6)
+        >>> generator.update_jitter(RtpPacket.create(0, 0, RtpPacket.MP2T_PT, bytearray(8)), 10.0)
+        >>> generator.update_jitter(RtpPacket.create(1, 900, RtpPacket.MP2T_PT, bytearray(8)), 10.026)
+        >>> print(u'{0:.6f}'.format(generator.jitter))
+        0.001000
+        """
+        if self._previous is not None:
+            previous_timestamp, previous_time = self._previous
+            # Difference of the RTP timestamps (in seconds) with respect to the 32-bit wrap-around
+            delta = ((media.timestamp - previous_timestamp + 0x80000000) & 0xffffffff) - 0x80000000
+            transit = (arrival_time - previous_time) - delta / media.clock_rate
+            self.jitter += (abs(transit) - self.jitter) / 16
+        self._previous = (media.timestamp, arrival_time)
+
+    def __str__(self):
+        u"""Returns a string containing the statistics of the FEC streams generator and of the media socket."""
+        return u'{0}\nKernel dropped packets       = {1}\nInter-arrival jitter (ms)    = {2:.3f}'.format(
+               self._generator, self.kernel_drops, self.jitter * 1000)
+
     def on_new_col(self, col, generator):
         u"""
         Called by ``self=FecGenerator`` when a new column FEC packet is generated and available for output.
@@ -173,9 +248,7 @@ class SocketFecGenerator(object):
         col_rtp = RtpPacket.create(col.sequence, 0, RtpPacket.DYNAMIC_PT, col.bytes)
         log.debug(u'Send COL FEC packet seq={0} snbase={1} LxD={2}x{3} trec={4} socket={5}'.format(
                   col.sequence, col.snbase, col.L, col.D, col.timestamp_recovery, self.col_socket))
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-        sock.sendto(col_rtp.bytes, (self.col_socket[u'ip'], self.col_socket[u'port']))
+        self.output.sendto(col_rtp.bytes, (self.col_socket[u'ip'], self.col_socket[u'port']))
 
     def on_new_row(self, row, generator):
         u"""
@@ -191,9 +264,7 @@ class SocketFecGenerator(object):
         row_rtp = RtpPacket.create(row.sequence, 0, RtpPacket.DYNAMIC_PT, row.bytes)
         log.debug(u'Send ROW FEC packet seq={0} snbase={1} LxD={2}x{3} trec={4} socket={5}'.format(
                   row.sequence, row.snbase, row.L, row.D, row.timestamp_recovery, self.row_socket))
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-        sock.sendto(row_rtp.bytes, (self.row_socket[u'ip'], self.row_socket[u'port']))
+        self.output.sendto(row_rtp.bytes, (self.row_socket[u'ip'], self.row_socket[u'port']))
 
     def on_reset(self, media, generator):
         u"""
@@ -238,6 +309,9 @@ def main():
     HELP_TIMEOUT = u'Set timeout for socket operations (in seconds)'
     HELP_PROFILE = u'Set profiling output file (this enable profiling)'
     HELP_STOP    = u'Automatic stop time (in seconds)'
+    HELP_RCVBUF  = u'Size of the kernel receive buffer (in bytes)'
+    HELP_SNDBUF  = u'Size of the kernel send buffer (in bytes)'
+    HELP_SOURCE  = u'IP address of the source (source-specific multicast)'
 
     dmedia = SocketFecGenerator.DEFAULT_MEDIA
     dcol = SocketFecGenerator.DEFAULT_COL
@@ -255,6 +329,9 @@ def main():
     parser.add_argument(u'-t', u'--timeout',      type=int,           help=HELP_TIMEOUT, nargs='?', default=None)
     parser.add_argument(u'-s', u'--stop-time',    type=int,           help=HELP_STOP,    nargs='?', default=None)
     parser.add_argument(u'-p', u'--profile',      type=FileType('w'), help=HELP_PROFILE, nargs='?', default=None)
+    parser.add_argument(u'--rcvbuf',              type=int,           help=HELP_RCVBUF,  nargs='?', default=None)
+    parser.add_argument(u'--sndbuf',              type=int,           help=HELP_SNDBUF,  nargs='?', default=None)
+    parser.add_argument(u'--source',              type=unicode,       help=HELP_SOURCE,  nargs='?', default=None)
     args = parser.parse_args()
 
     def handle_stop_signal(SIGNAL, stack):
@@ -263,7 +340,8 @@ def main():
     try:
         signal.signal(signal.SIGTERM, handle_stop_signal)
         signal.signal(signal.SIGINT, handle_stop_signal)
-        generator = SocketFecGenerator(args.media, args.col, args.row, args.l, args.d)
+        generator = SocketFecGenerator(args.media, args.col, args.row, args.l, args.d, rcvbuf=args.rcvbuf,
+                                       sndbuf=args.sndbuf, source=args.source)
         if args.profile:
             from pycallgraph import PyCallGraph
             from pycallgraph.output import GraphvizOutput
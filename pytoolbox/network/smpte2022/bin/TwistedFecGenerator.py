@@ -27,6 +27,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import logging, socket
 from twisted.internet.protocol import DatagramProtocol
+from ...ip import join_multicast_group, tune_socket, udp_drops
 from ...rtp import RtpPacket
 from ..generator import FecGenerator
 
@@ -51,7 +52,7 @@ class TwistedFecGenerator(DatagramProtocol):
     >>> generator = TwistedFecGenerator(media[u'ip'], u'MyTwistedFecGenerator', col, row, 5, 6)
     >>> reactor.listenMulticast(media[u'port'], generator, listenMultiple=True) # doctest: +ELLIPSIS
     <....TwistedFecGenerator... on 5004>
-    >>> print(generator._generator)
+    >>> print(generator)
     Matrix size L x D            = 5 x 6
     Total invalid media packets  = 0
     Total media packets received = 0
@@ -59,6 +60,7 @@ class TwistedFecGenerator(DatagramProtocol):
     Row    sequence number       = 1
     Media  sequence number       = None
     Medias buffer (seq. numbers) = []
+    Kernel dropped packets       = 0
 
     Then you only need to start reactor with ``reactor.run()``.
     """
@@ -71,7 +73,7 @@ class TwistedFecGenerator(DatagramProtocol):
 
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Constructor >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
-    def __init__(self, group, name, col_socket, row_socket, L, D):
+    def __init__(self, group, name, col_socket, row_socket, L, D, rcvbuf=None, sndbuf=None, source=None):
         u"""
         Construct a TwistedFecGenerator.
 
@@ -87,22 +89,54 @@ class TwistedFecGenerator(DatagramProtocol):
         :type L: int
         :param D: Vertical size of the FEC matrix (rows)
         :type D: int
+        :param rcvbuf: Size of the kernel receive buffer of the media socket (in bytes, None to keep default)
+        :type rcvbuf: int
+        :param sndbuf: Size of the kernel send buffer of the FEC socket (in bytes, None to keep default)
+        :type sndbuf: int
+        :param source: IP address of the media source, to join the group as a source-specific multicast member
+        :type source: str
         """
         self.group = group
         self.name = name
         self.col_socket = col_socket
         self.row_socket = row_socket
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.source = source
+        self._output = None
         self._generator = FecGenerator(L, D)
         self._generator.on_new_col = self.on_new_col
         self._generator.on_new_row = self.on_new_row
         self._generator.on_reset = self.on_reset
 
+    # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Properties >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
+
+    @property
+    def kernel_drops(self):
+        u"""Return the count of media packets dropped by the kernel (receive buffer overflow) or 0 if unknown."""
+        transport = getattr(self, u'transport', None)
+        return (udp_drops(transport.getHandle()) or 0) if transport else 0
+
+    @property
+    def output(self):
+        u"""Return the socket used to send FEC packets (created and tuned at first call)."""
+        if self._output is None:
+            self._output = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            self._output.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+            tune_socket(self._output, sndbuf=self.sndbuf)
+        return self._output
+
     # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Functions >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
     def startProtocol(self):
         log.info(u'SMPTE 2022-1 FEC Generator by David Fischer')
         log.info(u'started Listening {0}'.format(self.group))
-        self.transport.joinGroup(self.group)
+        handle = self.transport.getHandle()
+        log.info(u'Media socket settings {0}'.format(tune_socket(handle, rcvbuf=self.rcvbuf)))
+        if self.source:
+            join_multicast_group(handle, self.group, source=self.source)
+        else:
+            self.transport.joinGroup(self.group)
         self.transport.setLoopbackMode(False)
         self.transport.setTTL(1)
 
@@ -112,6 +146,12 @@ class TwistedFecGenerator(DatagramProtocol):
                   media.sequence, media.timestamp, media.payload_size, socket))
         self._generator.put_media(media)
 
+    def stopProtocol(self):
+        log.info(u'Statistics\n{0}'.format(self))
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+
     def on_new_col(self, col, generator):
         u"""
         Called by ``self=FecGenerator`` when a new column FEC packet is generated and available for output.
@@ -126,9 +166,7 @@ class TwistedFecGenerator(DatagramProtocol):
         col_rtp = RtpPacket.create(col.sequence, 0, RtpPacket.DYNAMIC_PT, col.bytes)
         log.debug(u'Send COL FEC packet seq={0} snbase={1} LxD={2}x{3} trec={4} socket={5}'.format(
                   col.sequence, col.snbase, col.L, col.D, col.timestamp_recovery, self.col_socket))
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-        sock.sendto(col_rtp.bytes, (self.col_socket[u'ip'], self.col_socket[u'port']))
+        self.output.sendto(col_rtp.bytes, (self.col_socket[u'ip'], self.col_socket[u'port']))
 
     def on_new_row(self, row, generator):
         u"""
@@ -144,9 +182,7 @@ class TwistedFecGenerator(DatagramProtocol):
         row_rtp = RtpPacket.create(row.sequence, 0, RtpPacket.DYNAMIC_PT, row.bytes)
         log.debug(u'Send ROW FEC packet seq={0} snbase={1} LxD={2}x{3} trec={4} socket={5}'.format(
                   row.sequence, row.snbase, row.L, row.D, row.timestamp_recovery, self.row_socket))
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-        sock.sendto(row_rtp.bytes, (self.row_socket[u'ip'], self.row_socket[u'port']))
+        self.output.sendto(row_rtp.bytes, (self.row_socket[u'ip'], self.row_socket[u'port']))
 
     def on_reset(self, media, generator):
         u"""
@@ -162,6 +198,10 @@ class TwistedFecGenerator(DatagramProtocol):
         log.warning(u'Media seq={0} is out of sequence (expected {1}) : FEC algorithm resetted !'.format(
                     media.sequence, generator._media_sequence))
 
+    def __str__(self):
+        u"""Returns a string containing the statistics of the FEC streams generator and of the media socket."""
+        return u'{0}\nKernel dropped packets       = {1}'.format(self._generator, self.kernel_drops)
+
     # @staticmethod
     # def test():
     #     u"""
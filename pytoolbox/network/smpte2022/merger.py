@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+#**********************************************************************************************************************#
+#                                        PYTOOLBOX - TOOLBOX FOR PYTHON SCRIPTS
+#
+#  Main Developer : David Fischer (david.fischer.ch@gmail.com)
+#  Copyright      : Copyright (c) 2012-2013 David Fischer. All rights reserved.
+#
+#**********************************************************************************************************************#
+#
+# This file is part of David Fischer's pytoolbox Project.
+#
+# This project is free software: you can redistribute it and/or modify it under the terms of the EUPL v. 1.1 as provided
+# by the European Commission. This project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the European Union Public License for more details.
+#
+# You should have received a copy of the EUPL General Public License along with this project.
+# If not, see he EUPL licence v1.1 is available in 22 languages:
+#     22-07-2013, <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>
+#
+# Retrieved from https://github.com/davidfischer-ch/pytoolbox.git
+
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import select, time
+from ...encoding import to_bytes
+from ..rtp import RtpPacket
+
+
+class SeamlessMerger(object):
+    u"""
+    A SMPTE 2022-7 seamless protection switching merger.
+
+    This merger accept the same RTP media stream received from two paths (e.g. two sockets), output the first-arriving
+    copy of every media packet and drop the duplicates. The media packets that are already merged are tracked in a
+    circular window indexed by sequence number. Every slot of the window stores a bitmask of the paths that delivered
+    the packet, so testing, inserting and evicting a sequence number are O(1) operations.
+
+    The output can be directly connected to a :class:`FecReceiver` to combine both protections.
+
+    **Example usage**
+
+    Merge two paths (the second one lagging, and missing some packets) into a FEC receiver:
+
+    >>> from StringIO import StringIO
+    >>> from .receiver import FecReceiver
+    >>> output = StringIO()
+    >>> receiver = FecReceiver(output)
+    >>> merger = SeamlessMerger(receiver, window=16)
+    >>> for i in xrange(40):
+    ...     merger.put_media(RtpPacket.create(i, i * 100, RtpPacket.MP2T_PT, str(i % 10)), 0, arrival_time=i)
+    ...     if i >= 2 and i % 7 != 0:
+    ...         merger.put_media(RtpPacket.create(i - 2, i * 100, RtpPacket.MP2T_PT, str(i % 10)), 1,
+    ...                          arrival_time=i)
+    >>> receiver.flush()
+    >>> print(output.getvalue())
+    0123456789012345678901234567890123456789
+    >>> print(merger)
+    Path  Received Invalid Duplicated Late Lost Skew Max skew
+    0           40       0          0    0    0    0        0
+    1           33       0         33    0    3    2        2
+    Merged packets output : 40
+    Merged packets missing : 0
+    Window resets : 0
+    """
+
+    # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Constants >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
+
+    ER_PATH = u'Path must be 0 or 1, got {0}'
+    ER_WINDOW = u'Window must be a power of 2 in range [2..32768], got {0}'
+
+    PATHS = xrange(2)
+    ALL_PATHS = 0x3  # Bitmask of a media packet received on both paths
+
+    # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Constructor >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
+
+    def __init__(self, receiver=None, window=1024, onlyMP2TS=True):
+        u"""
+        Construct a SeamlessMerger.
+
+        :param receiver: Where to output merged media packets (something with a ``put_media`` method), may be None.
+        :type receiver: FecReceiver
+        :param window: Size of the deduplication window in packets (must be a power of 2), maximum skew between paths.
+        :type window: int
+        :param onlyMP2TS: Only accept valid RTP packets containing a MPEG2-TS payload.
+        :type onlyMP2TS: bool
+
+        **Example usage**
+
+        >>> SeamlessMerger(window=1000)
+        Traceback (most recent call last):
+            ...
+        ValueError: Window must be a power of 2 in range [2..32768], got 1000
+        """
+        if window < 2 or window > 32768 or window & (window - 1):
+            raise ValueError(to_bytes(SeamlessMerger.ER_WINDOW.format(window)))
+        self.receiver = receiver
+        self.onlyMP2TS = onlyMP2TS
+        self.window = window
+        self.highest = None  # Highest sequence number merged so far (None = startup state)
+        # Merged media packets, window[sequence & mask] = bitmask of the paths that delivered the packet
+        self._mask = window - 1
+        self._window = bytearray([SeamlessMerger.ALL_PATHS]) * window
+        self._times = [0.0] * window  # Arrival time of the first copy of the media packets
+        # Statistics about merged stream
+        self.media_output = 0   # Output (merged) media packets counter
+        self.media_missing = 0  # Media packets missing on both paths counter
+        self.resets = 0         # Window resets counter (sequence jump larger than the window)
+        # Statistics about paths
+        self.received = [0, 0]    # Received media packets counters
+        self.invalid = [0, 0]     # Invalid media packets counters
+        self.duplicated = [0, 0]  # Media packets already output from the other path counters
+        self.late = [0, 0]        # Media packets received too late (out of the window) counters
+        self.lost = [0, 0]        # Media packets evicted from the window without being received from the path
+        self.skew = [0, 0]        # Last measured delay of the path compared to the first-arriving copy
+        self.max_skew = [0, 0]    # Maximum measured delay of the path compared to the first-arriving copy
+
+    # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Functions >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
+
+    def on_media(self, media, path):
+        u"""
+        Called by SeamlessMerger when a media packet is merged (first-arriving copy) and available for output.
+
+        By default this method put the media packet into ``receiver`` (if any).
+
+        .. seealso::
+
+            You can `monkey patch <http://stackoverflow.com/questions/5626193/what-is-monkey-patching>`_ it.
+
+        :param media: Merged media packet
+        :type media: RtpPacket
+        :param path: The path the media packet was received from
+        :type path: int
+        """
+        if self.receiver:
+            self.receiver.put_media(media, self.onlyMP2TS)
+
+    def put_media(self, media, path, arrival_time=None):
+        u"""
+        Put an incoming media packet received from ``path``, output it if this is the first-arriving copy.
+
+        :param media: Incoming media packet
+        :type media: RtpPacket
+        :param path: The path the media packet was received from (0 or 1)
+        :type path: int
+        :param arrival_time: Arrival time of the media packet (defaults to now), used to measure the skew between paths
+        :type arrival_time: float
+
+        **Example usage**
+
+        A packet is output once, the late duplicates are ignored:
+
+        >>> merger = SeamlessMerger(window=4)
+        >>> merger.on_media = lambda media, path: print(u'output {0} from {1}'.format(media.sequence, path))
+        >>> for sequence, path in ((10, 1), (10, 0), (12, 0), (11, 1), (11, 0), (12, 1), (65535, 0), (13, 1)):
+        ...     merger.put_media(RtpPacket.create(sequence, 0, RtpPacket.MP2T_PT, u'salut'), path)
+        output 10 from 1
+        output 12 from 0
+        output 11 from 1
+        output 13 from 1
+        >>> print(merger.duplicated, merger.late, merger.highest)
+        [2, 1] [1, 0] 13
+
+        Any sequence jump larger than the window reset the window:
+
+        >>> merger.put_media(RtpPacket.create(1000, 0, RtpPacket.MP2T_PT, u'salut'), 0)
+        output 1000 from 0
+        >>> print(merger.resets, merger.highest)
+        1 1000
+        """
+        if path not in SeamlessMerger.PATHS:
+            raise ValueError(to_bytes(SeamlessMerger.ER_PATH.format(path)))
+        self.received[path] += 1
+        if not (media.validMP2T if self.onlyMP2TS else media.valid):
+            self.invalid[path] += 1
+            return
+        arrival_time = time.time() if arrival_time is None else arrival_time
+        sequence, bit = media.sequence, 1 << path
+        if self.highest is None:
+            self.highest = sequence
+            self._window[sequence & self._mask] = 0
+        delta = (sequence - self.highest) & RtpPacket.S_MASK
+        if delta and delta < 0x8000:
+            # Newer packet, slide the window and account for media packets that are evicted
+            if delta >= self.window:
+                self.resets += 1
+                self._window[:] = bytearray([SeamlessMerger.ALL_PATHS]) * self.window
+                self._window[sequence & self._mask] = 0
+            else:
+                window, mask = self._window, self._mask
+                for evicted in xrange(self.highest + 1, self.highest + delta + 1):
+                    index = evicted & mask
+                    paths = window[index]
+                    if paths == 0:
+                        self.media_missing += 1
+                    elif paths != SeamlessMerger.ALL_PATHS:
+                        self.lost[1 - (paths >> 1)] += 1
+                    window[index] = 0
+            self.highest = sequence
+        elif delta and (self.highest - sequence) & RtpPacket.S_MASK >= self.window:
+            self.late[path] += 1
+            return
+        index = sequence & self._mask
+        paths = self._window[index]
+        if paths:
+            # Already output from the other path (or received twice from the same path)
+            self.duplicated[path] += 1
+            if not paths & bit:
+                self._window[index] = paths | bit
+                skew = arrival_time - self._times[index]
+                self.skew[path] = skew
+                if skew > self.max_skew[path]:
+                    self.max_skew[path] = skew
+            return
+        self._window[index] = bit
+        self._times[index] = arrival_time
+        self.skew[path] = 0
+        self.media_output += 1
+        self.on_media(media, path)
+
+    def poll(self, sockets, timeout=None, size=1500):
+        u"""
+        Wait for incoming media packets on the sockets (one per path) and put them into the merger.
+        Returns the number of received datagrams (0 if timeout).
+
+        :param sockets: The sockets of the paths (the index of the socket is the path)
+        :type sockets: list
+        :param timeout: Maximum time to wait for a datagram (in seconds, or None to wait forever)
+        :type timeout: float
+        :param size: Maximum size of a datagram
+        :type size: int
+
+        **Example usage**
+
+        >>> import socket
+        >>> sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for path in SeamlessMerger.PATHS]
+        >>> for sock in sockets:
+        ...     sock.bind((u'127.0.0.1', 0))
+        >>> merger = SeamlessMerger()
+        >>> for sock in sockets:
+        ...     _ = sock.sendto(RtpPacket.create(7, 700, RtpPacket.MP2T_PT, bytearray(188)).bytes, sock.getsockname())
+        >>> count = 0
+        >>> while count < 2:
+        ...     count += merger.poll(sockets, timeout=1)
+        >>> print(merger.received, sum(merger.duplicated), merger.media_output)
+        [1, 1] 1 1
+        >>> for sock in sockets:
+        ...     sock.close()
+        """
+        readable = select.select(sockets, [], [], timeout)[0]
+        for sock in readable:
+            datagram = sock.recv(size)
+            self.put_media(RtpPacket(bytearray(datagram), len(datagram)), sockets.index(sock))
+        return len(readable)
+
+    def __str__(self):
+        u"""
+        Return a string representing this instance.
+
+        **Example usage**
+
+        >>> print(SeamlessMerger())
+        Path  Received Invalid Duplicated Late Lost Skew Max skew
+        0            0       0          0    0    0    0        0
+        1            0       0          0    0    0    0        0
+        Merged packets output : 0
+        Merged packets missing : 0
+        Window resets : 0
+        """
+        lines = [u'Path  Received Invalid Duplicated Late Lost Skew Max skew']
+        for path in SeamlessMerger.PATHS:
+            lines.append(u'%-4d%10d%8d%11d%5d%5d%5.3g%9.3g' % (
+                         path, self.received[path], self.invalid[path], self.duplicated[path], self.late[path],
+                         self.lost[path], self.skew[path], self.max_skew[path]))
+        lines += [u'Merged packets output : {0}'.format(self.media_output),
+                  u'Merged packets missing : {0}'.format(self.media_missing),
+                  u'Window resets : {0}'.format(self.resets)]
+        return u'\n'.join(lines)
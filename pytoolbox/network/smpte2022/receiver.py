@@ -27,7 +27,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from ...encoding import to_bytes
 from ..ip import IPSocket
 from ..rtp import RtpPacket
-from .base import FecPacket
+from .base import FecPacket, xor_inplace
 
 
 class FecReceiver(object):
@@ -107,8 +107,6 @@ class FecReceiver(object):
     ER_COL_OVERWRITE = u'Another column FEC packet is already registered to protect media packet n°{0}'
     ER_ROW_MISMATCH = u'Row FEC packet n°{0}, expected n°{1}'
     ER_ROW_OVERWRITE = u'Another row FEC packet is already registered to protect media packet n°{0}'
-    ER_GET_COL_CASCADE = u'Column FEC cascade : Unable to compute sequence # of the media packet to recover\n{0}\n'
-    ER_GET_ROW_CASCADE = u'Row FEC cascade : Unable to compute sequence # of the media packet to recover\n{0}\n'
     ER_NULL_COL_CASCADE = u'Column FEC cascade : Unable to find linked entry in crosses buffer'
     ER_NULL_ROW_CASCADE = u'Row FEC cascade : Unable to find linked entry in crosses buffer'
     ER_STARTUP = u'Current position still not initialized (startup state)'
@@ -250,9 +248,7 @@ class FecReceiver(object):
             raise ValueError(FecReceiver.ER_DIRECTION.format(fec.direction))
         cross = None
         media_lost = 0
-        media_max = (fec.snbase + fec.na * fec.offset) & RtpPacket.S_MASK
-        media_test = fec.snbase
-        while media_test != media_max:
+        for media_test in fec.protected:
             # If media packet is not in the medias buffer (is missing)
             if not media_test in self.medias:
                 media_lost = media_test
@@ -275,13 +271,12 @@ class FecReceiver(object):
                 else:
                     raise ValueError(to_bytes(FecReceiver.ER_FEC_DIRECTION.format(fec.direction)))
                 fec.set_missing(media_test)
-            media_test = (media_test + fec.offset) & RtpPacket.S_MASK
         if fec.L != 0:
             self.matrixL = fec.L
         if fec.D != 0:
             self.matrixD = fec.D
         # [1] The fec packet is useless if none of the protected media packets is missing
-        if len(fec.missing) == 0:
+        if not fec.missing_mask:
             return
         # FIXME check if 10*delay_value is a good way to avoid removing early fec packets !
         # The fec packet is useless if it needs an already output'ed media packet to do recovery
@@ -302,7 +297,7 @@ class FecReceiver(object):
             if len(self.rows) > self.max_row:
                 self.max_row = len(self.rows)
         # [2] Only on media packet missing, fec packet is able to recover it now !
-        if len(fec.missing) == 1:
+        if fec.single_missing is not None:
             self.recover_media_packet(media_lost, cross, fec)
             self.out()  # FIXME maybe better to call it from another thread
         # [3] More than one media packet is missing, fec packet stored for future recovery
@@ -347,8 +342,8 @@ class FecReceiver(object):
 
         # Recover the missing media packet and remove any useless linked fec packet
         if recovered_by_fec:
-            if len(fec.missing) != 1:
-                raise NotImplementedError(FecReceiver.ER_MISSING_COUNT.format(len(fec.missing)))
+            if fec.single_missing is None:
+                raise NotImplementedError(FecReceiver.ER_MISSING_COUNT.format(fec.missing_count))
             if fec.direction == FecPacket.COL and fec.sequence != col_sequence:
                 raise NotImplementedError(FecReceiver.ER_COL_MISMATCH.format(fec.sequence, col_sequence))
             if fec.direction == FecPacket.ROW and fec.sequence != row_sequence:
@@ -362,13 +357,10 @@ class FecReceiver(object):
 
             # > recovered payload ^= all media packets linked to the fec packet
             aborted = False
-            media_max = (fec.snbase + fec.na * fec.offset) & RtpPacket.S_MASK
-            media_test = fec.snbase
-            while media_test != media_max:
+            for media_test in fec.protected:
                 if media_test == media_sequence:
-                    media_test = (media_test + fec.offset) & RtpPacket.S_MASK
                     continue
-                friend = self.medias[media_test]
+                friend = self.medias.get(media_test)
                 # Unable to recover the media packet if any of the friend media packets is missing
                 if not friend:
                     self.media_aborted_recovery += 1
@@ -377,10 +369,10 @@ class FecReceiver(object):
                 media.payload_type ^= friend.payload_type
                 media.timestamp ^= friend.timestamp
                 payload_size ^= friend.payload_size
-                # FIXME FIXME FIXME FIXME FIXME OPTIMIZATION FIXME FIXME FIXME FIXME
-                for no in xrange(min(len(media.payload), len(friend.payload))):
-                    media.payload[no] ^= friend.payload[no]
-                media_test = (media_test + fec.offset) & RtpPacket.S_MASK
+                payload = friend.payload[:len(media.payload)]
+                if len(payload) < len(media.payload):
+                    payload = payload + bytearray(len(media.payload) - len(payload))
+                xor_inplace(media.payload, payload)
 
             # If the media packet is successfully recovered
             if not aborted:
@@ -406,36 +398,30 @@ class FecReceiver(object):
             fec_row.set_recovered(media_sequence)
 
         if fec_col:
-            if len(fec_col.missing) == 1:
+            cascade_media_sequence = fec_col.single_missing
+            if cascade_media_sequence is not None:
                 # Cascade !
-                cascade_media_sequence = fec_col.missing[0]
-                if cascade_media_sequence:
-                    cascade_cross = self.crosses.get(cascade_media_sequence)
-                    if cascade_cross:
-                        self.recover_media_packet(cascade_media_sequence, cascade_cross, fec_col)
-                    else:
-                        raise NotImplementedError(
-                            to_bytes(u'recover_media_packet({0}, {1}, {2}):\n{3}\nmedia sequence : {4}\n{5}\n'.format(
-                            media_sequence, cross, fec, FecReceiver.ER_NULL_COL_CASCADE, cascade_media_sequence,
-                            fec_col)))
+                cascade_cross = self.crosses.get(cascade_media_sequence)
+                if cascade_cross:
+                    self.recover_media_packet(cascade_media_sequence, cascade_cross, fec_col)
                 else:
-                    raise NotImplementedError(to_bytes(FecReceiver.ER_GET_COL_CASCADE.format(fec_col)))
+                    raise NotImplementedError(
+                        to_bytes(u'recover_media_packet({0}, {1}, {2}):\n{3}\nmedia sequence : {4}\n{5}\n'.format(
+                        media_sequence, cross, fec, FecReceiver.ER_NULL_COL_CASCADE, cascade_media_sequence,
+                        fec_col)))
 
         if fec_row:
-            if len(fec_row.missing) == 1:
+            cascade_media_sequence = fec_row.single_missing
+            if cascade_media_sequence is not None:
                 # Cascade !
-                cascade_media_sequence = fec_row.missing[0]
-                if cascade_media_sequence:
-                    cascade_cross = self.crosses.get(cascade_media_sequence)
-                    if cascade_cross:
-                        self.recover_media_packet(cascade_media_sequence, cascade_cross, fec_row)
-                    else:
-                        raise NotImplementedError(
-                            to_bytes(u'{0}\nrecover_media_packet({1}, {2}, {3}):\nmedia sequence : {4}\n{5}\n'.format(
-                            FecReceiver.ER_NULL_ROW_CASCADE, media_sequence, cross, fec, cascade_media_sequence,
-                            fec_row)))
+                cascade_cross = self.crosses.get(cascade_media_sequence)
+                if cascade_cross:
+                    self.recover_media_packet(cascade_media_sequence, cascade_cross, fec_row)
                 else:
-                    raise NotImplementedError(to_bytes(FecReceiver.ER_GET_ROW_CASCADE.format(fec_row)))
+                    raise NotImplementedError(
+                        to_bytes(u'{0}\nrecover_media_packet({1}, {2}, {3}):\nmedia sequence : {4}\n{5}\n'.format(
+                        FecReceiver.ER_NULL_ROW_CASCADE, media_sequence, cross, fec, cascade_media_sequence,
+                        fec_row)))
 
     def out(self):
         u"""Extract packets to output in order to keep a 'certain' amount of them in the buffer."""
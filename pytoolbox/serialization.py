@@ -24,19 +24,247 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import errno, inspect, json, os, pickle, shutil
+import errno, fcntl, inspect, io, json, mmap, os, shutil, struct, sys, tempfile, threading, weakref, zlib
 from bson.objectid import ObjectId
 from codecs import open
+from collections import OrderedDict
+from six import integer_types, reraise
 from .encoding import string_types, to_bytes
 
+if sys.version_info[0] > 2:
+    import pickle
+else:
+    import cPickle as pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+    ujson.dumps(None, default=None)  # The serialization hook is required (ujson >= 5)
+except (ImportError, TypeError):
+    ujson = None
+
 
 # Data -> File ---------------------------------------------------------------------------------------------------------
 
-def to_file(filename, data=None, pickle_data=None, binary=False, safe=False, backup=False):
+FICLONE = 0x40049409  # Linux ioctl to clone (reflink) a file on copy-on-write file-systems (btrfs, xfs, ...)
+
+
+def clone_file(source, destination):
+    u"""Copy a file (and its metadata) by using a reflink if supported by the file-system, else a byte copy."""
+    try:
+        with open(source, u'rb') as src_file:
+            with open(destination, u'wb') as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        shutil.copystat(source, destination)
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            raise
+        shutil.copy2(source, destination)
+
+
+class WriteTransaction(object):
+    u"""
+    Stage the write operations of many files and commit them at once, the fast and crash-safe way:
+
+    1. Every file is written into a temporary file (*filename*.tmp), writing a file twice only keeps the last data.
+    2. The temporary files are fsync-ed in batch (if ``fsync`` is set).
+    3. The current files are hard-linked to *filename*.bkp (if ``backup`` is set, else *filename*.old), no bytes are
+       copied.
+    4. The temporary files are renamed to their final name and the directories are fsync-ed.
+
+    Every file is replaced atomically: After a crash a file is either the old or the new version, never a partial one.
+    The temporary files are removed if the transaction is rolled back (e.g. an exception inside the ``with`` block).
+    If the commit fails, the files already renamed are restored from step 3 so either all files or none are replaced.
+
+    **Example usage**
+
+    >>> from nose.tools import assert_equal, assert_raises
+    >>> with WriteTransaction(backup=True) as transaction:
+    ...     for i in range(3):
+    ...         transaction.write(u'/tmp/transaction_{0}'.format(i), data=u'version 1 of {0}'.format(i))
+    >>> with WriteTransaction(backup=True) as transaction:
+    ...     for i in range(3):
+    ...         transaction.write(u'/tmp/transaction_{0}'.format(i), data=u'version 2 of {0}'.format(i))
+    >>> print(transaction.backups)
+    [u'/tmp/transaction_0.bkp', u'/tmp/transaction_1.bkp', u'/tmp/transaction_2.bkp']
+    >>> assert_equal(open(u'/tmp/transaction_2', u'r', u'utf-8').read(), u'version 2 of 2')
+    >>> assert_equal(open(u'/tmp/transaction_2.bkp', u'r', u'utf-8').read(), u'version 1 of 2')
+
+    Nothing is written if the transaction fails:
+
+    >>> def fail():
+    ...     with WriteTransaction() as transaction:
+    ...         transaction.write(u'/tmp/transaction_0', data=u'version 3 of 0')
+    ...         transaction.write(u'/tmp/transaction_1', data=assert_equal)
+    >>> assert_raises(TypeError, fail)
+    >>> assert_equal(open(u'/tmp/transaction_0', u'r', u'utf-8').read(), u'version 2 of 0')
+    >>> os.path.exists(u'/tmp/transaction_0.tmp')
+    False
+
+    Nothing is replaced if the commit fails (here the last file cannot be renamed):
+
+    >>> transaction = WriteTransaction()
+    >>> transaction.write(u'/tmp/transaction_0', data=u'version 3 of 0')
+    >>> transaction.write(u'/tmp/transaction_0', data=u'version 4 of 0')
+    >>> transaction.write(u'/tmp/transaction_1', data=u'version 3 of 1')
+    >>> transaction.write(u'/tmp/transaction_2', data=u'version 3 of 2')
+    >>> os.remove(u'/tmp/transaction_2.tmp')
+    >>> assert_raises(OSError, transaction.commit)
+    >>> assert_equal(open(u'/tmp/transaction_0', u'r', u'utf-8').read(), u'version 2 of 0')
+    >>> assert_equal(open(u'/tmp/transaction_1', u'r', u'utf-8').read(), u'version 2 of 1')
+    >>> sorted(f for f in os.listdir(u'/tmp') if f.startswith(u'transaction_') and f.endswith((u'.tmp', u'.old')))
+    []
+    >>> transaction.write(u'/tmp/transaction_0', data=u'version 3 of 0')
+    >>> transaction.write(u'/tmp/transaction_0', data=u'version 4 of 0')
+    >>> transaction.commit()
+    >>> assert_equal(open(u'/tmp/transaction_0', u'r', u'utf-8').read(), u'version 4 of 0')
+    >>> for i in range(3):
+    ...     os.remove(u'/tmp/transaction_{0}'.format(i))
+    ...     os.remove(u'/tmp/transaction_{0}.bkp'.format(i))
+    """
+
+    def __init__(self, fsync=True, backup=False):
+        self.fsync = fsync
+        self.backup = backup
+        self.staged, self.backups = OrderedDict(), []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def write(self, filename, data=None, pickle_data=None, binary=False):
+        u"""Stage the write of some data to a file (replacing any previously staged data), see :func:`to_file`."""
+        temporary_filename = u'{0}.tmp'.format(filename)
+        self.staged[filename] = temporary_filename
+        with open(temporary_filename, u'wb' if binary else u'w', None if binary else u'utf-8') as f:
+            if data:
+                f.write(data)
+            if pickle_data:
+                pickle.dump(pickle_data, f)
+
+    def commit(self):
+        u"""Make the staged files durable and rename them to their final name, all of them or none."""
+        staged, self.staged = list(self.staged.items()), OrderedDict()
+        saved, renamed = OrderedDict(), []
+        try:
+            if self.fsync:
+                for filename, temporary_filename in staged:
+                    fd = os.open(temporary_filename, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+            for filename, temporary_filename in staged:
+                saved[filename] = self._save(filename)
+            for filename, temporary_filename in staged:
+                os.rename(temporary_filename, filename)
+                renamed.append(filename)
+        except:
+            exc_info = sys.exc_info()
+            self._restore(staged, saved, renamed)
+            reraise(*exc_info)
+        for saved_filename in saved.values():
+            if saved_filename and not self.backup:
+                os.remove(saved_filename)
+        if self.backup:
+            self.backups.extend(f for f in saved.values() if f)
+        if self.fsync:
+            for directory in set(os.path.dirname(os.path.abspath(f)) for f, t in staged):
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def rollback(self):
+        u"""Remove the staged (temporary) files."""
+        for temporary_filename in self.staged.values():
+            try:
+                os.remove(temporary_filename)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        self.staged = OrderedDict()
+
+    def _save(self, filename):
+        u"""Hard-link (or copy) the current version of ``filename`` and return the link, None if there is no file."""
+        saved_filename = u'{0}.{1}'.format(filename, u'bkp' if self.backup else u'old')
+        try:
+            os.remove(saved_filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        try:
+            # The rename replaces the directory entry, the old inode (content) is kept by the link
+            os.link(filename, saved_filename)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            if e.errno not in (errno.EPERM, errno.EXDEV, errno.EMLINK, errno.ENOTSUP):
+                raise
+            clone_file(filename, saved_filename)
+        return saved_filename
+
+    def _restore(self, staged, saved, renamed):
+        u"""Put back the previous version of the ``renamed`` files and remove the temporary files (failed commit)."""
+        for filename in renamed:
+            saved_filename = saved.get(filename)
+            if saved_filename is None:
+                os.remove(filename)  # There was no such file before the commit
+            elif self.backup:
+                # Keep the backup, restore a link (or copy) of it
+                temporary_filename = u'{0}.tmp'.format(filename)
+                try:
+                    os.link(saved_filename, temporary_filename)
+                except OSError:
+                    clone_file(saved_filename, temporary_filename)
+                os.rename(temporary_filename, filename)
+            else:
+                os.rename(saved_filename, filename)
+        leftovers = [t for f, t in staged if f not in renamed]
+        if not self.backup:
+            leftovers += [s for f, s in saved.items() if s and f not in renamed]
+        for leftover in leftovers:
+            try:
+                os.remove(leftover)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+
+def to_file(filename, data=None, pickle_data=None, binary=False, safe=False, backup=False, transaction=None):
     u"""
     Write some data to a file, can be safe (tmp file -> rename), may create a backup before any write operation.
     Return the name of the backup filename or None.
 
+    The safe mode is a :class:`WriteTransaction` of a single file (fsync, backup by hard-link, atomic rename).
+    Set ``transaction`` to stage the write into a transaction instead (``safe`` and ``backup`` are then ignored).
+
     **Example usage**
 
     In-place write operation:
@@ -68,34 +296,55 @@ def to_file(filename, data=None, pickle_data=None, binary=False, safe=False, bac
     >>> assert_raises(TypeError, to_file, u'/tmp/to_file', data=assert_equal, safe=True)
     >>> assert_equal(open(u'/tmp/to_file', u'r', u'utf-8').read(), u'oui et toi ?')
     """
+    if transaction is not None:
+        transaction.write(filename, data=data, pickle_data=pickle_data, binary=binary)
+        return None
+    if safe:
+        with WriteTransaction(backup=backup) as transaction:
+            transaction.write(filename, data=data, pickle_data=pickle_data, binary=binary)
+        return transaction.backups[0] if transaction.backups else None
     if backup:
         backup_filename = u'{0}.bkp'.format(filename)
         try:
-            shutil.copy2(filename, backup_filename)
+            clone_file(filename, backup_filename)  # The file is modified in-place, the backup must be a copy
         except IOError as e:
             if e.errno != errno.ENOENT:
                 raise
             backup_filename = None
-    write_filename = u'{0}.tmp'.format(filename) if safe else filename
-    with open(write_filename, u'wb' if binary else u'w', None if binary else u'utf-8') as f:
+    with open(filename, u'wb' if binary else u'w', None if binary else u'utf-8') as f:
         if data:
             f.write(data)
         if pickle_data:
             pickle.dump(pickle_data, f)
-    if safe:
-        os.rename(write_filename, filename)
     return backup_filename if backup else None
 
 # Object <-> Pickle file -----------------------------------------------------------------------------------------------
 
 class PickleableObject(object):
-    u"""An :class:`object` serializable/deserializable by :mod:`pickle`."""
+    u"""
+    An :class:`object` serializable/deserializable by :mod:`pickle` (or :mod:`msgpack`, see :func:`object2binary`).
+
+    **Example usage**
+
+    >>> from nose.tools import assert_equal
+    >>> state = PickleableObject()
+    >>> state.counters = {u'a': 1}
+    >>> state.write(u'/tmp/state.pkl', serializer=u'pickle', compression=u'zlib')
+    >>> assert_equal(PickleableObject.read(u'/tmp/state.pkl').counters, {u'a': 1})
+
+    The files written by the previous versions (pickle, protocol 0) are loaded as well:
+
+    >>> a = to_file(u'/tmp/state.pkl', pickle_data=state, binary=True)
+    >>> assert_equal(PickleableObject.read(u'/tmp/state.pkl', use_mmap=False).counters, {u'a': 1})
+    >>> os.remove(u'/tmp/state.pkl')
+    """
     @classmethod
-    def read(cls, filename, store_filename=False, create_if_error=False, **kwargs):
-        u"""Return a deserialized instance of a pickleable object loaded from a file."""
+    def read(cls, filename, store_filename=False, create_if_error=False, use_mmap=True, **kwargs):
+        u"""
+        Return a deserialized instance of a pickleable object loaded from a file, see :func:`binaryfile2object`.
+        """
         try:
-            with open(filename, u'rb') as f:
-                the_object = pickle.load(f)
+            the_object = binaryfile2object(filename, cls, use_mmap)
         except:
             if not create_if_error:
                 raise
@@ -105,8 +354,14 @@ class PickleableObject(object):
             the_object._pickle_filename = filename
         return the_object
 
-    def write(self, filename=None, store_filename=False, safe=False, backup=False):
-        u"""Serialize ``self`` to a file, excluding the attribute ``_pickle_filename``."""
+    def write(self, filename=None, store_filename=False, safe=False, backup=False, transaction=None,
+              serializer=u'pickle', compression=None):
+        u"""
+        Serialize ``self`` to a file, excluding the attribute ``_pickle_filename``.
+
+        Set ``transaction`` to a :class:`WriteTransaction` to checkpoint many objects at once.
+        Set ``serializer`` and ``compression`` to select the format, see :func:`object2binary`.
+        """
         pickle_filename = getattr(self, '_pickle_filename', None)
         filename = filename or pickle_filename
         if filename is None:
@@ -114,13 +369,127 @@ class PickleableObject(object):
         try:
             if pickle_filename:
                 del self._pickle_filename
-            to_file(filename, pickle_data=self, binary=True, safe=safe, backup=backup)
+            to_file(filename, data=object2binary(self, serializer, compression), binary=True, safe=safe, backup=backup,
+                    transaction=transaction)
         finally:
             if store_filename:
                 self._pickle_filename = filename
             elif pickle_filename:
                 self._pickle_filename = pickle_filename
 
+
+# Object <-> Binary string ---------------------------------------------------------------------------------------------
+
+BINARY_MAGIC = b'PTBX'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct(b'!4sBBB')  # Magic, version, serializer, compression
+BINARY_SERIALIZERS = {u'pickle': 1, u'msgpack': 2}
+BINARY_COMPRESSIONS = {None: 0, u'zlib': 1, u'lz4': 2, u'zstd': 3}
+
+
+def _compressor(compression):
+    if compression == u'zlib':
+        return zlib.compress, zlib.decompress
+    if compression == u'lz4' and lz4 is not None:
+        return lz4.compress, lz4.decompress
+    if compression == u'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(to_bytes(u'Compression {0} is not available'.format(compression)))
+
+
+def object2binary(obj, serializer=u'pickle', compression=None):
+    u"""
+    Serialize an :class:`object` to a binary string starting with a header identifying the format.
+
+    * Set ``serializer`` to *pickle* (highest protocol) or *msgpack* (requires :mod:`msgpack`). The latter only stores
+      the attributes of the objects (the ones of the nested objects as dictionaries) but is faster and portable.
+    * Set ``compression`` to *zlib*, *lz4* or *zstd* (requires :mod:`lz4` or :mod:`zstandard`) to compress the data.
+
+    **Example usage**
+
+    >>> from nose.tools import assert_equal
+    >>> data = object2binary({u'x': 3, u'y': [4, 5]}, compression=u'zlib')
+    >>> data[:4] == BINARY_MAGIC
+    True
+    >>> assert_equal(binary2object(data), {u'x': 3, u'y': [4, 5]})
+    >>> binary2object(BINARY_HEADER.pack(BINARY_MAGIC, 2, 1, 0) + data[BINARY_HEADER.size:])
+    Traceback (most recent call last):
+        ...
+    ValueError: Binary format version 2 is not supported
+    >>> object2binary({u'x': 3}, serializer=u'json')
+    Traceback (most recent call last):
+        ...
+    ValueError: Serializer json is not available
+    """
+    if serializer == u'pickle':
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    elif serializer == u'msgpack' and msgpack is not None:
+        data = msgpack.packb(obj, default=_attributes, use_bin_type=True)
+    else:
+        raise ValueError(to_bytes(u'Serializer {0} is not available'.format(serializer)))
+    if compression is not None:
+        data = _compressor(compression)[0](data)
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_SERIALIZERS[serializer],
+                                BINARY_COMPRESSIONS[compression])
+    return header + data
+
+
+def binary2object(data, cls=None):
+    u"""
+    Deserialize a binary string (or a memory map) to an :class:`object`, see :func:`object2binary`.
+
+    Set ``cls`` to get an instance of ``cls`` from the attributes stored by *msgpack*. A binary string without any
+    header is loaded by :mod:`pickle` (the format of the previous versions of :class:`PickleableObject`).
+    """
+    header = bytes(data[:BINARY_HEADER.size])
+    if len(header) < BINARY_HEADER.size or header[:4] != BINARY_MAGIC:
+        offset, serializer, compression = 0, u'pickle', None
+    else:
+        magic, version, serializer, compression = BINARY_HEADER.unpack(header)
+        if version != BINARY_VERSION:
+            raise ValueError(to_bytes(u'Binary format version {0} is not supported'.format(version)))
+        offset = BINARY_HEADER.size
+        serializer = dict((v, k) for k, v in BINARY_SERIALIZERS.items()).get(serializer)
+        compression = dict((v, k) for k, v in BINARY_COMPRESSIONS.items()).get(compression, u'unknown')
+    if isinstance(data, mmap.mmap) and sys.version_info[0] > 2:
+        # Deserialize straight from the memory map, the views must be released before closing it
+        with memoryview(data) as view:
+            with view[offset:] as payload:
+                return _binary2object(payload, serializer, compression, cls)
+    return _binary2object(data[offset:] if offset else data[:], serializer, compression, cls)
+
+
+def _binary2object(payload, serializer, compression, cls):
+    if compression is not None:
+        payload = _compressor(compression)[1](payload)
+    if serializer == u'pickle':
+        return pickle.loads(payload)
+    if serializer == u'msgpack' and msgpack is not None:
+        attributes = msgpack.unpackb(payload, raw=False)
+        if cls is None:
+            return attributes
+        the_object = cls.__new__(cls)
+        the_object.__dict__.update(attributes)
+        return the_object
+    raise ValueError(to_bytes(u'Serializer {0} is not available'.format(serializer)))
+
+
+def binaryfile2object(filename, cls=None, use_mmap=True):
+    u"""
+    Load and deserialize the binary string stored in a file ``filename`` to an :class:`object`.
+
+    The file is memory mapped if ``use_mmap`` is set: The pages are loaded on demand from the page cache.
+    """
+    with io.open(filename, u'rb') as f:
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return binary2object(mapping, cls)
+            finally:
+                mapping.close()
+        return binary2object(f.read(), cls)
+
+
 # Object <-> JSON string -----------------------------------------------------------------------------------------------
 
 ## http://stackoverflow.com/questions/6255387/mongodb-object-serialized-as-json
@@ -137,18 +506,121 @@ class SmartJSONEncoderV2(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, ObjectId):
             return unicode(obj)
+        return get_serializer(obj.__class__)(obj)
+
+
+_serializers = weakref.WeakKeyDictionary()
+
+
+def get_serializer(cls):
+    u"""
+    Return a function returning the members of an instance of ``cls`` as a dictionary, the attributes, the properties
+    and the class attributes excepting the routines and the special members (the ones of :func:`inspect.getmembers`).
+
+    The members of the class are listed once and the function is cached (a class modified at runtime is not updated).
+
+    **Example usage**
+
+    >>> from nose.tools import assert_equal
+    >>> class Point(object):
+    ...     DIMENSIONS = 2
+    ...     def __init__(self, x=0, y=0):
+    ...         self.x, self.y = x, y
+    ...     @property
+    ...     def z(self):
+    ...         return self.x + self.y
+    ...     def norm(self):
+    ...         return (self.x ** 2 + self.y ** 2) ** 0.5
+    >>> serializer = get_serializer(Point)
+    >>> serializer is get_serializer(Point)
+    True
+    >>> assert_equal(serializer(Point(16, -5)), {u'DIMENSIONS': 2, u'x': 16, u'y': -5, u'z': 11})
+    """
+    try:
+        return _serializers[cls]
+    except KeyError:
+        pass
+    names, mro = [], inspect.getmro(cls)
+    for name in dir(cls):
+        if name.startswith(u'__'):
+            continue
+        for klass in mro:
+            if name in klass.__dict__:
+                if not inspect.isroutine(klass.__dict__[name]):
+                    names.append(name)
+                break
+    names = tuple(names)
+
+    def serializer(obj):
         attributes = {}
-        for a in inspect.getmembers(obj):
-            if inspect.isroutine(a[1]) or inspect.isbuiltin(a[1]) or a[0].startswith(u'__'):
-                continue
-            attributes[a[0]] = a[1]
+        for name in names:
+            try:
+                attributes[name] = getattr(obj, name)
+            except AttributeError:
+                pass
+        for name, value in getattr(obj, u'__dict__', {}).items():
+            if name not in attributes and not name.startswith(u'__') and not inspect.isroutine(value):
+                attributes[name] = value
         return attributes
 
-def object2json(obj, include_properties, **kwargs):
+    _serializers[cls] = serializer
+    return serializer
+
+
+def _attributes(obj):
+    if isinstance(obj, ObjectId):
+        return unicode(obj)
+    try:
+        return obj.__dict__
+    except AttributeError:
+        raise TypeError(to_bytes(u'{0!r} is not JSON serializable'.format(obj)))
+
+
+def _properties(obj):
+    if isinstance(obj, ObjectId):
+        return unicode(obj)
+    return get_serializer(obj.__class__)(obj)
+
+
+def _key(key):
+    if isinstance(key, string_types):
+        return key.decode(u'utf-8') if isinstance(key, bytes) else key
+    if key is True or key is False or key is None:
+        return unicode(json.dumps(key))
+    if isinstance(key, float):
+        return unicode(repr(key))
+    if isinstance(key, integer_types):
+        return unicode(key)
+    raise TypeError(to_bytes(u'key {0!r} is not a string'.format(key)))
+
+
+def _object2builtin(obj, serialize, markers):
+    u"""Convert ``obj`` to the python types of JSON (dict, list, unicode, ...) the way :mod:`json` would."""
+    if obj is None or isinstance(obj, (bool, float) + integer_types):
+        return obj
+    if isinstance(obj, string_types):
+        return obj.decode(u'utf-8') if isinstance(obj, bytes) else obj
+    marker = id(obj)
+    if marker in markers:
+        raise ValueError(to_bytes(u'Circular reference detected'))
+    markers.add(marker)
+    try:
+        if isinstance(obj, dict):
+            return dict((_key(key), _object2builtin(value, serialize, markers)) for key, value in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return [_object2builtin(value, serialize, markers) for value in obj]
+        return _object2builtin(serialize(obj), serialize, markers)
+    finally:
+        markers.discard(marker)
+
+
+def object2json(obj, include_properties, fast=False, **kwargs):
     u"""
     Serialize an :class:`object` to a JSON string. Use one of the *smart* JSON encoder of this module.
 
     * Set include_properties to True to also include the properties of ``obj``.
+    * Set fast to True to generate a compact JSON string (no whitespace, non-ASCII characters not escaped) by using
+      :mod:`orjson` or :mod:`ujson` if installed, kwargs is then ignored.
     * Set kwargs with any argument of the function :mod:`json`.dumps excepting cls.
 
     **Example usage**
@@ -171,8 +643,20 @@ def object2json(obj, include_properties, **kwargs):
         "y": -5,
         "z": 11
     }
+    >>> assert_equal(json.loads(object2json(p1, include_properties=True, fast=True)), {u'x': 16, u'y': -5, u'z': 11})
     """
-    return json.dumps(obj, cls=(SmartJSONEncoderV2 if include_properties else SmartJSONEncoderV1), **kwargs)
+    encoder = SmartJSONEncoderV2 if include_properties else SmartJSONEncoderV1
+    if not fast:
+        return json.dumps(obj, cls=encoder, **kwargs)
+    if orjson or ujson:
+        default = _properties if include_properties else _attributes
+        try:
+            if orjson:
+                return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS).decode(u'utf-8')
+            return ujson.dumps(obj, default=default, ensure_ascii=False, escape_forward_slashes=False)
+        except (OverflowError, TypeError, ValueError):
+            pass  # Integer too big, circular reference, ... let json handle (and report) it
+    return json.dumps(obj, cls=encoder, ensure_ascii=False, separators=(u',', u':'))
 
 
 def json2object(cls, json_string, inspect_constructor):
@@ -285,19 +769,23 @@ class JsoneableObject(object):
                 the_object._json_filename = filename
             return the_object
 
-    def write(self, filename=None, include_properties=False, safe=False, backup=False, **kwargs):
-        u"""Serialize ``self`` to a file, excluding the attribute ``_json_filename``."""
+    def write(self, filename=None, include_properties=False, safe=False, backup=False, transaction=None, **kwargs):
+        u"""
+        Serialize ``self`` to a file, excluding the attribute ``_json_filename``.
+
+        Set ``transaction`` to a :class:`WriteTransaction` to checkpoint many objects at once.
+        """
         if filename is None and hasattr(self, u'_json_filename'):
             filename = self._json_filename
             try:
                 del self._json_filename
                 to_file(filename, data=object2json(self, include_properties, **kwargs),
-                        binary=False, safe=safe, backup=backup)
+                        binary=False, safe=safe, backup=backup, transaction=transaction)
             finally:
                 self._json_filename = filename
         elif filename is not None:
             to_file(filename, data=object2json(self, include_properties, **kwargs),
-                    binary=False, safe=safe, backup=backup)
+                    binary=False, safe=safe, backup=backup, transaction=transaction)
         else:
             raise ValueError(u'A filename must be specified')
 
@@ -314,12 +802,8 @@ class JsoneableObject(object):
 
 def object2dict(obj, include_properties):
     u"""
-    Convert an :class:`object` to a python dictionary.
-
-    .. warning::
-
-        Current implementation serialize ``obj`` to a JSON string and then deserialize this JSON string to an instance
-        of :class:`dict`.
+    Convert an :class:`object` to a python dictionary, the same as converting it to a JSON string and back (without
+    paying the price of that round trip).
 
     **Example usage**
 
@@ -350,7 +834,7 @@ def object2dict(obj, include_properties):
         ...
     ValueError: Circular reference detected
     """
-    return json2object(dict, object2json(obj, include_properties), inspect_constructor=False)
+    return _object2builtin(obj, _properties if include_properties else _attributes, set())
 
 
 def object2dictV2(obj, remove_underscore):
@@ -402,5 +886,353 @@ def dict2object(cls, the_dict, inspect_constructor):
     >>> assert_equal(dict2object(User, user_dict, inspect_constructor=True).__dict__, expected)
     """
     if inspect_constructor:
-        the_dict = {arg: the_dict.get(arg, None) for arg in inspect.getargspec(cls.__init__)[0] if arg != 'self'}
+        the_dict = {arg: the_dict.get(arg, None) for arg in get_arguments(cls)}
     return cls(**the_dict)
+
+
+_arguments = weakref.WeakKeyDictionary()
+
+
+def get_arguments(cls):
+    u"""
+    Return the names of the arguments of the constructor (``__init__``) of ``cls``, inspected once and cached.
+
+    **Example usage**
+
+    >>> class User(object):
+    ...     def __init__(self, first_name, last_name=u'Fischer', **kwargs):
+    ...         self.first_name, self.last_name = first_name, last_name
+    >>> print(get_arguments(User))
+    ('first_name', 'last_name')
+    """
+    try:
+        return _arguments[cls]
+    except KeyError:
+        pass
+    getargspec = inspect.getfullargspec if sys.version_info[0] > 2 else inspect.getargspec
+    arguments = tuple(arg for arg in getargspec(cls.__init__)[0] if arg != u'self')
+    _arguments[cls] = arguments
+    return arguments
+
+
+def dicts2objects(cls, dicts, inspect_constructor):
+    u"""
+    Convert python dictionaries to instances of a class, lazily (this is a generator), see :func:`dict2object`.
+
+    **Example usage**
+
+    >>> class User(object):
+    ...     def __init__(self, first_name, last_name=u'Fischer'):
+    ...         self.first_name, self.last_name = first_name, last_name
+    >>> users = dicts2objects(User, ({u'first_name': name, u'age': 30} for name in (u'Victor', u'David')), True)
+    >>> print([(user.first_name, user.last_name) for user in users])
+    [(u'Victor', None), (u'David', None)]
+    """
+    if inspect_constructor:
+        arguments = get_arguments(cls)
+        for the_dict in dicts:
+            yield cls(**{arg: the_dict.get(arg, None) for arg in arguments})
+    else:
+        for the_dict in dicts:
+            yield cls(**the_dict)
+
+
+def jsonlines2objects(cls, filename_or_file, inspect_constructor):
+    u"""
+    Load and deserialize the JSON strings stored in a JSON lines file (one JSON string per line) to instances of
+    ``cls``, lazily (this is a generator): The memory footprint is constant whatever the size of the file.
+
+    **Example usage**
+
+    >>> class Point(object):
+    ...     def __init__(self, x=0, y=0):
+    ...         self.x, self.y = x, y
+    >>> with open(u'/tmp/points.jsonl', u'w', encoding=u'utf-8') as f:
+    ...     for i in range(3):
+    ...         f.write(object2json(Point(i, -i), include_properties=False) + u'\\n')
+    >>> print([(p.x, p.y) for p in jsonlines2objects(Point, u'/tmp/points.jsonl', inspect_constructor=True)])
+    [(0, 0), (1, -1), (2, -2)]
+    >>> os.remove(u'/tmp/points.jsonl')
+    """
+    f = (io.open(filename_or_file, u'r', encoding=u'utf-8') if isinstance(filename_or_file, string_types)
+         else filename_or_file)
+    try:
+        for obj in dicts2objects(cls, (json.loads(line) for line in f if line.strip()), inspect_constructor):
+            yield obj
+    finally:
+        if f is not filename_or_file:
+            f.close()
+
+
+# Collection of objects <-> JSON lines file ----------------------------------------------------------------------------
+
+class JsonLinesStore(object):
+    u"""
+    A collection of objects (e.g. :class:`JsoneableObject`) stored in a JSON lines file, one object per line.
+
+    The objects are appended to the file, an object appended again with the same ``key`` (the name of an attribute)
+    replaces the previous one and a deleted object is recorded by a tombstone line. The offset of the last version of
+    every object is kept in an index (saved to *filename*.index) so that reading an object is a single seek and the
+    parsing of a single line. The index covers the file up to a given size, the lines appended after (by another
+    process, before a crash, ...) are indexed at opening. A truncated (partially written) last line is discarded.
+
+    The superseded and deleted objects are removed from the file by :meth:`compact`, that can run in the background:
+    The objects appended meanwhile are copied before the file is atomically replaced. A single compaction runs at a time
+    and closing the collection waits for the running compaction. The collection must be written by a single process at
+    a time.
+
+    **Example usage**
+
+    >>> from nose.tools import assert_equal
+    >>> class User(JsoneableObject):
+    ...     def __init__(self, _id, name, **kwargs):
+    ...         self._id, self.name = _id, name
+    >>> with JsonLinesStore(u'/tmp/users.jsonl', User) as store:
+    ...     store.append_many(User(i, u'user {0}'.format(i)) for i in range(5))
+    ...     store.append(User(3, u'Victor'))
+    ...     store.delete(4)
+    >>> store = JsonLinesStore(u'/tmp/users.jsonl', User)
+    >>> print(len(store), store.get(3).name, 4 in store)
+    4 Victor False
+    >>> print([user.name for user in store])
+    [u'user 0', u'user 1', u'user 2', u'Victor']
+
+    Compact the file in the background while appending:
+
+    >>> thread = store.compact(background=True)
+    >>> store.append(User(5, u'David'))
+    >>> store.compact(background=True) in (thread, None)
+    True
+    >>> thread.join()
+    >>> print(store.garbage_size, [user.name for user in store])
+    0 [u'user 0', u'user 1', u'user 2', u'Victor', u'David']
+    >>> store.close()
+    >>> assert_equal(JsonLinesStore(u'/tmp/users.jsonl', User).get(5).name, u'David')
+    >>> os.remove(u'/tmp/users.jsonl')
+    >>> os.remove(u'/tmp/users.jsonl.index')
+    """
+
+    DELETED = u'__deleted__'
+
+    def __init__(self, filename, cls, key=u'_id', include_properties=False, inspect_constructor=True):
+        self.filename = filename
+        self.index_filename = u'{0}.index'.format(filename)
+        self.cls = cls
+        self.key = key
+        self.include_properties = include_properties
+        self.inspect_constructor = inspect_constructor
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._compaction = None
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, key):
+        return _object2builtin(key, _attributes, set()) in self.index
+
+    def __iter__(self):
+        u"""Yield the objects in order of (last) insertion, reading the file sequentially."""
+        with self._lock:
+            self._writer.flush()
+            size, index = self.size, self.index.copy()
+        for offset, line, record in self._lines(self.filename, 0, size):
+            location = index.get(record.get(self.key)) if record else None
+            if location and location[0] == offset:
+                yield dict2object(self.cls, record, self.inspect_constructor)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def garbage_size(self):
+        u"""Return the size of the superseded and deleted objects, freed by a compaction."""
+        return self.size - sum(length for offset, length in self.index.values())
+
+    def append(self, obj):
+        u"""Append an object (or a new version of an object) to the collection."""
+        self.append_many((obj, ))
+
+    def append_many(self, objects):
+        u"""Append objects to the collection with a single write."""
+        lines, keys = [], []
+        for obj in objects:
+            keys.append(_object2builtin(getattr(obj, self.key), _attributes, set()))
+            lines.append(object2json(obj, self.include_properties, fast=True).encode(u'utf-8') + b'\n')
+        self._write(keys, lines)
+
+    def delete(self, key):
+        u"""Delete an object of the collection (a tombstone line is appended)."""
+        key = _object2builtin(key, _attributes, set())
+        if key not in self.index:
+            raise KeyError(key)
+        self._write([key], [json.dumps({self.key: key, self.DELETED: True}).encode(u'utf-8') + b'\n'], deleted=True)
+
+    def get(self, key, default=None):
+        u"""Return the object with the given key (or ``default``) by reading a single line of the file."""
+        with self._lock:
+            try:
+                offset, length = self.index[_object2builtin(key, _attributes, set())]
+            except KeyError:
+                return default
+            self._writer.flush()
+            self._reader.seek(offset)
+            data = self._reader.read(length)
+        return dict2object(self.cls, json.loads(data.decode(u'utf-8')), self.inspect_constructor)
+
+    def keys(self):
+        return self.index.keys()
+
+    def close(self):
+        u"""Wait for the running compaction (if any), save the index and close the file."""
+        compaction = self._compaction
+        if compaction is not None and compaction is not threading.current_thread():
+            compaction.join()
+        with self._lock:
+            if self._writer is not None:
+                self.save_index()
+                self._writer.close()
+                self._reader.close()
+                self._writer = self._reader = None
+
+    def save_index(self):
+        u"""Save the index to *filename*.index."""
+        with self._lock:
+            self._writer.flush()
+            state = {
+                u'inode': os.fstat(self._writer.fileno()).st_ino, u'size': self.size,
+                u'index': [[key, offset, length] for key, (offset, length) in self.index.items()]
+            }
+            to_file(self.index_filename, data=json.dumps(state), safe=True)
+
+    def compact(self, background=False):
+        u"""
+        Remove the superseded and deleted objects from the file. Return the thread if run in the ``background``, the
+        thread of the running compaction if any (or None if it just finished).
+
+        Nothing is done if the collection is closed.
+        """
+        if background:
+            with self._lock:
+                if self._compaction is None:
+                    self._compaction = threading.Thread(target=self._compact_in_background)
+                    self._compaction.daemon = True
+                    self._compaction.start()
+                return self._compaction
+        with self._compaction_lock:
+            with self._lock:
+                if self._writer is None:
+                    return
+                self._writer.flush()
+                size, index = self.size, self.index.copy()
+                mode = os.fstat(self._writer.fileno()).st_mode
+            fd, temporary_filename = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.filename)),
+                prefix=u'{0}.'.format(os.path.basename(self.filename)), suffix=u'.tmp')
+            try:
+                os.fchmod(fd, mode & 0o7777)
+                new_index = {}
+                with io.open(fd, u'wb') as f:
+                    # The objects appended before the compaction, without locking the collection
+                    with io.open(self.filename, u'rb') as reader:
+                        for key, (offset, length) in sorted(index.items(), key=lambda item: item[1][0]):
+                            reader.seek(offset)
+                            new_index[key] = (f.tell(), length)
+                            f.write(reader.read(length))
+                    with self._lock:
+                        if self._writer is None:
+                            os.remove(temporary_filename)
+                            return
+                        # The objects appended meanwhile
+                        self._writer.flush()
+                        for offset, line, record in self._lines(self.filename, size, self.size):
+                            if record is None:
+                                continue
+                            if record.get(self.DELETED):
+                                new_index.pop(record.get(self.key), None)
+                            else:
+                                new_index[record.get(self.key)] = (f.tell(), len(line))
+                            f.write(line)
+                        f.flush()
+                        os.fsync(f.fileno())
+                        os.rename(temporary_filename, self.filename)
+                        self._writer.close()
+                        self._reader.close()
+                        self._writer = io.open(self.filename, u'ab')
+                        self._reader = io.open(self.filename, u'rb')
+                        self.index, self.size = new_index, f.tell()
+                        self.save_index()
+            except:
+                exc_info = sys.exc_info()
+                try:
+                    os.remove(temporary_filename)
+                except OSError:
+                    pass
+                reraise(*exc_info)
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            with self._lock:
+                self._compaction = None
+
+    def _open(self):
+        if not os.path.exists(self.filename):
+            io.open(self.filename, u'wb').close()
+        self._writer = io.open(self.filename, u'ab')
+        self._reader = io.open(self.filename, u'rb')
+        stat = os.fstat(self._writer.fileno())
+        inode, file_size = stat.st_ino, stat.st_size
+        self.index, self.size = {}, 0
+        try:
+            with io.open(self.index_filename, u'r', encoding=u'utf-8') as f:
+                state = json.loads(f.read())
+            if state[u'inode'] == inode and state[u'size'] <= file_size:
+                self.index = dict((key, (offset, length)) for key, offset, length in state[u'index'])
+                self.size = state[u'size']
+        except (IOError, KeyError, ValueError):
+            pass  # Missing, corrupted or stale index, the file is indexed from the start
+        for offset, line, record in self._lines(self.filename, self.size, file_size):
+            if record is None:
+                self.size = offset + len(line)  # Skip the corrupted line
+            else:
+                self._index(record.get(self.key), offset, len(line), record.get(self.DELETED))
+        if self.size < file_size:
+            self._writer.truncate(self.size)  # Discard the last line, partially written
+
+    def _index(self, key, offset, length, deleted):
+        if deleted:
+            self.index.pop(key, None)
+        else:
+            self.index[key] = (offset, length)
+        self.size = offset + length
+
+    def _lines(self, filename, start, stop):
+        u"""
+        Yield a tuple (offset, line, record) for every complete line of the file between ``start`` and ``stop``.
+        The record of a corrupted line (invalid JSON or not an object) is None.
+        """
+        with io.open(filename, u'rb') as f:
+            f.seek(start)
+            offset = start
+            while offset < stop:
+                line = f.readline()
+                if not line.endswith(b'\n') or offset + len(line) > stop:
+                    break
+                try:
+                    record = json.loads(line.decode(u'utf-8'))
+                except ValueError:
+                    record = None
+                yield offset, line, record if isinstance(record, dict) else None
+                offset += len(line)
+
+    def _write(self, keys, lines, deleted=False):
+        with self._lock:
+            self._writer.write(b''.join(lines))
+            for key, line in zip(keys, lines):
+                self._index(key, self.size, len(line), deleted)
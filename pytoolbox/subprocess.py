@@ -24,14 +24,189 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import errno, fcntl, multiprocessing, os, re, setuptools.archive_util, shlex, shutil, subprocess
+import errno, fcntl, multiprocessing, os, re, select, setuptools.archive_util, shlex, shutil, subprocess, sys, tempfile
+import Queue, six, threading
+from collections import deque
 from .encoding import to_bytes, string_types
 from .filesystem import try_makedirs
 
 EMPTY_CMD_RETURN = {u'process': None, u'stdout': None, u'stderr': None, u'returncode': None}
 
 
-def cmd(command, input=None, cli_input=None, cli_output=False, fail=True, log=None, communicate=True, **kwargs):
+def _args(command):
+    u"""Return the arguments list (to give to Popen) and the arguments string (to log) of a ``command``."""
+    if isinstance(command, string_types):
+        return shlex.split(to_bytes(command)), command
+    return ([to_bytes(a) for a in command if a is not None],
+            u' '.join([unicode(a) for a in command if a is not None]))
+
+
+def _bytes(data):
+    u"""Return ``data`` encoded to UTF-8 if this is an Unicode string, else unchanged (e.g. bytes)."""
+    return data.encode(u'utf-8') if isinstance(data, unicode) else data
+
+
+def _communicate(process, input=None, timeout=None, captures=None):
+    u"""
+    Communicate with the ``process`` and kill it if it takes more than ``timeout`` seconds (returncode < 0).
+
+    The output streams listed in ``captures`` (a dictionary name -> :class:`OutputCapture`) are read by threads and
+    written to the capture objects instead of being buffered in memory by ``process.communicate``.
+    """
+    timer = None if timeout is None else threading.Timer(timeout, kill, [process])
+    if timer:
+        timer.daemon = True
+        timer.start()
+    try:
+        if not captures:
+            return process.communicate(input=input)
+        threads = [threading.Thread(target=_drain, args=(getattr(process, n), c)) for n, c in captures.iteritems()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        if process.stdin:
+            try:
+                if input is not None:
+                    process.stdin.write(_bytes(input))
+                process.stdin.close()
+            except IOError as e:
+                if e.errno != errno.EPIPE:
+                    raise
+        for thread in threads:
+            thread.join()
+        process.wait()
+        return tuple(captures[n].value if n in captures else None for n in (u'stdout', u'stderr'))
+    finally:
+        if timer:
+            timer.cancel()
+
+
+def _captures(process, capture):
+    u"""Return a dictionary name -> output capture for the output pipes of the ``process`` or None."""
+    if capture is None:
+        return None
+    return dict((n, capture(n)) for n in (u'stdout', u'stderr') if getattr(process, n) is not None)
+
+
+def _drain(pipe, capture, chunk_size=64*1024):
+    u"""Read the ``pipe`` until EOF and write the data to the ``capture``."""
+    try:
+        fd = pipe.fileno()
+        while True:
+            data = os.read(fd, chunk_size)
+            if not data:
+                break
+            capture.write(data)
+    finally:
+        capture.close()
+        pipe.close()
+
+
+def kill(process):
+    u"""Kill the ``process``, ignoring the error raised if the process is already terminated."""
+    try:
+        process.kill()
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+class OutputCapture(object):
+    u"""
+    Capture an output stream of a process with a bounded memory footprint.
+
+    Only the first ``head_size`` and the last ``tail_size`` bytes are kept in memory. Set ``spill`` to True (temporary
+    file) or to a path to also write the full stream to a file, it is up to you to remove it. Set ``callback`` to a
+    method called with (name, line) for each line of the stream (lines longer than ``MAX_LINE_SIZE`` are split).
+
+    **Example usage**
+
+    >>> lines = []
+    >>> capture = OutputCapture(u'stdout', head_size=4, tail_size=5, callback=lambda n, l: lines.append(l))
+    >>> for data in (b'abcd', b'ef\\ngh', b'ijklmn', b'op'):
+    ...     capture.write(data)
+    >>> capture.close()
+    >>> print(capture.size, capture.skipped)
+    17 8
+    >>> print(capture.value.decode(u'utf-8'))
+    abcd
+    [... 8 bytes skipped ...]
+    lmnop
+    >>> print(lines == [b'abcdef\\n', b'ghijklmnop'])
+    True
+    """
+
+    MAX_LINE_SIZE = 64 * 1024
+
+    def __init__(self, name=None, head_size=64*1024, tail_size=64*1024, spill=False, callback=None):
+        self.name = name
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.callback = callback
+        self.head, self.tail, self.size = bytearray(), bytearray(), 0
+        self._line = bytearray()
+        if spill is True:
+            self.spill = tempfile.NamedTemporaryFile(prefix=u'{0}-'.format(name or u'output'), delete=False)
+        else:
+            self.spill = open(spill, u'wb') if spill else None
+
+    @property
+    def skipped(self):
+        u"""Return the amount of bytes that are not kept in memory."""
+        return self.size - len(self.head) - len(self.tail)
+
+    @property
+    def spill_path(self):
+        return self.spill.name if self.spill else None
+
+    @property
+    def value(self):
+        u"""Return the captured output, the skipped bytes are replaced by a marker."""
+        if self.skipped:
+            return bytes(self.head + u'\n[... {0} bytes skipped ...]\n'.format(self.skipped).encode(u'utf-8') +
+                         self.tail)
+        return bytes(self.head + self.tail)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.spill:
+            self.spill.write(data)
+        if self.callback:
+            self._split(data)
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data and self.tail_size:
+            self.tail += data[-self.tail_size:]
+            del self.tail[:-self.tail_size]
+
+    def close(self):
+        u"""Call the callback with the last line (if not terminated by a line feed) and close the spill file."""
+        if self.callback and self._line:
+            self.callback(self.name, bytes(self._line))
+            del self._line[:]
+        if self.spill:
+            self.spill.close()
+
+    def _split(self, data):
+        line = self._line
+        line += data
+        start = 0
+        while True:
+            index = line.find(b'\n', start)
+            if index < 0:
+                break
+            self.callback(self.name, bytes(line[start:index + 1]))
+            start = index + 1
+        del line[:start]
+        while len(line) > self.MAX_LINE_SIZE:
+            self.callback(self.name, bytes(line[:self.MAX_LINE_SIZE]))
+            del line[:self.MAX_LINE_SIZE]
+
+
+def cmd(command, input=None, cli_input=None, cli_output=False, fail=True, log=None, communicate=True, timeout=None,
+        capture=None, **kwargs):
     u"""
     Calls the ``command`` and returns a dictionary with process, stdout, stderr, and the returncode.
 
@@ -43,13 +218,33 @@ def cmd(command, input=None, cli_input=None, cli_output=False, fail=True, log=No
     * Set ``fail`` to False to avoid the exception ``subprocess.CalledProcessError``.
     * Set ``log`` to a method to log / print details about what is executed / any failure.
     * Set ``communicate`` to True to communicate with the process, this is a locking call.
+    * Set ``timeout`` to kill the process if it takes more than ``timeout`` seconds (only if ``communicate``).
+    * Set ``capture`` to a factory of :class:`OutputCapture` (called with the name of the stream) to bound the memory
+      used to capture stdout and stderr. The result will contain the captures (key ``captures``).
     * Set kwargs with any argument of the :mod:`subprocess`.Popen constructor excepting stdin, stdout and stderr.
+
+    **Example usage**
+
+    >>> print(cmd(u'sleep 5', timeout=0.1, fail=False)[u'returncode'])
+    -9
+
+    Capture only the beginning and the end of a big output and spill the full output to a temporary file:
+
+    >>> from functools import partial
+    >>> result = cmd([u'seq', u'100000'], capture=partial(OutputCapture, head_size=5, tail_size=13, spill=True))
+    >>> print(result[u'stdout'].decode(u'utf-8').strip())
+    1
+    2
+    3
+    [... 588877 bytes skipped ...]
+    99999
+    100000
+    >>> path = result[u'captures'][u'stdout'].spill_path
+    >>> print(os.path.getsize(path))
+    588895
+    >>> os.remove(path)
     """
-    if isinstance(command, string_types):
-        args_list, args_string = shlex.split(to_bytes(command)), command
-    else:
-        args_list = [to_bytes(a) for a in command if a is not None]
-        args_string = u' '.join([unicode(a) for a in command if a is not None])
+    args_list, args_string = _args(command)
     if hasattr(log, u'__call__'):
         log(u'Execute {0}{1}{2}'.format(u'' if input is None else u'echo {0}|'.format(repr(input)),
             args_string, u'' if cli_input is None else u' < {0}'.format(repr(cli_input))))
@@ -65,8 +260,11 @@ def cmd(command, input=None, cli_input=None, cli_output=False, fail=True, log=No
     if cli_input is not None:
         process.stdin.write(to_bytes(cli_input))
     if communicate:
-        stdout, stderr = process.communicate(input=input)
+        captures = _captures(process, capture)
+        stdout, stderr = _communicate(process, input=input, timeout=timeout, captures=captures)
         result = {u'process': process, u'stdout': stdout, u'stderr': stderr, u'returncode': process.returncode}
+        if captures:
+            result[u'captures'] = captures
         if hasattr(log, u'__call__'):
             log(result)
         if process.returncode != 0:
@@ -77,6 +275,100 @@ def cmd(command, input=None, cli_input=None, cli_output=False, fail=True, log=No
     return  {u'process': process, u'stdout': None, u'stderr': None, u'returncode': process.returncode}
 
 
+def cmd_many(commands, workers=multiprocessing.cpu_count(), timeout=None, fail_fast=False, log=None, capture=None,
+             **kwargs):
+    u"""
+    Calls the ``commands`` with up to ``workers`` running processes and yields a tuple (index, result) for each command
+    as soon as it completes. The result is the dictionary returned by :func:`cmd` with ``fail`` set to False.
+
+    * Set ``timeout`` to kill any process taking more than ``timeout`` seconds.
+    * Set ``fail_fast`` to True to stop at the first failing command: Queued commands are not started, running
+      processes are killed and ``subprocess.CalledProcessError`` is raised.
+    * Set ``log``, ``capture`` and kwargs as you would do with :func:`cmd`.
+
+    Any exception raised while calling a command (e.g. an invalid argument) stops the queue and is raised again.
+
+    Running processes are also killed if the generator is closed before the end.
+
+    **Example usage**
+
+    >>> commands = [[u'sleep', u'0.4'], u'echo hello', [u'sleep', u'0.2']]
+    >>> results = list(cmd_many(commands, workers=3))
+    >>> print([index for index, result in results])
+    [1, 2, 0]
+    >>> print(dict(results)[1][u'stdout'].strip().decode(u'utf-8'))
+    hello
+
+    Handle time-outs and failures:
+
+    >>> results = dict(cmd_many([u'sleep 5', u'false', u'true'], workers=2, timeout=0.2))
+    >>> print([results[i][u'returncode'] for i in range(3)])
+    [-9, 1, 0]
+    >>> for result in cmd_many([u'sleep 5', u'false'], workers=2, fail_fast=True):
+    ...     print(result)
+    Traceback (most recent call last):
+        ...
+    CalledProcessError: Command 'false' returned non-zero exit status 1
+    """
+    input = kwargs.pop(u'input', None)
+    pending, done = Queue.Queue(), Queue.Queue()
+    for index, command in enumerate(commands):
+        pending.put((index, command))
+    count, lock, running, stop = pending.qsize(), threading.Lock(), {}, threading.Event()
+
+    def worker():
+        while not stop.is_set():
+            try:
+                index, command = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result = cmd(command, input=input, fail=False, log=log, communicate=False, **kwargs)
+                process = result[u'process']
+                if process is not None:
+                    with lock:
+                        running[index] = process
+                    try:
+                        if stop.is_set():
+                            kill(process)
+                        captures = _captures(process, capture)
+                        stdout, stderr = _communicate(process, input=input, timeout=timeout, captures=captures)
+                    finally:
+                        with lock:
+                            del running[index]
+                    result = {
+                        u'process': process, u'stdout': stdout, u'stderr': stderr, u'returncode': process.returncode
+                    }
+                    if captures:
+                        result[u'captures'] = captures
+                    if hasattr(log, u'__call__'):
+                        log(result)
+                done.put((index, command, result, None))
+            except BaseException:
+                done.put((index, command, None, sys.exc_info()))
+
+    threads = [threading.Thread(target=worker) for i in xrange(min(workers, count))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for i in xrange(count):
+            index, command, result, error = done.get()
+            if error is not None:
+                stop.set()
+                six.reraise(*error)
+            if fail_fast and result[u'returncode'] != 0:
+                raise subprocess.CalledProcessError(result[u'returncode'], _args(command)[1], result[u'stderr'])
+            yield index, result
+    finally:
+        stop.set()
+        with lock:
+            for process in running.values():
+                kill(process)
+        for thread in threads:
+            thread.join()
+
+
 # http://stackoverflow.com/a/7730201/190597
 def make_async(fd):
     u"""Add the O_NONBLOCK flag to a file descriptor."""
@@ -93,6 +385,213 @@ def read_async(fd):
             return u''
         raise
 
+
+class AsyncProcess(object):
+    u"""
+    A process spawned by :func:`cmd_async`, with non-blocking pipes and line iterators for stdout and stderr.
+
+    Nothing is read from the pipes until a line iterator is consumed: A slow consumer makes the pipe full and the
+    process blocks on write (backpressure). The lines of the stream that is not iterated are buffered to avoid a
+    deadlock. Call ``cancel()`` to kill the process, a cancelled process never raises ``subprocess.CalledProcessError``.
+
+    The lines are framed by any of the ``separators`` (e.g. ``(b'\\n', b'\\r')`` for progress lines), a ``\\r\\n``
+    sequence ends a single line.
+    """
+
+    NAMES = (u'stdout', u'stderr')
+
+    def __init__(self, process, args_string, input=None, fail=True, log=None, separators=(b'\n', )):
+        self.process = process
+        self.args_string = args_string
+        self.fail = fail
+        self.log = log
+        self.separators = separators
+        self.cancelled = self.finished = False
+        self._input = bytearray(_bytes(input)) if input is not None else None
+        self._names, self._partials, self._lines = {}, {}, {}
+        if process is None:
+            self.finished = True  # Popen failed and cmd returned the error (fail=False)
+            return
+        for name in AsyncProcess.NAMES:
+            self._lines[name] = deque()
+            pipe = getattr(process, name)
+            if pipe is not None:
+                make_async(pipe)
+                self._names[pipe.fileno()] = name
+                self._partials[name] = bytearray()
+        if self._input is None:
+            process.stdin.close()  # Let the process know there is nothing more to read
+        else:
+            make_async(process.stdin)
+
+    @property
+    def returncode(self):
+        return 2 if self.process is None else self.process.poll()
+
+    def cancel(self):
+        u"""Kill the process."""
+        self.cancelled = True
+        if self.process is not None:
+            kill(self.process)
+
+    def lines(self, timeout=None):
+        u"""Yield a tuple (name, line) for each line of stdout and stderr, see :func:`iter_lines`."""
+        for process, name, line in iter_lines([self], timeout=timeout):
+            yield name, line
+
+    def stdout_lines(self, timeout=None):
+        u"""Yield the lines of stdout, see :func:`iter_lines`."""
+        for process, name, line in iter_lines([self], names=(u'stdout',), timeout=timeout):
+            yield line
+
+    def stderr_lines(self, timeout=None):
+        u"""Yield the lines of stderr, see :func:`iter_lines`."""
+        for process, name, line in iter_lines([self], names=(u'stderr',), timeout=timeout):
+            yield line
+
+    def _events(self):
+        u"""Yield a tuple (file descriptor, events to poll) for each pipe that is still open."""
+        for fd in self._names:
+            yield fd, select.POLLIN
+        if self._input is not None:
+            yield self.process.stdin.fileno(), select.POLLOUT
+
+    def _handle(self, fd, chunk_size):
+        u"""Read from or write to the pipe ``fd`` (that is ready) and return True if the pipe is now closed."""
+        try:
+            if fd not in self._names:
+                del self._input[:os.write(fd, self._input[:chunk_size])]
+                if self._input:
+                    return False
+                self._input = None
+                self.process.stdin.close()
+                return True
+            data = os.read(fd, chunk_size)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            if e.errno != errno.EPIPE:
+                raise
+            self._input = None  # The process do not read its input anymore
+            self.process.stdin.close()
+            return True
+        name = self._names[fd]
+        partial, lines = self._partials[name], self._lines[name]
+        if data:
+            partial += data
+            while True:
+                indexes = [i for i in (partial.find(separator) for separator in self.separators) if i >= 0]
+                if not indexes:
+                    return False
+                index = min(indexes)
+                if partial[index:index + 2] == b'\r\n':
+                    index += 1
+                lines.append(bytes(partial[:index + 1]))
+                del partial[:index + 1]
+        if partial:
+            lines.append(bytes(partial))  # Last line without any line feed
+        del self._names[fd], self._partials[name]
+        getattr(self.process, name).close()
+        return True
+
+    def _finish(self):
+        u"""Wait for the process to terminate and raise ``subprocess.CalledProcessError`` if it failed."""
+        self.finished = True
+        self.process.wait()
+        if hasattr(self.log, u'__call__'):
+            self.log({u'process': self.process, u'stdout': None, u'stderr': None, u'returncode': self.returncode})
+        if self.fail and not self.cancelled and self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.args_string)
+
+
+def cmd_async(command, input=None, cli_input=None, fail=True, log=None, separators=(b'\n', ), **kwargs):
+    u"""
+    Calls the ``command`` and returns an :class:`AsyncProcess` to consume its output line by line without blocking.
+
+    The arguments are the ones of :func:`cmd`, ``input`` is written to stdin without blocking while the output is read.
+    A failure (returncode != 0) raises ``subprocess.CalledProcessError`` at the end of the iteration if ``fail`` is set.
+    The lines are framed by any of the ``separators``, see :class:`AsyncProcess`.
+
+    **Example usage**
+
+    >>> process = cmd_async([u'sh', u'-c', u'echo a; echo b >&2; printf c'])
+    >>> for line in process.stdout_lines():
+    ...     print(line.decode(u'utf-8').strip())
+    a
+    c
+    >>> print([line.decode(u'utf-8') for line in process.stderr_lines()] == [u'b\\n'], process.returncode)
+    True 0
+    >>> print(b''.join(cmd_async(u'cat', input=u'pipe this\\n').stdout_lines()).decode(u'utf-8').strip())
+    pipe this
+    >>> process = cmd_async([u'printf', u'a\\rb\\r\\nc\\n'], separators=(b'\\n', b'\\r'))
+    >>> print([line.decode(u'utf-8').strip() for line in process.stdout_lines()])
+    [u'a', u'b', u'c']
+
+    Failures and cancellation:
+
+    >>> list(cmd_async(u'false').lines())
+    Traceback (most recent call last):
+        ...
+    CalledProcessError: Command 'false' returned non-zero exit status 1
+    >>> process = cmd_async(u'sleep 5')
+    >>> process.cancel()
+    >>> print(list(process.lines()), process.returncode)
+    [] -9
+    """
+    result = cmd(command, cli_input=cli_input, fail=fail, log=log, communicate=False, **kwargs)
+    return AsyncProcess(result[u'process'], _args(command)[1], input=input, fail=fail, log=log, separators=separators)
+
+
+def iter_lines(processes, names=AsyncProcess.NAMES, timeout=None, chunk_size=4096):
+    u"""
+    Supervise many :class:`AsyncProcess` from a single thread and yield a tuple (process, name, line) for each line
+    of the streams listed in ``names`` as soon as it is available.
+
+    Processes are killed if nothing happened during ``timeout`` seconds (and then raise if they must ``fail``).
+
+    **Example usage**
+
+    >>> processes = [cmd_async([u'sh', u'-c', u'sleep 0.{0}; echo {0}'.format(i)]) for i in (3, 1, 2)]
+    >>> for process, name, line in iter_lines(processes):
+    ...     print(name, line.decode(u'utf-8').strip())
+    stdout 1
+    stdout 2
+    stdout 3
+    >>> list(iter_lines([cmd_async(u'sleep 5')], timeout=0.1))
+    Traceback (most recent call last):
+        ...
+    CalledProcessError: Command 'sleep 5' returned non-zero exit status -9
+    """
+    processes = list(processes)
+    poller, owners, counts = select.poll(), {}, dict((process, 0) for process in processes)
+    for process in processes:
+        for fd, events in process._events():
+            poller.register(fd, events)
+            owners[fd] = process
+            counts[process] += 1
+    while True:
+        for process in processes:
+            for name in names:
+                lines = process._lines.get(name)
+                while lines:
+                    yield process, name, lines.popleft()
+        # Processes without any open pipe
+        for process in processes:
+            if not process.finished and not counts[process]:
+                process._finish()
+        if not owners:
+            break
+        events = poller.poll(None if timeout is None else timeout * 1000)
+        if not events:
+            for process in set(owners.values()):
+                kill(process.process)
+        for fd, event in events:
+            process = owners[fd]
+            if process._handle(fd, chunk_size):
+                poller.unregister(fd)
+                del owners[fd]
+                counts[process] -= 1
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 def make(archive, with_cmake=False, configure_options=u'', make_options=u'-j{0}'.format(multiprocessing.cpu_count()),
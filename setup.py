@@ -61,8 +61,8 @@ Operating System :: Unix
 """
 
 keywords = [
-    'celery', 'ffmpeg', 'django', 'flask', 'json', 'juju', 'mock', 'mongodb', 'rsync', 'rtp', 'smpte 2022-1', 'screen',
-    'subprocess'
+    'celery', 'ffmpeg', 'django', 'flask', 'json', 'juju', 'mock', 'mongodb', 'rsync', 'rtp', 'smpte 2022-1',
+    'smpte 2022-7', 'screen', 'subprocess'
 ]
 
 install_requires = [
@@ -78,10 +78,12 @@ install_requires = [
 ]
 
 extras_require = {
-    'django':    ['django'],  # FIXME version
-    'flask':     ['flask'],   # FIXME version
-    'mongo':     ['celery'],  # FIXME version
-    'smpte2022': ['fastxor', 'twisted'],  # FIXME version
+    'django':        ['django'],  # FIXME version
+    'filesystem':    ['pyinotify', 'scandir'],  # FIXME version
+    'flask':         ['flask'],   # FIXME version
+    'mongo':         ['celery'],  # FIXME version
+    'serialization': ['lz4', 'msgpack', 'zstandard'],  # FIXME version
+    'smpte2022':     ['fastxor', 'twisted'],  # FIXME version
 }
 
 # Why not installing following packages for python 3 ?
@@ -24,14 +24,14 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import math, os
+import json, math, os, time
 from nose.tools import assert_equal, assert_raises, raises
 from pytoolbox.collections import pygal_deque
 from pytoolbox.encoding import csv_reader
 from pytoolbox.filesystem import try_remove
 from pytoolbox.unittest import mock_cmd
-from pytoolbox.serialization import PickleableObject
-from pytoolbox.subprocess import cmd, screen_launch, screen_list, screen_kill
+from pytoolbox.serialization import PickleableObject, object2json
+from pytoolbox.subprocess import cmd, cmd_many, OutputCapture, screen_launch, screen_list, screen_kill
 from pytoolbox.validation import validate_list
 
 here = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
@@ -63,6 +63,30 @@ class TestPyutils(object):
         # There are at least 30 lines in this source file !
         assert(len(result[u'stdout'].splitlines()) > 30)
 
+    def test_cmd_many(self):
+        start_time = time.time()
+        results = dict(cmd_many([[u'sleep', u'0.3']] * 8, workers=8))
+        # The commands are executed in parallel: fan-out takes as long as the slowest command
+        assert(time.time() - start_time < 1.2)
+        assert_equal(sorted(results.keys()), list(range(8)))
+        assert_equal(set(r[u'returncode'] for r in results.values()), set([0]))
+
+    def test_cmd_many_input(self):
+        # The input is piped to every command, as with cmd
+        results = dict(cmd_many([[u'cat'], [u'cat']], workers=2, input=u'hello'))
+        assert_equal([results[i][u'stdout'] for i in range(2)], [b'hello', b'hello'])
+        result = dict(cmd_many([[u'cat']], workers=1, input=u'hello', capture=OutputCapture))[0]
+        assert_equal(result[u'captures'][u'stdout'].value, b'hello')
+
+    def test_cmd_many_error(self):
+        # An exception raised by a worker is raised again by the generator instead of blocking it forever
+        assert_raises(TypeError, list, cmd_many([u'true'], workers=1, stdout=1))
+
+        def log(result):
+            if isinstance(result, dict):
+                raise RuntimeError(u'log failed')
+        assert_raises(RuntimeError, list, cmd_many([u'true', u'true'], workers=2, log=log))
+
     def test_screen(self):
         try:
             # Launch some screens
@@ -114,6 +138,17 @@ class TestPyutils(object):
         os.remove(u'test3.pkl')
         assert_raises(IOError, MyPoint.read, u'test3.pkl')
 
+    def test_object2json_fast(self):
+        # Serialized by orjson or ujson if installed, else by json, the output is the same
+        p1 = MyPoint(name=u'Café', x=3, y=-4)
+        assert_equal(json.loads(object2json(p1, include_properties=True, fast=True)),
+                     {u'name': u'Café', u'x': 3, u'y': -4, u'length': 5.0})
+        assert_equal(object2json([u'Café', {u'a': None, 1: [True]}, 2.5, u'/'], include_properties=False, fast=True),
+                     json.dumps([u'Café', {u'a': None, 1: [True]}, 2.5, u'/'], ensure_ascii=False,
+                                separators=(u',', u':')))
+        assert_equal(object2json({u'big': 2**70}, include_properties=False, fast=True),
+                     u'{"big":1180591620717411303424}')
+
     def test_csv_reader(self):
         values, i = [(u'David', u'Vélo'), (u'Michaël', u'Tennis de table'), (u'Loïc', u'Piano')], 0
         for name, hobby in csv_reader(os.path.join(here, u'unicode.csv')):